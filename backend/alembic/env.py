@@ -0,0 +1,69 @@
+"""
+Environnement Alembic : migrations exécutées avec le moteur asynchrone de
+l'application (asyncpg / aiosqlite), sur la base de DATABASE_URL.
+"""
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.pool import NullPool
+
+from app.core.config import settings
+from app.core.database import Base, create_engine_for_url
+import app.models  # noqa: F401 (enregistre les tables dans Base.metadata)
+from app.models.message import include_in_autogenerate
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("configure_logging", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def database_url() -> str:
+    # Une connexion peut être fournie par l'appelant (tests, prepare_database)
+    return config.attributes.get("database_url") or settings.database_url
+
+def run_migrations_offline() -> None:
+    """Génère le SQL sans se connecter (alembic upgrade head --sql)."""
+    context.configure(
+        url=database_url(),
+        target_metadata=target_metadata,
+        include_name=include_in_autogenerate,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def do_run_migrations(connection) -> None:
+    if connection.dialect.name == "sqlite":
+        # Une copie de table (batch) supprime l'ancienne table : avec les clés
+        # étrangères actives, la cascade viderait les tables qui en dépendent.
+        # (Sans effet dans une transaction : désactivé avant d'en ouvrir une.)
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        connection.commit()
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_name=include_in_autogenerate,
+        # SQLite ne sait pas modifier une colonne : ALTER via copie de table
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+async def run_async_migrations() -> None:
+    engine = create_engine_for_url(database_url(), poolclass=NullPool)
+    try:
+        async with engine.connect() as connection:
+            await connection.run_sync(do_run_migrations)
+    finally:
+        await engine.dispose()
+
+def run_migrations_online() -> None:
+    asyncio.run(run_async_migrations())
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
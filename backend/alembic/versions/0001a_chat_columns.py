@@ -0,0 +1,55 @@
+"""Colonnes et index ajoutés au schéma initial
+
+- conversations : résumé glissant (summary, summary_message_id), index
+  composite (user_id, created_at, id) pour la pagination ;
+- messages : token_count, idempotency_key (unique), index composite
+  (conversation_id, created_at, id) pour la lecture des derniers messages.
+Les index simples qu'ils remplacent sont supprimés.
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2024-03-15 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0001a"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.add_column(sa.Column("summary", sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column("summary_message_id", sa.Integer(), nullable=True))
+        batch_op.drop_index("ix_conversations_user_id")
+        batch_op.create_index("ix_conversations_user_id_created_at_id", ["user_id", "created_at", "id"])
+
+    with op.batch_alter_table("messages") as batch_op:
+        batch_op.add_column(sa.Column("token_count", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("idempotency_key", sa.String(255), nullable=True))
+        # Nom par défaut de PostgreSQL, attendu par la révision 0002
+        batch_op.create_unique_constraint("messages_idempotency_key_key", ["idempotency_key"])
+        batch_op.drop_index("ix_messages_conversation_id")
+        batch_op.drop_index("ix_messages_created_at")
+        batch_op.create_index("ix_messages_conversation_id_created_at_id", ["conversation_id", "created_at", "id"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("messages") as batch_op:
+        batch_op.drop_index("ix_messages_conversation_id_created_at_id")
+        batch_op.create_index("ix_messages_created_at", ["created_at"])
+        batch_op.create_index("ix_messages_conversation_id", ["conversation_id"])
+        batch_op.drop_constraint("messages_idempotency_key_key", type_="unique")
+        batch_op.drop_column("idempotency_key")
+        batch_op.drop_column("token_count")
+
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.drop_index("ix_conversations_user_id_created_at_id")
+        batch_op.create_index("ix_conversations_user_id", ["user_id"])
+        batch_op.drop_column("summary_message_id")
+        batch_op.drop_column("summary")
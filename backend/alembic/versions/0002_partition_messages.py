@@ -0,0 +1,155 @@
+"""Partitionnement mensuel de messages (PostgreSQL)
+
+La table messages devient partitionnée par mois sur created_at
+(messages_pYYYYMM, plus une partition par défaut). Chaque partition a ses
+propres index : les index de la période active restent petits quand
+l'historique grossit, et une période archivée se supprime par DROP TABLE
+(voir app/services/retention.py).
+
+PostgreSQL n'accepte une contrainte d'unicité sur une table partitionnée que
+si elle inclut la clé de partition : l'unicité de idempotency_key est reportée
+sur la table message_idempotency_keys, alimentée par un trigger. Un doublon
+lève toujours une erreur d'intégrité à l'INSERT du message.
+
+Sans effet sur SQLite (tests, développement).
+
+Revision ID: 0002
+Revises: 0001a
+Create Date: 2024-04-01 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions créées à l'avance au-delà du mois courant (ensuite : job de rétention)
+MONTHS_AHEAD = 3
+
+COLUMNS = "id, conversation_id, content, is_bot, token_count, idempotency_key, created_at"
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_unpartitioned_pkey")
+    op.execute("ALTER INDEX messages_idempotency_key_key RENAME TO messages_unpartitioned_idempotency_key_key")
+    op.execute("ALTER INDEX ix_messages_id RENAME TO ix_messages_unpartitioned_id")
+    op.execute(
+        "ALTER INDEX ix_messages_conversation_id_created_at_id "
+        "RENAME TO ix_messages_unpartitioned_conversation_id_created_at_id"
+    )
+
+    op.execute("""
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+            conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+            content TEXT NOT NULL,
+            is_bot BOOLEAN NOT NULL,
+            token_count INTEGER,
+            idempotency_key VARCHAR(255),
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    # Index déclarés sur la table mère : créés sur chaque partition
+    op.execute("CREATE INDEX ix_messages_id ON messages (id)")
+    op.execute(
+        "CREATE INDEX ix_messages_conversation_id_created_at_id "
+        "ON messages (conversation_id, created_at, id)"
+    )
+    op.execute(
+        "CREATE INDEX ix_messages_idempotency_key ON messages (idempotency_key) "
+        "WHERE idempotency_key IS NOT NULL"
+    )
+
+    # Partitions mensuelles du plus ancien message jusqu'à MONTHS_AHEAD mois après
+    # le mois courant ; la partition par défaut reçoit ce qui sort de ces bornes.
+    op.execute(f"""
+        DO $$
+        DECLARE
+            month TIMESTAMP := date_trunc('month', coalesce(
+                (SELECT min(created_at) FROM messages_unpartitioned), now()
+            ) AT TIME ZONE 'UTC');
+            last_month TIMESTAMP := date_trunc('month', now() AT TIME ZONE 'UTC')
+                + interval '{MONTHS_AHEAD} months';
+        BEGIN
+            WHILE month <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    'messages_p' || to_char(month, 'YYYYMM'),
+                    month AT TIME ZONE 'UTC',
+                    (month + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                month := month + interval '1 month';
+            END LOOP;
+        END $$
+    """)
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    op.execute("""
+        CREATE TABLE message_idempotency_keys (
+            idempotency_key VARCHAR(255) PRIMARY KEY,
+            conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE
+        )
+    """)
+    op.execute("""
+        CREATE FUNCTION messages_claim_idempotency_key() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO message_idempotency_keys (idempotency_key, conversation_id)
+            VALUES (NEW.idempotency_key, NEW.conversation_id);
+            RETURN NULL;
+        END $$
+    """)
+    op.execute("""
+        CREATE TRIGGER messages_idempotency_key
+        AFTER INSERT ON messages
+        FOR EACH ROW WHEN (NEW.idempotency_key IS NOT NULL)
+        EXECUTE FUNCTION messages_claim_idempotency_key()
+    """)
+
+    op.execute(f"INSERT INTO messages ({COLUMNS}) SELECT {COLUMNS} FROM messages_unpartitioned")
+    # La séquence des id appartenait à l'ancienne table : elle ne doit pas être supprimée avec elle
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("DROP TABLE messages_unpartitioned")
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_partitioned_pkey")
+    op.execute("ALTER INDEX ix_messages_id RENAME TO ix_messages_partitioned_id")
+    op.execute(
+        "ALTER INDEX ix_messages_conversation_id_created_at_id "
+        "RENAME TO ix_messages_partitioned_conversation_id_created_at_id"
+    )
+    op.execute("""
+        CREATE TABLE messages (
+            id INTEGER NOT NULL DEFAULT nextval('messages_id_seq') PRIMARY KEY,
+            conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+            content TEXT NOT NULL,
+            is_bot BOOLEAN NOT NULL,
+            token_count INTEGER,
+            idempotency_key VARCHAR(255) UNIQUE,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+    """)
+    op.execute("CREATE INDEX ix_messages_id ON messages (id)")
+    op.execute(
+        "CREATE INDEX ix_messages_conversation_id_created_at_id "
+        "ON messages (conversation_id, created_at, id)"
+    )
+    op.execute(f"INSERT INTO messages ({COLUMNS}) SELECT {COLUMNS} FROM messages_partitioned")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    # Supprime aussi toutes les partitions
+    op.execute("DROP TABLE messages_partitioned")
+    op.execute("DROP TABLE message_idempotency_keys")
+    op.execute("DROP FUNCTION messages_claim_idempotency_key()")
@@ -0,0 +1,67 @@
+"""Index plein texte des messages
+
+PostgreSQL : colonne tsvector générée (configuration 'french') et index GIN,
+créés sur la table mère partitionnée donc sur chaque partition.
+SQLite : table FTS5 (texte et propriétaire du message) tenue à jour par
+triggers, remplie à partir des messages existants.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-05-01 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    dialect = op.get_context().dialect.name
+    if dialect == "postgresql":
+        op.execute(
+            "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('french', content)) STORED"
+        )
+        op.execute("CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)")
+    elif dialect == "sqlite":
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            "content, owner, tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+            "INSERT INTO messages_fts (rowid, content, owner) VALUES (new.id, new.content, "
+            "(SELECT 'u' || user_id FROM conversations WHERE id = new.conversation_id)); END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+            "DELETE FROM messages_fts WHERE rowid = old.id; END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+            "UPDATE messages_fts SET content = new.content WHERE rowid = new.id; END"
+        )
+        # Indexe les messages déjà présents (base créée sans l'index par l'ancien create_all)
+        op.execute("DELETE FROM messages_fts")
+        op.execute(
+            "INSERT INTO messages_fts (rowid, content, owner) "
+            "SELECT messages.id, messages.content, 'u' || conversations.user_id "
+            "FROM messages JOIN conversations ON conversations.id = messages.conversation_id"
+        )
+
+
+def downgrade() -> None:
+    dialect = op.get_context().dialect.name
+    if dialect == "postgresql":
+        op.execute("DROP INDEX ix_messages_search_vector")
+        op.execute("ALTER TABLE messages DROP COLUMN search_vector")
+    elif dialect == "sqlite":
+        op.execute("DROP TRIGGER messages_fts_update")
+        op.execute("DROP TRIGGER messages_fts_delete")
+        op.execute("DROP TRIGGER messages_fts_insert")
+        op.execute("DROP TABLE messages_fts")
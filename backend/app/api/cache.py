@@ -0,0 +1,52 @@
+"""
+Routes API des caches : statistiques et invalidation du cache de réponses,
+statistiques du cache d'historique.
+"""
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from app.services.history_cache import HistoryCache, get_history_cache
+from app.services.response_cache import ResponseCache, get_response_cache
+
+router = APIRouter()
+
+def require_cache(response_cache: Optional[ResponseCache] = Depends(get_response_cache)) -> ResponseCache:
+    if response_cache is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Le cache de réponses est désactivé (RESPONSE_CACHE_ENABLED=False)."
+        )
+    return response_cache
+
+@router.get("/cache/stats")
+async def cache_stats(response_cache: ResponseCache = Depends(require_cache)):
+    """Compteurs du cache : entrées, hits, misses, évictions, taux de hit."""
+    return response_cache.stats()
+
+@router.delete("/cache")
+async def invalidate_cache(
+    question: Optional[str] = Query(None, description="Question à invalider. Sans paramètre, tout le cache est vidé."),
+    response_cache: ResponseCache = Depends(require_cache)
+):
+    if question is None:
+        response_cache.clear()
+        return {"cleared": True}
+
+    if not response_cache.invalidate(question):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Aucune réponse en cache pour cette question."
+        )
+    return {"invalidated": question}
+
+@router.get("/cache/history/stats")
+async def history_cache_stats(history_cache: Optional[HistoryCache] = Depends(get_history_cache)):
+    """Cache d'historique : taux de hit, conversations en cache, mémoire utilisée (estimée)."""
+    if history_cache is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Le cache d'historique est désactivé (HISTORY_CACHE_ENABLED=False)."
+        )
+    return history_cache.stats()
@@ -3,48 +3,226 @@ Routes API du chat.
 C'est ici que les requêtes HTTP arrivent et sont traitées.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import json
+import math
+from typing import Optional
+from contextlib import aclosing
+from datetime import datetime, timezone
+
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
-from app.schemas.chat import ChatRequest, ChatResponse
-from app.services.chatbot_service import ChatbotService
+from app.core.pagination import Cursor, decode_cursor, page_cursors
+from app.repositories.conversation_repository import ConversationRepository
+from app.schemas.chat import ChatRequest, ChatResponse, ConversationItemSchema, ConversationPage, MessagePage
+from app.services.chatbot_service import ChatbotService, ChatResult, TurnInProgressError
+from app.services.langchain_service import LangChainService, get_langchain_service
+from app.services.history_cache import HistoryCache, get_history_cache
+from app.services.llm_resilience import LLMUnavailableError
+from app.services.message_writer import MessageWriter, get_message_writer
+from app.services.rate_limiter import RateLimitExceeded, UserRateLimiter, get_user_rate_limiter
+from app.services.response_cache import ResponseCache, get_response_cache
+from app.services.single_flight import SingleFlight, get_single_flight
+from app.services.summary_service import ConversationSummarizer, get_summarizer
 
 router = APIRouter()
 
+# En-tête optionnel : un nouvel essai avec la même clé renvoie la réponse déjà enregistrée
+IdempotencyKey = Header(
+    None,
+    alias="Idempotency-Key",
+    max_length=255,
+    description="Identifiant unique de la requête (UUID) : un nouvel essai renvoie la réponse enregistrée."
+)
+REPLAYED_HEADER = "Idempotent-Replayed"
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    db: Session = Depends(get_db)
+    response: Response,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    db: AsyncSession = Depends(get_db),
+    langchain_service: LangChainService = Depends(get_langchain_service),
+    summarizer: ConversationSummarizer = Depends(get_summarizer),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    rate_limiter: Optional[UserRateLimiter] = Depends(get_user_rate_limiter),
+    single_flight: Optional[SingleFlight] = Depends(get_single_flight),
+    message_writer: Optional[MessageWriter] = Depends(get_message_writer),
+    history_cache: Optional[HistoryCache] = Depends(get_history_cache)
 ):
+    # Limite par utilisateur : attend son tour, ou 429 + Retry-After
+    if rate_limiter is not None:
+        await rate_limiter.acquire(request.user_id)
+
     try:
-        service = ChatbotService(db)
+        service = ChatbotService(db, langchain_service, response_cache, single_flight, message_writer, history_cache)
         
-        bot_response, conversation_id = await service.process_message(
+        result = await service.process_message(
             user_id=request.user_id,
             message=request.message,
-            conversation_id=request.conversation_id
+            conversation_id=request.conversation_id,
+            idempotency_key=idempotency_key
         )
         
+        if result.replayed:
+            response.headers[REPLAYED_HEADER] = "true"
+        else:
+            # Résumé glissant mis à jour après l'envoi de la réponse
+            background_tasks.add_task(summarizer.update_if_needed, result.conversation_id)
+        
         return ChatResponse(
-            bot_response=bot_response,
-            conversation_id=conversation_id
+            response=result.response,
+            conversation_id=result.conversation_id,
+            prompt_tokens=result.prompt_tokens,
+            completion_tokens=result.completion_tokens,
+            cached=result.cached
         )
         
+    except (RateLimitExceeded, LLMUnavailableError, TurnInProgressError):
+        raise
     except Exception as e:
         print(f"❌ Erreur /api/chat : {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Une erreur est survenue lors du traitement du message: {str(e)}"
         )
+def sse_event(event: str, data: dict) -> str:
+    """Formate un événement Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Désactive le buffering des proxys (nginx)
+}
+
+async def replay_stream(result: ChatResult):
+    """Rejoue en SSE une réponse déjà enregistrée (même clé d'idempotence)."""
+    yield sse_event("start", {"conversation_id": result.conversation_id})
+    yield sse_event("token", {"token": result.response})
+    yield sse_event("end", {
+        "conversation_id": result.conversation_id,
+        "prompt_tokens": result.prompt_tokens,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    })
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = IdempotencyKey,
+    db: AsyncSession = Depends(get_db),
+    langchain_service: LangChainService = Depends(get_langchain_service),
+    summarizer: ConversationSummarizer = Depends(get_summarizer),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    rate_limiter: Optional[UserRateLimiter] = Depends(get_user_rate_limiter),
+    message_writer: Optional[MessageWriter] = Depends(get_message_writer),
+    history_cache: Optional[HistoryCache] = Depends(get_history_cache)
+):
+    """
+    Variante streaming de /chat : la réponse est envoyée token par token (SSE).
+
+    Événements : "start" (conversation_id), "token" (texte), "end" (réponse
+    sauvegardée) ou "error". Si le client se déconnecte, Starlette annule le
+    générateur : l'appel au modèle est fermé et la réponse n'est pas sauvegardée.
+
+    La limite par utilisateur est vérifiée avant le flux (429 + Retry-After) ;
+    si le modèle est saturé ou indisponible pendant le flux, l'événement "error"
+    porte retry_after.
+
+    Avec une clé d'idempotence déjà utilisée, la réponse enregistrée est rejouée
+    en un seul événement "token" ; si seul le message utilisateur avait été
+    enregistré (flux interrompu par une erreur), la réponse est générée dans
+    sa conversation, sans nouveau message utilisateur. Les flux ne passent pas par le single-flight :
+    chaque client reçoit ses propres tokens.
+    """
+    if rate_limiter is not None:
+        await rate_limiter.acquire(request.user_id)
+
+    try:
+        service = ChatbotService(
+            db, langchain_service, response_cache,
+            message_writer=message_writer, history_cache=history_cache
+        )
+        question, stored = await service.find_turn(idempotency_key) if idempotency_key else (None, None)
+        if stored is None:
+            try:
+                conversation_id, context = await service.start_turn(
+                    user_id=request.user_id,
+                    message=request.message,
+                    conversation_id=request.conversation_id,
+                    idempotency_key=idempotency_key,
+                    question=question
+                )
+            except IntegrityError:
+                # Même clé envoyée en parallèle : rien n'a été enregistré pour cet envoi
+                if not idempotency_key:
+                    raise
+                stored = await service.resolve_duplicate(idempotency_key)
+        if stored is not None:
+            return StreamingResponse(
+                replay_stream(stored),
+                media_type="text/event-stream",
+                headers={**SSE_HEADERS, REPLAYED_HEADER: "true"},
+            )
+    except TurnInProgressError:
+        raise
+    except Exception as e:
+        print(f"❌ Erreur /api/chat/stream : {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Une erreur est survenue lors du traitement du message: {str(e)}"
+        )
+
+    # Note : la session de get_db est déjà fermée quand le flux démarre ; une
+    # AsyncSession fermée reste réutilisable, on la referme donc nous-mêmes à la fin.
+    async def event_stream():
+        yield sse_event("start", {"conversation_id": conversation_id})
+        try:
+            reply = service.stream_reply(conversation_id, request.message, context, idempotency_key)
+            async with aclosing(reply) as tokens:
+                async for token in tokens:
+                    yield sse_event("token", {"token": token})
+        except (RateLimitExceeded, LLMUnavailableError) as e:
+            yield sse_event("error", {"detail": e.detail, "retry_after": math.ceil(e.retry_after)})
+            return
+        except Exception as e:
+            print(f"❌ Erreur /api/chat/stream : {e}")
+            yield sse_event("error", {"detail": f"Une erreur est survenue lors de la génération: {str(e)}"})
+            return
+        finally:
+            # Protégé de l'annulation (déconnexion du client) pour rendre la connexion au pool.
+            with anyio.CancelScope(shield=True):
+                await db.close()
+        yield sse_event("end", {
+            "conversation_id": conversation_id,
+            "prompt_tokens": context.prompt_tokens,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        })
+
+    # Exécuté après la fin du flux (et donc après la sauvegarde de la réponse)
+    background_tasks.add_task(summarizer.update_if_needed, conversation_id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
 @router.get("/conversations/{conversation_id}")       
 async def get_conversation(
     conversation_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    message_writer: Optional[MessageWriter] = Depends(get_message_writer),
+    history_cache: Optional[HistoryCache] = Depends(get_history_cache)
 ):
     try:
-        service  = ChatbotService(db)
-        messages = service.get_conversation_messages(conversation_id)
+        service  = ChatbotService(db, message_writer=message_writer, history_cache=history_cache)
+        messages = await service.get_conversation_messages(conversation_id)
         
         if not messages:
             raise HTTPException(
@@ -62,4 +240,75 @@ async def get_conversation(
         raise HTTPException(
             status_code=e.status_code,
             detail=str(e)
-        )
\ No newline at end of file
+        )
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+@router.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def list_conversation_messages(
+    conversation_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Curseur older_cursor / newer_cursor d'une page précédente."),
+    db: AsyncSession = Depends(get_db),
+    message_writer: Optional[MessageWriter] = Depends(get_message_writer)
+):
+    """
+    Messages d'une conversation, paginés par curseur.
+    Sans curseur : les messages les plus récents (bas de la conversation).
+    """
+    position = parse_cursor(cursor)
+    if message_writer is not None:
+        await message_writer.wait_for(conversation_id)
+    repository = ConversationRepository(db)
+    messages, has_more = await repository.get_messages_page(conversation_id, limit, position)
+
+    if not messages and await repository.get_conversation(conversation_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Conversation {conversation_id} non trouvée."
+        )
+
+    older_cursor, newer_cursor = page_cursors(messages, has_more, position)
+    return MessagePage(items=messages, older_cursor=older_cursor, newer_cursor=newer_cursor)
+
+@router.get("/users/{user_id}/conversations", response_model=ConversationPage)
+async def list_user_conversations(
+    user_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Curseur older_cursor / newer_cursor d'une page précédente."),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Conversations d'un utilisateur, les plus récentes en premier, paginées par curseur.
+
+    Chaque conversation est accompagnée de son dernier message : 2 requêtes au
+    total, quelle que soit la taille de la page.
+    """
+    position = parse_cursor(cursor)
+    repository = ConversationRepository(db)
+    conversations, has_more = await repository.get_user_conversations_page(user_id, limit, position)
+    last_messages = await repository.get_last_messages([c.id for c in conversations])
+
+    older_cursor, newer_cursor = page_cursors(conversations, has_more, position)
+    return ConversationPage(
+        items=[
+            ConversationItemSchema(
+                id=c.id,
+                user_id=c.user_id,
+                created_at=c.created_at,
+                last_message=last_messages.get(c.id)
+            )
+            for c in reversed(conversations)
+        ],
+        older_cursor=older_cursor,
+        newer_cursor=newer_cursor
+    )
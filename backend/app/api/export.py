@@ -0,0 +1,48 @@
+"""
+Route API d'export en masse des conversations (NDJSON en flux).
+"""
+
+from datetime import datetime
+from typing import Optional
+
+import anyio
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_db
+from app.services.conversation_export import export_criteria, export_ndjson
+
+router = APIRouter()
+
+@router.get("/export/conversations")
+async def export_conversations(
+    user_id: Optional[int] = Query(None, description="Conversations de cet utilisateur uniquement."),
+    since: Optional[datetime] = Query(None, description="Conversations créées à partir de cette date (ISO 8601)."),
+    until: Optional[datetime] = Query(None, description="Conversations créées avant cette date (ISO 8601)."),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Exporte les conversations (toutes, d'un utilisateur et/ou d'une période)
+    avec tous leurs messages : une conversation JSON par ligne (NDJSON).
+
+    Le flux est lu en base par un curseur côté serveur : la mémoire utilisée
+    ne dépend pas du volume exporté. La connexion reste empruntée au pool
+    pendant toute la durée du téléchargement.
+    """
+    # La session de get_db est déjà fermée quand le flux démarre : une
+    # AsyncSession fermée reste réutilisable, on la referme donc nous-mêmes à la fin.
+    async def ndjson_stream():
+        try:
+            async for line in export_ndjson(db, *export_criteria(user_id, since, until)):
+                yield line
+        finally:
+            # Protégé de l'annulation (déconnexion du client) pour rendre la connexion au pool.
+            with anyio.CancelScope(shield=True):
+                await db.close()
+
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'},
+    )
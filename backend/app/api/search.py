@@ -0,0 +1,33 @@
+"""
+Route API de recherche plein texte dans l'historique des conversations.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_db
+from app.repositories.message_search import MessageSearchRepository
+from app.schemas.chat import SearchResults
+
+router = APIRouter()
+
+@router.get("/users/{user_id}/messages/search", response_model=SearchResults)
+async def search_messages(
+    user_id: int,
+    q: str = Query(..., min_length=1, max_length=200, description="Mots recherchés, ex. : hôtel Lyon."),
+    limit: int = Query(20, ge=1, le=100),
+    since: Optional[datetime] = Query(None, description="Messages envoyés à partir de cette date (ISO 8601)."),
+    until: Optional[datetime] = Query(None, description="Messages envoyés avant cette date (ISO 8601)."),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Recherche dans les messages de toutes les conversations d'un utilisateur.
+
+    Une seule requête servie par l'index plein texte (GIN sur PostgreSQL,
+    FTS5 sur SQLite) : les messages ne sont pas chargés pour être parcourus.
+    """
+    hits = await MessageSearchRepository(db).search(user_id, q, limit, since, until)
+    return SearchResults(query=q, hits=hits)
@@ -1,3 +1,6 @@
+from functools import lru_cache
+from typing import Any, Optional
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -5,10 +8,83 @@ class Settings(BaseSettings):
     debug: bool = False
     host: str = "0.0.0.0"
     port: int = 8000
+    # Production (python -m app.server) : 0 = un worker par cœur
+    web_workers: int = 0
+    # Drain à l'arrêt : au-delà de la durée max d'un appel au modèle (llm_total_timeout_seconds)
+    web_graceful_timeout_seconds: int = 75
+    web_keepalive_seconds: int = 5
+    web_max_requests: int = 0
     database_url: str
+    # Pool de connexions (PostgreSQL) : les connexions ne sont plus tenues
+    # pendant l'appel au modèle, un petit pool suffit pour beaucoup de chats.
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout_seconds: float = 30.0
     openai_api_key: str
     openai_model: str = "gpt-3.5-turbo"
     openai_temperature: float = 0.7
+    openai_fallback_model: Optional[str] = None  # ex: "gpt-3.5-turbo", utilisé si le modèle principal échoue
+    llm_timeout_seconds: float = 30.0
+    llm_total_timeout_seconds: float = 60.0
+    llm_max_retries: int = 2
+    llm_retry_base_delay_seconds: float = 0.5
+    llm_retry_max_delay_seconds: float = 8.0
+    llm_hedging_enabled: bool = False
+    llm_hedge_after_seconds: float = 5.0  # seuil initial, remplacé par le p95 observé
+    circuit_breaker_failure_threshold: int = 5
+    circuit_breaker_reset_seconds: float = 30.0
+    openai_max_connections: int = 100
+    openai_keepalive_expiry: float = 30.0
+    llm_backend: str = "openai"  # "openai" ou "fake" (faux modèle local, tests de charge)
+    fake_llm_latency_seconds: float = 0.5
+    fake_llm_tokens_per_second: float = 50.0
+    fake_llm_completion_tokens: int = 60
+    fake_llm_error_rate: float = 0.0
+    fake_llm_seed: int = 42
+    context_token_budget: int = 3000
+    context_max_messages: int = 50
+    summary_enabled: bool = True
+    summary_every_messages: int = 10
+    response_cache_enabled: bool = False
+    response_cache_max_entries: int = 1000
+    response_cache_ttl_seconds: int = 3600
+    response_cache_semantic: bool = False
+    response_cache_similarity_threshold: float = 0.95
+    response_cache_embed_timeout_seconds: float = 2.0
+    openai_embedding_model: str = "text-embedding-3-small"
+    rate_limit_enabled: bool = True
+    rate_limit_per_minute: float = 20.0
+    rate_limit_burst: int = 5
+    rate_limit_max_wait_seconds: float = 2.0
+    rate_limit_store_url: Optional[str] = None
+    llm_max_concurrency: int = 20
+    llm_queue_timeout_seconds: float = 5.0
+    metrics_enabled: bool = True
+    history_cache_enabled: bool = True
+    history_cache_window: int = 50
+    history_cache_max_bytes: int = 64 * 1024 * 1024
+    history_cache_ttl_seconds: float = 600.0
+    history_cache_url: Optional[str] = None
+    write_behind_enabled: bool = False
+    write_behind_batch_size: int = 200
+    write_behind_max_pending: int = 1000
+    retention_days: int = 365
+    retention_archive_dir: str = "archives"
+    retention_batch_size: int = 500
+    partition_months_ahead: int = 3
+    embedding_backend: str = "hashing"  # "hashing", "sentence-transformers" (modèle local) ou "stub" (tests)
+    embedding_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    embedding_dim: int = 384
+    embedding_store_enabled: bool = False
+    embedding_store_path: str = "data/embeddings"
+    embedding_batch_size: int = 256
+    embedding_interval_seconds: float = 5.0
+    embedding_rescan_ids: int = 10_000
+    knowledge_base_enabled: bool = False
+    knowledge_base_path: str = "data/knowledge_base"
+    knowledge_base_top_k: int = 4
+    knowledge_base_min_score: float = 0.25
+    knowledge_base_max_tokens: int = 400
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
@@ -19,7 +95,21 @@ class Settings(BaseSettings):
         "case_sensitive": False
     }
 
-settings = Settings()
-
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
-    return settings
\ No newline at end of file
+    """Configuration lue (environnement, .env) et validée au premier appel, puis partagée."""
+    return Settings()
+
+class LazySettings:
+    """
+    Accès à la configuration sans la lire à l'import : `settings.x` construit
+    Settings au premier attribut demandé (get_settings), puis lui délègue.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(get_settings(), name, value)
+
+settings: Settings = LazySettings()  # type: ignore[assignment]
\ No newline at end of file
@@ -1,49 +1,185 @@
-from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import event, select
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncGenerator, Optional
+import asyncio
+import time
 
 from app.core.config import settings
+from app.core.metrics import DB_POOL_CHECKED_OUT, DB_POOL_CHECKOUT_SECONDS
 
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping= True,
-    pool_size = 10,
-    max_overflow=20,
-    echo=settings.debug,
-)
+# Drivers asynchrones utilisés à la place des drivers synchrones de l'URL
+# (asyncpg pour PostgreSQL, aiosqlite pour SQLite en tests/dev).
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
 
-SessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine
-)
+def to_async_url(database_url: str) -> URL:
+    """Convertit une URL de base de données synchrone en URL asynchrone."""
+    url = make_url(database_url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername)
+
+def timed_pool_class(pool_class):
+    """
+    Sous-classe du pool qui mesure l'attente d'une connexion (histogramme
+    travelbot_db_pool_checkout_wait_seconds). Une attente qui grimpe signifie
+    que le pool est trop petit pour la charge.
+    """
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            finally:
+                DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+            # Compté ici plutôt que lu dans pool.checkedout() : la valeur est
+            # ainsi agrégée entre workers (mode multiprocessus de Prometheus).
+            DB_POOL_CHECKED_OUT.inc()
+            return connection
+
+        def _do_return_conn(self, record):
+            DB_POOL_CHECKED_OUT.dec()
+            return super()._do_return_conn(record)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+def sqlite_foreign_keys(dbapi_connection, connection_record) -> None:
+    """
+    SQLite n'applique les clés étrangères (et donc ON DELETE CASCADE) que si
+    on le demande, à chaque connexion.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def create_engine_for_url(database_url: str, **kwargs):
+    """Crée un AsyncEngine, avec les options de pool adaptées au dialecte."""
+    url = to_async_url(database_url)
+    pool_class = kwargs.pop("poolclass", None) or url.get_dialect().get_pool_class(url)
+    if issubclass(pool_class, QueuePool):
+        kwargs.setdefault("pool_size", settings.db_pool_size)
+        kwargs.setdefault("max_overflow", settings.db_max_overflow)
+        kwargs.setdefault("pool_timeout", settings.db_pool_timeout_seconds)
+    async_engine = create_async_engine(
+        url,
+        poolclass=timed_pool_class(pool_class),
+        pool_pre_ping=True,
+        echo=settings.debug,
+        **kwargs,
+    )
+    if url.get_backend_name() == "sqlite":
+        event.listen(async_engine.sync_engine, "connect", sqlite_foreign_keys)
+    return async_engine
+
+@lru_cache(maxsize=1)
+def get_engine() -> AsyncEngine:
+    """
+    Moteur de l'application, créé au premier appel puis partagé : importer
+    l'application (tests, CLI, migrations) ne lit ni DATABASE_URL ni la
+    configuration.
+    """
+    return create_engine_for_url(settings.database_url)
+
+@lru_cache(maxsize=1)
+def get_session_factory() -> async_sessionmaker:
+    """Fabrique de sessions liée à get_engine(), créée au premier appel."""
+    # expire_on_commit=False : en asynchrone, un accès à un attribut expiré
+    # déclencherait un chargement implicite (interdit hors greenlet).
+    return async_sessionmaker(
+        bind=get_engine(),
+        autoflush=False,
+        expire_on_commit=False,
+    )
 
 Base = declarative_base()
 
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with get_session_factory()() as db:
         yield db
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+def alembic_config(database_url: Optional[str] = None):
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    # Appelé depuis l'application : on ne reconfigure pas ses logs
+    config.attributes["configure_logging"] = False
+    if database_url is not None:
+        config.attributes["database_url"] = database_url
+    return config
+
+async def _has_unversioned_schema(database_url: str) -> bool:
+    """Tables créées avant Alembic (ancien create_all au démarrage), sans table alembic_version."""
+    from sqlalchemy import inspect
+    from sqlalchemy.pool import NullPool
+
+    legacy_engine = create_engine_for_url(database_url, poolclass=NullPool)
+    try:
+        async with legacy_engine.connect() as conn:
+            tables = await conn.run_sync(lambda sync_conn: set(inspect(sync_conn).get_table_names()))
     finally:
-        db.close()
-        
-def init_db() -> None:
-    from app.models import user, conversation, message
+        await legacy_engine.dispose()
+    return "users" in tables and "alembic_version" not in tables
+
+def run_migrations(database_url: Optional[str] = None) -> None:
+    """
+    Applique les migrations Alembic (alembic upgrade head).
+
+    À appeler une seule fois par déploiement, avant de lancer les workers, et
+    hors boucle asyncio (Alembic exécute sa propre boucle). Une base créée par
+    l'ancien create_all est d'abord marquée à la révision initiale.
+    """
+    from alembic import command
+
+    database_url = database_url or settings.database_url
+    config = alembic_config(database_url)
+    if asyncio.run(_has_unversioned_schema(database_url)):
+        print("🗃️ Schéma existant sans version : marqué à la révision initiale (0001)")
+        command.stamp(config, "0001")
+    command.upgrade(config, "head")
+
+async def seed_demo_user() -> None:
+    """Crée un utilisateur de démo si aucun n'existe."""
     from app.models.user import User
-    
-    Base.metadata.create_all(bind=engine)
-    
-    # Créer un utilisateur de démo si aucun n'existe
-    db = SessionLocal()
-    try:
-        existing_user = db.query(User).first()
+
+    async with get_session_factory()() as db:
+        result = await db.execute(select(User).limit(1))
+        existing_user = result.scalars().first()
         if not existing_user:
             demo_user = User(email="demo@travelbot.local", name="Utilisateur Demo")
             db.add(demo_user)
-            db.commit()
+            await db.commit()
             print("👤 Utilisateur de démo créé (id=1)")
-    finally:
-        db.close()
-    
-    print("*******Base de données initialisée*******")
\ No newline at end of file
+
+def prepare_database() -> None:
+    """
+    Migrations puis utilisateur de démo, dans le processus de lancement (avant
+    les workers) : les workers démarrent sans DDL ni course entre eux.
+    """
+    run_migrations()
+
+    async def seed() -> None:
+        try:
+            await seed_demo_user()
+        finally:
+            # Aucune connexion ouverte ici ne doit être héritée par les workers
+            await get_engine().dispose()
+
+    asyncio.run(seed())
+    print("*******Base de données initialisée*******")
@@ -0,0 +1,187 @@
+"""
+Métriques Prometheus et en-tête Server-Timing.
+
+Chaque étape d'un tour de chat est chronométrée avec `timed_stage(...)` :
+- histogramme `travelbot_chat_stage_seconds{stage=...}` (exposé sur /metrics) ;
+- durée ajoutée à l'en-tête `Server-Timing` de la réponse HTTP, visible dans
+  l'onglet Réseau du navigateur.
+
+On y trouve aussi l'attente d'une connexion du pool SQLAlchemy (faut-il agrandir
+le pool ou la base ?), les tokens envoyés / reçus du modèle (quota OpenAI) et la
+durée totale des requêtes HTTP par route (faut-il plus de workers ?).
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+# Étapes d'un tour de chat (valeurs du label "stage")
+STAGE_CONVERSATION = "conversation"   # lecture ou création de la conversation
+STAGE_HISTORY = "history"             # lecture de l'historique (contexte)
+STAGE_USER_MESSAGE = "user_message"   # INSERT du message utilisateur
+STAGE_LLM = "llm"                     # appel au modèle
+STAGE_CACHE = "cache"                 # réponse servie par le cache
+STAGE_BOT_MESSAGE = "bot_message"     # INSERT de la réponse du bot (ou mise en file d'écriture)
+STAGE_COMMIT = "commit"               # COMMIT de la transaction
+
+# De 1 ms (requêtes DB) à 60 s (réponses longues du modèle)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CHAT_STAGE_SECONDS = Histogram(
+    "travelbot_chat_stage_seconds",
+    "Durée de chaque étape d'un tour de chat.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "travelbot_http_request_duration_seconds",
+    "Durée des requêtes HTTP, par route.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "travelbot_db_pool_checkout_wait_seconds",
+    "Attente pour obtenir une connexion du pool SQLAlchemy.",
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "travelbot_db_pool_checked_out",
+    "Connexions du pool actuellement utilisées.",
+    multiprocess_mode="livesum",
+)
+LLM_ATTEMPTS = Counter(
+    "travelbot_llm_attempts_total",
+    "Tentatives d'appel au modèle, par modèle et résultat (success, timeout, error).",
+    ["model", "outcome"],
+)
+LLM_HEDGES = Counter(
+    "travelbot_llm_hedged_requests_total",
+    "Requêtes doublées car la réponse dépassait le seuil de hedging.",
+    ["model"],
+)
+LLM_FALLBACKS = Counter(
+    "travelbot_llm_fallbacks_total",
+    "Passages au modèle de repli.",
+    ["model"],
+)
+LLM_TOKENS = Counter(
+    "travelbot_llm_tokens_total",
+    "Tokens échangés avec le modèle (prompt envoyé, réponse reçue).",
+    ["kind"],
+)
+WRITE_BEHIND_PENDING = Gauge(
+    "travelbot_write_behind_pending_messages",
+    "Messages en file d'écriture différée, pas encore enregistrés.",
+    multiprocess_mode="livesum",
+)
+WRITE_BEHIND_BATCH_ROWS = Histogram(
+    "travelbot_write_behind_batch_rows",
+    "Nombre de messages par INSERT de l'écriture différée.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+# Durées des étapes de la requête HTTP en cours (None hors requête)
+_stage_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("stage_timings", default=None)
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Chronomètre une étape : histogramme Prometheus + en-tête Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        CHAT_STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+def record_llm_tokens(prompt_tokens: int, completion_tokens: int) -> None:
+    LLM_TOKENS.labels("prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels("completion").inc(completion_tokens)
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    """Formate l'en-tête Server-Timing (durées en millisecondes)."""
+    entries = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings]
+    entries.append(f"app;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Retourne le contenu de /metrics et son type MIME.
+
+    Avec plusieurs workers (PROMETHEUS_MULTIPROC_DIR, voir app.server), chaque
+    worker écrit ses valeurs dans ce dossier : on les agrège tous, quel que soit
+    le worker qui reçoit le scrape.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def route_template(scope: Scope) -> str:
+    """Chemin de la route (ex: /api/conversations/{conversation_id}) pour limiter la cardinalité."""
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI : mesure la durée des requêtes HTTP et ajoute l'en-tête
+    Server-Timing avec les étapes terminées au moment où la réponse démarre.
+
+    En streaming (SSE), l'en-tête part avant la génération : seules les étapes
+    préalables (conversation, historique, message utilisateur) y figurent ; les
+    suivantes restent mesurées dans les histogrammes.
+    """
+
+    def __init__(self, app: ASGIApp, enabled: Optional[bool] = None):
+        self.app = app
+        # Pile de middlewares construite au premier appel (démarrage), pas à l'import
+        self.enabled = settings.metrics_enabled if enabled is None else enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: List[Tuple[str, float]] = []
+        token = _stage_timings.set(timings)
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                header = server_timing_header(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _stage_timings.reset(token)
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route_template(scope), str(status_code)
+            ).observe(time.perf_counter() - start)
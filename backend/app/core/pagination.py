@@ -0,0 +1,63 @@
+"""
+Pagination par curseur (keyset) : on reprend là où la page précédente s'arrête,
+avec une condition sur (created_at, id) servie par un index composite, au lieu
+d'un OFFSET qui oblige la base à parcourir toutes les lignes sautées.
+
+Le curseur est opaque pour le client (JSON encodé en base64) : il contient la
+position (created_at, id) et le sens de lecture.
+"""
+
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Literal, Optional
+
+# "before" : éléments plus anciens que la position ; "after" : plus récents.
+Direction = Literal["before", "after"]
+
+@dataclass
+class Cursor:
+    created_at: datetime
+    id: int
+    direction: Direction
+
+def encode_cursor(created_at: datetime, id: int, direction: Direction) -> str:
+    payload = json.dumps({"t": created_at.isoformat(), "i": id, "d": direction})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Décode un curseur. Lève ValueError s'il est invalide."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction = payload["d"]
+        if direction not in ("before", "after"):
+            raise ValueError(direction)
+        return Cursor(
+            created_at=datetime.fromisoformat(payload["t"]),
+            id=int(payload["i"]),
+            direction=direction,
+        )
+    except Exception as e:
+        raise ValueError(f"Curseur invalide : {cursor}") from e
+
+def page_cursors(items: list, has_more: bool, cursor: Optional[Cursor]) -> tuple:
+    """
+    Calcule (curseur vers les éléments plus anciens, curseur vers les plus récents)
+    pour une page d'éléments triés chronologiquement.
+
+    Sans curseur, la page est la plus récente : il n'y a rien de plus récent.
+    """
+    if not items:
+        return None, None
+    first, last = items[0], items[-1]
+
+    if cursor is None or cursor.direction == "before":
+        has_older, has_newer = has_more, cursor is not None
+    else:
+        has_older, has_newer = True, has_more
+
+    older = encode_cursor(first.created_at, first.id, "before") if has_older else None
+    newer = encode_cursor(last.created_at, last.id, "after") if has_newer else None
+    return older, newer
@@ -1,16 +1,69 @@
-from fastapi import FastAPI
+import asyncio
+import math
+
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 
 from app.core.config import settings
-from app.core.database import init_db
-from app.api import chat
+from app.core.database import get_engine, get_session_factory, prepare_database
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.api import cache, chat, export, search
+from app.services.history_cache import create_history_cache
+from app.services.langchain_service import LangChainService, preload_ai_modules
+from app.services.chatbot_service import TurnInProgressError
+from app.services.llm_resilience import LLMUnavailableError
+from app.services.message_writer import MessageWriter
+from app.services.rate_limiter import RateLimitExceeded, UserRateLimiter, create_rate_limit_store
+from app.services.response_cache import ResponseCache
+from app.services.single_flight import SingleFlight
+from app.services.summary_service import ConversationSummarizer
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # === DÉMARRAGE ===
+    # Le schéma est créé par les migrations Alembic, avant le démarrage des
+    # workers (prepare_database) : rien à faire ici pour la base.
     print("🚀 Démarrage de TravelBot..")
-    init_db()
+    # Configuration lue au démarrage, pas à l'import (voir la création de l'app)
+    app.title = settings.app_name
+    SessionLocal = get_session_factory()
+    knowledge_base = None
+    if settings.knowledge_base_enabled:
+        # Import ici : NumPy n'est chargé que si la base de connaissances est activée
+        from app.services.knowledge_base import KnowledgeBase
+        try:
+            knowledge_base = KnowledgeBase.load(settings.knowledge_base_path)
+            print(f"📖 Base de connaissances chargée : {len(knowledge_base)} extraits")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Base de connaissances indisponible, réponses sans extraits : {e}")
+    app.state.langchain_service = LangChainService(knowledge_base=knowledge_base)
+    # LangChain / OpenAI / tiktoken chargés dans un thread : le worker accepte
+    # les requêtes sans attendre ces imports, la première conversation les trouve prêts.
+    app.state.ai_preload = asyncio.create_task(asyncio.to_thread(preload_ai_modules))
+    app.state.summarizer = ConversationSummarizer(SessionLocal, app.state.langchain_service)
+    if settings.response_cache_enabled:
+        app.state.response_cache = ResponseCache(
+            embedder=app.state.langchain_service.embed if settings.response_cache_semantic else None
+        )
+    app.state.single_flight = SingleFlight()
+    if settings.rate_limit_enabled:
+        app.state.user_rate_limiter = UserRateLimiter(create_rate_limit_store())
+    if settings.history_cache_enabled:
+        app.state.history_cache = create_history_cache()
+    if settings.write_behind_enabled:
+        app.state.message_writer = MessageWriter(SessionLocal, history_cache=getattr(app.state, "history_cache", None))
+        app.state.message_writer.start()
+    if settings.embedding_store_enabled:
+        from app.services.embedding_store import EmbeddingStore, EmbeddingWorker
+        try:
+            app.state.embedding_store = EmbeddingStore.open()
+            # Chaque worker démarre la tâche ; un seul à la fois écrit (verrou sur le fichier)
+            app.state.embedding_worker = EmbeddingWorker(SessionLocal, app.state.embedding_store)
+            app.state.embedding_worker.start()
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"⚠️ Magasin d'embeddings indisponible : {e}")
     print(f"🌐 Serveur démarré sur l'URL: http://{settings.host}:{settings.port}")
     print(f"📚 Swagger disponible sur l'URL: http://localhost:{settings.port}/docs")
     
@@ -18,10 +71,25 @@ async def lifespan(app: FastAPI):
     
     # === ARRÊT ===
     print("🛑 Arrêt de TravelBot..")
+    await app.state.ai_preload
+    if hasattr(app.state, "embedding_worker"):
+        await app.state.embedding_worker.aclose()
+        app.state.embedding_store.close()
+    if settings.write_behind_enabled:
+        # Avant la fermeture du pool : les messages encore en file sont enregistrés
+        await app.state.message_writer.aclose()
+    if settings.history_cache_enabled:
+        await app.state.history_cache.aclose()
+    await app.state.langchain_service.aclose()
+    if settings.rate_limit_enabled:
+        await app.state.user_rate_limiter.aclose()
+    await get_engine().dispose()
     
 
+# Rien n'est lu de la configuration à l'import (tests, CLI, migrations) : le
+# titre est fixé dans le lifespan, le middleware de métriques lit
+# METRICS_ENABLED au premier appel.
 app = FastAPI(
-    title=settings.app_name,
     description="Un chatbot touristique propulsé par OpenAI et LangChain.",
     version="1.0.0",
     lifespan=lifespan,
@@ -36,8 +104,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After", "Idempotent-Replayed"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    """Limite de débit atteinte : 429 avec le délai conseillé avant de réessayer."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+@app.exception_handler(TurnInProgressError)
+async def turn_in_progress_handler(request: Request, exc: TurnInProgressError):
+    """Clé d'idempotence d'un envoi encore en cours : 409, le client réessaie avec la même clé."""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    """Modèle principal et repli indisponibles (disjoncteurs ouverts, délais dépassés) : 503."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
 # --- Monter les routes ---
 app.include_router(
     chat.router,
@@ -45,6 +143,24 @@ app.include_router(
     tags=["Chat"]
 )
 
+app.include_router(
+    cache.router,
+    prefix="/api",
+    tags=["Cache"]
+)
+
+app.include_router(
+    export.router,
+    prefix="/api",
+    tags=["Export"]
+)
+
+app.include_router(
+    search.router,
+    prefix="/api",
+    tags=["Recherche"]
+)
+
 # --- Routes utilitaires ---
 @app.get("/health")
 async def health_check():
@@ -53,6 +169,12 @@ async def health_check():
         "app": settings.app_name
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métriques au format Prometheus (latences par étape, pool DB, tokens)."""
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
+
 @app.get("/")
 async def root():
     return {
@@ -61,9 +183,10 @@ async def root():
         "health":"/health"
     }
     
-# --- Lancement direct ---
+# --- Lancement direct (développement ; en production : python -m app.server) ---
 if __name__ == "__main__":
     import uvicorn
+    prepare_database()
     uvicorn.run(
         "app.main:app",
         host=settings.host,
@@ -1,7 +1,7 @@
 # Model Conversation - représente une conversation entre un utilisateur et le chatbot.
 # Chaque conversation peut contenir plusieurs messages.
 
-from sqlalchemy import Column, Integer, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Text, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 
@@ -10,13 +10,18 @@ from app.core.database import Base
 class Conversation(Base):
     __tablename__ = "conversations"
     
+    # Index composite pour lister les conversations d'un utilisateur par date
+    # (pagination par curseur sur (created_at, id)) ; remplace l'index sur user_id.
+    __table_args__ = (
+        Index("ix_conversations_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+    
     id =  Column(Integer, primary_key=True, index=True)
     
     user_id = Column(
         Integer,
         ForeignKey("users.id", ondelete='CASCADE'),
         nullable=False,
-        index=True
     )
     
     client_id = Column(
@@ -32,17 +37,34 @@ class Conversation(Base):
         nullable=False
     )
     
+    # Résumé glissant des anciens messages, mis à jour en tâche de fond
+    # (voir ConversationSummarizer). summary_message_id = dernier message résumé.
+    summary = Column(
+        Text,
+        nullable=True
+    )
+    
+    summary_message_id = Column(
+        Integer,
+        nullable=True
+    )
+    
     user = relationship(
         "User",
         back_populates="conversations",
     )
     
+    # Collection classique (plus de lazy="dynamic") : elle peut être chargée en
+    # avance avec selectinload(Conversation.messages). En asynchrone, un accès
+    # sans chargement préalable lève une erreur au lieu de faire une requête cachée.
     messages = relationship(
         "Message",
         back_populates="conversation",
         cascade="all, delete-orphan",
+        # Messages supprimés par la base (ON DELETE CASCADE) sans être chargés :
+        # supprimer une conversation de milliers de messages reste un seul DELETE.
+        passive_deletes=True,
         order_by= "Message.created_at",
-        lazy="dynamic"
     )
     
     def __repr__(self):
@@ -1,6 +1,6 @@
 # Model Message - représente un message dans une conversation entre un utilisateur et le chatbot.
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text
+from sqlalchemy import DDL, Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Index, event
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 
@@ -9,13 +9,19 @@ from app.core.database import Base
 class Message(Base):
     __tablename__ = "messages"
     
+    # Index composite : sert à la fois au filtre par conversation et au tri
+    # chronologique (lecture des N derniers messages sans tri en mémoire,
+    # pagination par curseur sur (created_at, id)).
+    __table_args__ = (
+        Index("ix_messages_conversation_id_created_at_id", "conversation_id", "created_at", "id"),
+    )
+    
     id = Column(Integer, primary_key=True, index=True)
     
     conversation_id = Column(
         Integer,
         ForeignKey("conversations.id", ondelete='CASCADE'),
         nullable=False,
-        index=True
     )
     
     content = Column(
@@ -30,11 +36,24 @@ class Message(Base):
         nullable=False
     )
     
+    # Nombre de tokens du contenu (tiktoken), calculé une fois pour le budget de contexte
+    token_count = Column(
+        Integer,
+        nullable=True
+    )
+    
+    # Clé d'idempotence (en-tête Idempotency-Key) de la requête qui a produit
+    # cette réponse du bot : un nouvel essai avec la même clé renvoie ce message.
+    idempotency_key = Column(
+        String(255),
+        nullable=True,
+        unique=True
+    )
+    
     created_at = Column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
         nullable=False,
-        index=True
     )
     
     conversation = relationship(
@@ -55,4 +74,47 @@ class Message(Base):
             "is_bot": self.is_bot,
             "created_at": self.created_at.isoformat()
         }
-    
\ No newline at end of file
+    
+
+# ─────────────────────────────────────
+# INDEX PLEIN TEXTE (recherche dans l'historique)
+# ─────────────────────────────────────
+# Créé avec la table par create_all (tests, benchmarks) ; les bases gérées par
+# Alembic le reçoivent de la migration 0003. Hors du modèle ORM : les requêtes
+# de recherche sont écrites par dialecte (app/repositories/message_search.py).
+
+# PostgreSQL : tsvector calculé par la base (configuration française :
+# racinisation, mots vides), index GIN.
+POSTGRES_SEARCH_DDL = [
+    "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('french', content)) STORED",
+    "CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)",
+]
+
+# SQLite : table FTS5 tenue à jour par triggers, accents ignorés. Elle porte
+# aussi le propriétaire du message (jeton "u<user_id>") : la recherche d'un
+# utilisateur est une intersection dans l'index, pas un filtre après coup.
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, owner, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts (rowid, content, owner) VALUES (new.id, new.content, "
+    "(SELECT 'u' || user_id FROM conversations WHERE id = new.conversation_id)); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "DELETE FROM messages_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "UPDATE messages_fts SET content = new.content WHERE rowid = new.id; END",
+]
+
+def include_in_autogenerate(name, type_, parent_names) -> bool:
+    """Filtre d'Alembic (autogenerate) : l'index plein texte n'est pas décrit par le modèle."""
+    if type_ == "table":
+        return not name.startswith("messages_fts")
+    return name not in ("search_vector", "ix_messages_search_vector")
+
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(Message.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(Message.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+# Les triggers disparaissent avec la table, pas la table virtuelle
+event.listen(Message.__table__, "after_drop", DDL("DROP TABLE IF EXISTS messages_fts").execute_if(dialect="sqlite"))
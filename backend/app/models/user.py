@@ -34,7 +34,9 @@ class User(Base):
         "Conversation",
         back_populates="user",
         cascade="all, delete-orphan",
-        lazy="dynamic"
+        # Suppression faite par la base (ON DELETE CASCADE) : les conversations
+        # ne sont pas chargées pour être supprimées une à une.
+        passive_deletes=True,
     )
     
     def __repr__(self):
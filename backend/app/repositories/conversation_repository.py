@@ -1,66 +1,349 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
+from sqlalchemy import and_, delete, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
+from app.core.metrics import STAGE_COMMIT, timed_stage
+from app.core.pagination import Cursor
 from app.models import Conversation, Message, User
+from app.services.history_cache import HistoryCache
 
 class ConversationRepository:
     """Repository pour gérer toutes opératons liées aux conversations et messages."""
-    
-    def __init__(self, db: Session):
+
+    def __init__(self, db: AsyncSession, history_cache: Optional[HistoryCache] = None):
         self.db = db
-        
-    def create_conversation(self, user_id:int, client_id: int =1)-> Conversation:
-        """Créer une nouvelle conversation pour un utilisateur."""
-        conversation = Conversation(user_id=user_id, client_id=client_id)
-        self.db.add(conversation)
-        self.db.commit()
-        self.db.refresh(conversation)
+        # Cache optionnel des derniers messages par conversation (write-through)
+        self.history_cache = history_cache
+        # Profondeur des unit_of_work imbriquées (0 = chaque écriture est commitée)
+        self._uow_depth = 0
+        # Mises à jour du cache à appliquer une fois la transaction commitée
+        self._after_commit: List[Callable[[], Awaitable[None]]] = []
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator["ConversationRepository"]:
+        """
+        Regroupe plusieurs écritures dans une seule transaction.
+
+        À l'intérieur, les écritures ne font qu'un INSERT (pas de commit) ; un seul
+        commit est fait à la sortie du bloc le plus externe, ou un rollback en cas
+        d'erreur. Les blocs imbriqués rejoignent la transaction englobante.
+        """
+        self._uow_depth += 1
+        try:
+            yield self
+            if self._uow_depth == 1:
+                await self._commit()
+        except BaseException:
+            if self._uow_depth == 1:
+                self._after_commit.clear()
+                await self.db.rollback()
+            raise
+        finally:
+            self._uow_depth -= 1
+
+    async def rollback(self) -> None:
+        """Annule la transaction en cours (par exemple après une erreur d'intégrité hors unit_of_work)."""
+        self._after_commit.clear()
+        await self.db.rollback()
+
+    async def _commit(self) -> None:
+        with timed_stage(STAGE_COMMIT):
+            await self.db.commit()
+        # Le cache ne reflète que des écritures commitées
+        hooks, self._after_commit = self._after_commit, []
+        for hook in hooks:
+            await hook()
+
+    def _on_commit(self, hook: Callable[[], Awaitable[None]]) -> None:
+        if self.history_cache is not None:
+            self._after_commit.append(hook)
+
+    async def _save(self) -> None:
+        """Commit immédiat hors unit_of_work ; sinon le commit est différé à la fin du bloc."""
+        if self._uow_depth == 0:
+            await self._commit()
+
+    async def create_conversation(self, user_id:int, client_id: int =1)-> Conversation:
+        """Créer une nouvelle conversation pour un utilisateur.
+
+        INSERT ... RETURNING : la ligne créée (id, created_at) est relue dans le même
+        aller-retour, sans refresh().
+        """
+        conversation = await self.db.scalar(
+            insert(Conversation).values(
+                user_id=user_id,
+                client_id=client_id
+            ).returning(Conversation)
+        )
+        # Nouvelle conversation : fenêtre vide et complète, le premier tour lit le cache
+        self._on_commit(lambda: self.history_cache.put(conversation.id, [], complete=True))
+        await self._save()
         return conversation
-    
-    def get_conversation(self, conversation_id: int) -> Optional[Conversation]:
+
+    async def get_conversation(self, conversation_id: int) -> Optional[Conversation]:
         """Retourne une conversation par son ID ou None si elle n'existe pas."""
-        return self.db.query(Conversation).filter(
-            Conversation.id == conversation_id
-        ).first()
-        
-    def get_user_conversations(self, user_id: int, limit: int = 10) -> List[Conversation]:
-        """Retourne les conversations d'un utilisateur, les plus récentes en premier."""
-        return self.db.query(Conversation).filter(
+        return await self.db.get(Conversation, conversation_id)
+
+    async def get_user_conversations(
+        self,
+        user_id: int,
+        limit: int = 10,
+        include_messages: bool = False
+    ) -> List[Conversation]:
+        """Retourne les conversations d'un utilisateur, les plus récentes en premier.
+
+        Avec include_messages=True, les messages de toutes les conversations sont
+        chargés en une seule requête supplémentaire (selectinload) : 2 requêtes
+        au total, quel que soit le nombre de conversations.
+        """
+        query = select(Conversation).where(
             Conversation.user_id == user_id
         ).order_by(
-            Conversation.created_at.desc()
-        ).limit(limit).all()
-        
-    def delete_conversation(self, conversation_id: int)-> bool:
-        """Supprime une conversation (et ses messages via CASCADE). Retourne True si succès."""
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
+            Conversation.created_at.desc(),
+            Conversation.id.desc()
+        ).limit(limit)
+        if include_messages:
+            query = query.options(selectinload(Conversation.messages))
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
+
+    async def get_last_messages(self, conversation_ids: List[int]) -> Dict[int, Message]:
+        """Retourne le dernier message de chaque conversation, en une seule requête.
+
+        Pour chaque conversation, une sous-requête corrélée trouve l'id du dernier
+        message en lisant une seule entrée de l'index (conversation_id, created_at, id),
+        quelle que soit la longueur de la conversation.
+        """
+        if not conversation_ids:
+            return {}
+        last_message_id = select(Message.id).where(
+            Message.conversation_id == Conversation.id
+        ).order_by(
+            Message.created_at.desc(),
+            Message.id.desc()
+        ).limit(1).correlate(Conversation).scalar_subquery()
+
+        result = await self.db.execute(
+            select(Message).join(
+                Conversation,
+                Message.id == last_message_id
+            ).where(Conversation.id.in_(conversation_ids))
+        )
+        return {message.conversation_id: message for message in result.scalars().all()}
+
+    async def get_user_conversations_with_last_message(
+        self,
+        user_id: int,
+        limit: int = 10
+    ) -> List[Tuple[Conversation, Optional[Message]]]:
+        """Conversations récentes d'un utilisateur avec leur dernier message (2 requêtes)."""
+        conversations = await self.get_user_conversations(user_id, limit=limit)
+        last_messages = await self.get_last_messages([c.id for c in conversations])
+        return [(c, last_messages.get(c.id)) for c in conversations]
+
+    async def _keyset_page(self, query, model, limit: int, cursor: Optional[Cursor]) -> Tuple[list, bool]:
+        """
+        Exécute une requête paginée par curseur sur (created_at, id).
+
+        Retourne les éléments en ordre chronologique et un booléen indiquant s'il
+        reste des éléments dans le sens de lecture (on lit limit + 1 lignes).
+        Sans curseur, on retourne la page la plus récente.
+        """
+        if cursor is not None and cursor.direction == "after":
+            query = query.where(or_(
+                model.created_at > cursor.created_at,
+                and_(model.created_at == cursor.created_at, model.id > cursor.id),
+            )).order_by(model.created_at.asc(), model.id.asc())
+        else:
+            if cursor is not None:
+                query = query.where(or_(
+                    model.created_at < cursor.created_at,
+                    and_(model.created_at == cursor.created_at, model.id < cursor.id),
+                ))
+            query = query.order_by(model.created_at.desc(), model.id.desc())
+
+        result = await self.db.execute(query.limit(limit + 1))
+        items = list(result.scalars().all())
+        has_more = len(items) > limit
+        items = items[:limit]
+        if cursor is None or cursor.direction == "before":
+            items.reverse()
+        return items, has_more
+
+    async def get_user_conversations_page(
+        self,
+        user_id: int,
+        limit: int = 20,
+        cursor: Optional[Cursor] = None
+    ) -> Tuple[List[Conversation], bool]:
+        """Page de conversations d'un utilisateur (keyset sur l'index (user_id, created_at, id))."""
+        return await self._keyset_page(
+            select(Conversation).where(Conversation.user_id == user_id),
+            Conversation,
+            limit,
+            cursor
+        )
+
+    async def get_messages_page(
+        self,
+        conversation_id: int,
+        limit: int = 50,
+        cursor: Optional[Cursor] = None
+    ) -> Tuple[List[Message], bool]:
+        """Page de messages d'une conversation (keyset sur l'index (conversation_id, created_at, id))."""
+        return await self._keyset_page(
+            select(Message).where(Message.conversation_id == conversation_id),
+            Message,
+            limit,
+            cursor
+        )
+
+    async def delete_conversation(self, conversation_id: int)-> bool:
+        """Supprime une conversation (et ses messages via CASCADE). Retourne True si succès.
+
+        Un seul DELETE : les messages sont supprimés par la base (ON DELETE
+        CASCADE), sans être chargés dans la session.
+        """
+        result = await self.db.execute(
+            delete(Conversation).where(Conversation.id == conversation_id)
+        )
+        if not result.rowcount:
             return False
-        self.db.delete(conversation)
-        self.db.commit()
+        self._on_commit(lambda: self.history_cache.invalidate(conversation_id))
+        await self._save()
         return True
-    
-    def add_message(self, conversation_id: int, content: str, is_bot: bool=False)-> Message:
-        """Ajoute un message à une conversation."""
-        message = Message(
+
+    async def add_message(
+        self,
+        conversation_id: int,
+        content: str,
+        is_bot: bool=False,
+        token_count: Optional[int]=None,
+        idempotency_key: Optional[str]=None,
+        created_at: Optional[datetime]=None
+    )-> Message:
+        """Ajoute un message à une conversation (INSERT ... RETURNING, sans refresh).
+
+        `created_at` permet de dater le message de sa réception quand il est
+        enregistré plus tard (après l'appel au modèle).
+        """
+        values = dict(
             conversation_id=conversation_id,
             content=content,
-            is_bot=is_bot
+            is_bot=is_bot,
+            token_count=token_count,
+            idempotency_key=idempotency_key
         )
-        self.db.add(message)
-        self.db.commit()
-        self.db.refresh(message)
+        if created_at is not None:
+            values["created_at"] = created_at
+        message = await self.db.scalar(insert(Message).values(**values).returning(Message))
+        self._on_commit(lambda: self.history_cache.append(message))
+        await self._save()
         return message
-    
-    def get_messages(self, conversation_id:int, limit: int=50) -> List[Message]:
-        """Retourne les messages d'une conversation en ordre chronologique."""
-        return self.db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(
-            Message.created_at.asc()
-        ).limit(limit).all()
-        
-    def get_conversation_history(self, conversation_id:int, limit: int=10)->List[dict]:
+
+    async def get_messages_by_idempotency_keys(self, idempotency_keys: List[str]) -> List[Message]:
+        """Retourne les messages enregistrés avec ces clés d'idempotence (un seul SELECT)."""
+        result = await self.db.execute(
+            select(Message).where(Message.idempotency_key.in_(idempotency_keys))
+        )
+        return list(result.scalars().all())
+
+    async def get_messages(self, conversation_id:int, limit: int=50) -> List[Message]:
+        """Retourne les messages d'une conversation en ordre chronologique.
+
+        Servi par le cache d'historique quand sa fenêtre contient toute la
+        conversation ; une conversation lue en entier remplit le cache.
+        """
+        generation = None
+        if self.history_cache is not None:
+            cached = await self.history_cache.first(conversation_id, limit)
+            if cached is not None:
+                return cached
+            generation = await self.history_cache.generation(conversation_id)
+        result = await self.db.execute(
+            select(Message).where(
+                Message.conversation_id == conversation_id
+            ).order_by(
+                Message.created_at.asc()
+            ).limit(limit)
+        )
+        messages = list(result.scalars().all())
+        if self.history_cache is not None and messages and len(messages) < limit:
+            await self.history_cache.put(conversation_id, messages, complete=True, generation=generation)
+        return messages
+
+    async def get_recent_messages(
+        self,
+        conversation_id: int,
+        limit: int = 10,
+        after_id: Optional[int] = None
+    ) -> List[Message]:
+        """Retourne les `limit` derniers messages d'une conversation, en ordre chronologique.
+
+        On trie en ordre décroissant pour que LIMIT garde les plus récents
+        (parcours inverse de l'index (conversation_id, created_at)), puis on
+        remet la liste dans l'ordre chronologique en mémoire.
+        Si `after_id` est donné, seuls les messages postérieurs à ce message sont retournés.
+
+        Avec le cache d'historique, la fenêtre en cache répond sans SELECT ; en
+        cas d'absence, on lit la fenêtre complète (window_size derniers messages)
+        pour la mettre en cache, puis on filtre en mémoire. La fenêtre n'est
+        enregistrée que si aucun message n'a été ajouté pendant la lecture
+        (génération inchangée).
+        """
+        cache = self.history_cache
+        if cache is not None and limit <= cache.window_size:
+            cached = await cache.recent(conversation_id, limit, after_id)
+            if cached is not None:
+                return cached
+            generation = await cache.generation(conversation_id)
+            window = await self._recent_messages(conversation_id, cache.window_size)
+            await cache.put(conversation_id, window, complete=len(window) < cache.window_size, generation=generation)
+            if after_id is not None:
+                window = [m for m in window if m.id > after_id]
+            return window[-limit:]
+        return await self._recent_messages(conversation_id, limit, after_id)
+
+    async def _recent_messages(
+        self,
+        conversation_id: int,
+        limit: int,
+        after_id: Optional[int] = None
+    ) -> List[Message]:
+        query = select(Message).where(Message.conversation_id == conversation_id)
+        if after_id is not None:
+            query = query.where(Message.id > after_id)
+        result = await self.db.execute(
+            query.order_by(
+                Message.created_at.desc(),
+                Message.id.desc()
+            ).limit(limit)
+        )
+        messages = list(result.scalars().all())
+        messages.reverse()
+        return messages
+
+    async def get_messages_after(self, conversation_id: int, after_id: Optional[int], limit: int) -> List[Message]:
+        """Retourne les `limit` PREMIERS messages postérieurs à `after_id` (tous si None), en ordre chronologique."""
+        query = select(Message).where(Message.conversation_id == conversation_id)
+        if after_id is not None:
+            query = query.where(Message.id > after_id)
+        result = await self.db.execute(
+            query.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def update_summary(self, conversation: Conversation, summary: str, summary_message_id: int) -> None:
+        """Enregistre le résumé glissant d'une conversation."""
+        conversation.summary = summary
+        conversation.summary_message_id = summary_message_id
+        await self.db.flush()
+        await self._save()
+
+    async def get_conversation_history(self, conversation_id:int, limit: int=10)->List[dict]:
         """Retourne l'historique au format que LangChain comprend.
         Exemple :
         [
@@ -68,7 +351,7 @@ class ConversationRepository:
             {"role": "assistant", "content": "Salut! Comment puis-je vous aider?"}
         ]
         """
-        messages = self.get_messages(conversation_id, limit=limit)
+        messages = await self.get_recent_messages(conversation_id, limit=limit)
         return [
             {
                 "role": "assistant" if msg.is_bot else "user",
@@ -76,18 +359,19 @@ class ConversationRepository:
             }
             for msg in messages
         ]
-        
-    def get_or_create_user(self, email:str, name: str="Utilisateur") -> User:
+
+    async def get_or_create_user(self, email:str, name: str="Utilisateur") -> User:
         """Retourne un utilisateur existant par email ou en crée un nouveau."""
-        user = self.db.query(User).filter(User.email == email).first()
+        result = await self.db.execute(select(User).where(User.email == email))
+        user = result.scalars().first()
         if not user:
             user = User(email=email, name=name)
             self.db.add(user)
-            self.db.commit()
-            self.db.refresh(user)
+            await self.db.flush()
+            await self._save()
         return user
-    
-    def get_conversation_messages(self, conversation_id: int, limit: int = 50):
+
+    async def get_conversation_messages(self, conversation_id: int, limit: int = 50):
         """Retourne les messages d'une conversation sous forme de dictionnaires."""
-        messages = self.get_messages(conversation_id, limit=limit)
-        return [msg.to_dict() for msg in messages]
\ No newline at end of file
+        messages = await self.get_messages(conversation_id, limit=limit)
+        return [msg.to_dict() for msg in messages]
@@ -0,0 +1,162 @@
+"""
+Recherche plein texte dans l'historique des conversations d'un utilisateur.
+
+Une requête par recherche, écrite pour chaque dialecte :
+- PostgreSQL : websearch_to_tsquery('french', ...) sur la colonne tsvector
+  (index GIN), classement ts_rank_cd, extraits ts_headline ;
+- SQLite (tests, développement) : MATCH sur la table FTS5 messages_fts,
+  restreint au propriétaire dans l'index (colonne owner), classement bm25,
+  extraits snippet(). FTS5 n'a pas de configuration française : les mots
+  vides les plus courants sont retirés de la requête (comme le fait 'french')
+  et chaque mot est cherché au singulier et au pluriel ("hôtel" trouve
+  "hôtels"). Pas de recherche par préfixe : "cher*" parcourrait aussi
+  "cherche", "cherchez"... et multiplierait le temps de réponse.
+
+Les extraits ne sont calculés que pour les meilleurs résultats (après le
+LIMIT). Chaque résultat est accompagné du message qui le précède dans sa
+conversation (la question posée au bot, par exemple), lu par l'index
+(conversation_id, created_at, id).
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Boolean, DateTime, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Marqueurs des termes trouvés dans les extraits
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+# Longueur maximale du message précédent renvoyé comme contexte
+CONTEXT_MAX_CHARS = 200
+
+# Mots vides français ignorés par la recherche SQLite (présents dans une grande
+# partie des messages : ils ralentissent la recherche sans la rendre plus précise)
+FRENCH_STOPWORDS = frozenset("""
+    a à au aux avec ce ces cet cette dans de des du elle en est et il ils je la le les leur
+    ma me mes mon ne nous on ou où par pas pour qu que qui sa se ses son sur ta te tes ton
+    tu un une vos votre vous y
+""".split())
+
+@dataclass
+class SearchHit:
+    message_id: int
+    conversation_id: int
+    conversation_created_at: datetime
+    is_bot: bool
+    created_at: datetime
+    snippet: str
+    rank: float
+    previous_message: Optional[str] = None
+
+def fts5_query(query: str, user_id: int) -> Optional[str]:
+    """
+    Requête FTS5 : chaque mot entre guillemets (pas d'opérateurs injectés),
+    au singulier ou au pluriel, tous requis dans le texte, et messages de
+    `user_id` uniquement.
+    """
+    words = re.findall(r"\w+", query.lower())
+    terms = [word for word in words if word not in FRENCH_STOPWORDS] or words
+    if not terms:
+        return None
+    variants = [
+        f'"{term}"' if term.endswith(("s", "x")) else f'("{term}" OR "{term}s")'
+        for term in terms
+    ]
+    return f'owner : "u{user_id}" AND content : (' + " AND ".join(variants) + ")"
+
+# Message précédent dans la même conversation (sous-requête corrélée, indexée)
+PREVIOUS_MESSAGE = """
+    (SELECT substr(previous.content, 1, :context_chars) FROM messages AS previous
+     WHERE previous.conversation_id = hit.conversation_id
+       AND (previous.created_at < hit.created_at
+            OR (previous.created_at = hit.created_at AND previous.id < hit.id))
+     ORDER BY previous.created_at DESC, previous.id DESC
+     LIMIT 1) AS previous_message
+"""
+
+POSTGRES_SEARCH = f"""
+    SELECT hit.id AS message_id, hit.conversation_id, hit.conversation_created_at,
+           hit.is_bot, hit.created_at, hit.rank,
+           ts_headline('french', hit.content, websearch_to_tsquery('french', :query),
+                       'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=25, MinWords=8') AS snippet,
+           {PREVIOUS_MESSAGE}
+    FROM (
+        SELECT m.id, m.conversation_id, m.content, m.is_bot, m.created_at,
+               c.created_at AS conversation_created_at,
+               ts_rank_cd(m.search_vector, websearch_to_tsquery('french', :query)) AS rank
+        FROM messages AS m
+        JOIN conversations AS c ON c.id = m.conversation_id
+        WHERE m.search_vector @@ websearch_to_tsquery('french', :query)
+          AND c.user_id = :user_id
+          {{period}}
+        ORDER BY rank DESC, m.created_at DESC
+        LIMIT :limit
+    ) AS hit
+    ORDER BY hit.rank DESC, hit.created_at DESC
+"""
+
+# bm25() est négatif : plus petit = plus pertinent. snippet() exige la table FTS
+# dans la requête : il est calculé dans la sous-requête, déjà limitée.
+SQLITE_SEARCH = f"""
+    SELECT hit.id AS message_id, hit.conversation_id, hit.conversation_created_at,
+           hit.is_bot, hit.created_at, -hit.rank AS rank, hit.snippet,
+           {PREVIOUS_MESSAGE}
+    FROM (
+        SELECT m.id, m.conversation_id, m.is_bot, m.created_at,
+               c.created_at AS conversation_created_at,
+               bm25(messages_fts, 1.0, 0.0) AS rank,
+               snippet(messages_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 16) AS snippet
+        FROM messages_fts
+        JOIN messages AS m ON m.id = messages_fts.rowid
+        JOIN conversations AS c ON c.id = m.conversation_id
+        WHERE messages_fts MATCH :query
+          {{period}}
+        ORDER BY rank, m.created_at DESC
+        LIMIT :limit
+    ) AS hit
+    ORDER BY hit.rank, hit.created_at DESC
+"""
+
+class MessageSearchRepository:
+    """Recherche plein texte dans les messages d'un utilisateur."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def search(
+        self,
+        user_id: int,
+        query: str,
+        limit: int = 20,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[SearchHit]:
+        """Messages les plus pertinents pour `query`, éventuellement limités à la période [since, until)."""
+        connection = await self.db.connection()
+        if connection.dialect.name == "postgresql":
+            sql, search_query = POSTGRES_SEARCH, query
+        else:
+            sql, search_query = SQLITE_SEARCH, fts5_query(query, user_id)
+            if search_query is None:
+                return []
+
+        params = {"query": search_query, "user_id": user_id, "limit": limit, "context_chars": CONTEXT_MAX_CHARS}
+        period, dates = [], []
+        if since is not None:
+            period.append("AND m.created_at >= :since")
+            dates.append(bindparam("since", since, type_=DateTime(timezone=True)))
+        if until is not None:
+            period.append("AND m.created_at < :until")
+            dates.append(bindparam("until", until, type_=DateTime(timezone=True)))
+
+        # Types des colonnes : dates et booléens convertis comme pour le modèle (SQLite les stocke en texte / entier)
+        statement = text(sql.format(period=" ".join(period))).bindparams(*dates).columns(
+            conversation_created_at=DateTime(timezone=True),
+            created_at=DateTime(timezone=True),
+            is_bot=Boolean(),
+        )
+        result = await self.db.execute(statement, params)
+        return [SearchHit(**row._mapping) for row in result]
@@ -62,7 +62,9 @@ class ChatResponse(BaseModel):
     {
         "response": "Nice offre beaucoup d'activités...",
         "conversation_id": 42,
-        "timestamp": "2024-02-01T10:30:00"
+        "timestamp": "2024-02-01T10:30:00",
+        "prompt_tokens": 812,
+        "completion_tokens": 164
     }
     """
     response: str = Field(
@@ -79,6 +81,21 @@ class ChatResponse(BaseModel):
         default_factory=lambda: datetime.now(timezone.utc),
         description="Horodatage UTC de la réponse.",
     )
+    
+    prompt_tokens: Optional[int] = Field(
+        None,
+        description="Nombre de tokens du prompt envoyé au modèle (prompt système + historique + question).",
+    )
+    
+    completion_tokens: Optional[int] = Field(
+        None,
+        description="Nombre de tokens de la réponse du bot.",
+    )
+    
+    cached: bool = Field(
+        False,
+        description="True si la réponse provient du cache (sans appel à OpenAI).",
+    )
 
 class MessageSchema(BaseModel):
     id: int
@@ -93,3 +110,45 @@ class ConversationSchema(BaseModel):
     created_at: datetime
     messages: list[MessageSchema] = []  # Liste des messages dans la conversation
     model_config = ConfigDict(from_attributes=True)
+
+class ConversationItemSchema(BaseModel):
+    """Conversation dans une liste (sans ses messages), avec son dernier message."""
+    id: int
+    user_id: int
+    created_at: datetime
+    last_message: Optional[MessageSchema] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class MessagePage(BaseModel):
+    """
+    Page de messages, en ordre chronologique.
+    
+    Les curseurs sont opaques : on les renvoie tels quels dans le paramètre
+    `cursor` pour charger les messages plus anciens ou plus récents.
+    """
+    items: list[MessageSchema]
+    older_cursor: Optional[str] = None
+    newer_cursor: Optional[str] = None
+
+class ConversationPage(BaseModel):
+    """Page de conversations, les plus récentes en premier."""
+    items: list[ConversationItemSchema]
+    older_cursor: Optional[str] = None
+    newer_cursor: Optional[str] = None
+
+class SearchHitSchema(BaseModel):
+    """Message trouvé par la recherche, avec un extrait et le message qui le précède."""
+    message_id: int
+    conversation_id: int
+    conversation_created_at: datetime
+    is_bot: bool
+    created_at: datetime
+    snippet: str = Field(..., description="Extrait du message, termes trouvés entre <mark> et </mark>.")
+    rank: float = Field(..., description="Pertinence (plus grand = plus pertinent).")
+    previous_message: Optional[str] = Field(None, description="Début du message précédent de la conversation.")
+    model_config = ConfigDict(from_attributes=True)
+
+class SearchResults(BaseModel):
+    """Résultats d'une recherche, les plus pertinents en premier."""
+    query: str
+    hits: list[SearchHitSchema]
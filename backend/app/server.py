@@ -0,0 +1,125 @@
+"""
+Lancement en production : plusieurs workers uvicorn sous gunicorn.
+
+    python -m app.server            # depuis backend/
+
+Avant de démarrer les workers, le processus maître :
+1. prépare le dossier des métriques Prometheus multiprocessus, pour que
+   /metrics agrège les valeurs de tous les workers ;
+2. applique les migrations Alembic et crée l'utilisateur de démo
+   (prepare_database) : une seule fois, sans course entre workers ;
+3. importe l'application (preload) : configuration lue et validée une fois,
+   code partagé entre workers par copy-on-write après le fork. Une erreur de
+   configuration arrête le lancement au lieu de faire redémarrer les workers
+   en boucle.
+
+Chaque worker tourne sur uvloop + httptools. À l'arrêt (SIGTERM), les workers
+n'acceptent plus de connexions, terminent les requêtes en cours (y compris les
+réponses en streaming) pendant `web_graceful_timeout_seconds`, puis exécutent
+le lifespan (vidage de la file d'écriture, fermeture des clients).
+
+Nombre de workers : WEB_WORKERS, ou par défaut un par cœur (application
+asynchrone : un worker sature un cœur). Avec plusieurs workers, les caches en
+mémoire (historique, limitation de débit) sont propres à chaque worker : voir
+HISTORY_CACHE_URL et RATE_LIMIT_STORE_URL pour les partager. Sans
+HISTORY_CACHE_URL, le cache d'historique est désactivé au lancement : un worker
+servirait sinon un historique périmé dès qu'un autre worker écrit dans la
+même conversation.
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Any, Dict
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from app.core.config import settings
+
+class TravelBotWorker(UvicornWorker):
+    """Worker uvicorn avec boucle uvloop et parseur HTTP httptools (paquets de uvicorn[standard])."""
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # Les requêtes en cours ont jusqu'à graceful_timeout - 5 s : il reste le
+        # temps d'exécuter le lifespan avant que gunicorn ne tue le worker.
+        self.config.timeout_graceful_shutdown = max(1, self.cfg.graceful_timeout - 5)
+
+def worker_count() -> int:
+    return settings.web_workers or os.cpu_count() or 1
+
+def disable_unshared_history_cache(workers: int) -> None:
+    """Plusieurs workers sans HISTORY_CACHE_URL : cache d'historique désactivé (avant le preload)."""
+    if workers > 1 and settings.history_cache_enabled and not settings.history_cache_url:
+        settings.history_cache_enabled = False
+        print(
+            f"⚠️ Cache d'historique désactivé : {workers} workers sans HISTORY_CACHE_URL "
+            "(chaque worker aurait sa propre copie, périmée dès qu'un autre écrit)"
+        )
+
+def prepare_metrics_dir() -> None:
+    """Dossier partagé des métriques, vidé à chaque lancement (doit précéder l'import de prometheus_client)."""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), "travelbot-metrics")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def child_exit(server, worker) -> None:
+    """Worker arrêté : ses jauges "live" ne doivent plus compter dans /metrics."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+def gunicorn_options() -> Dict[str, Any]:
+    return {
+        "bind": f"{settings.host}:{settings.port}",
+        "workers": worker_count(),
+        "worker_class": "app.server.TravelBotWorker",
+        "preload_app": True,
+        # Délai laissé aux requêtes en cours à l'arrêt (drain), puis arrêt forcé
+        "graceful_timeout": settings.web_graceful_timeout_seconds,
+        # Worker bloqué (boucle d'événements figée) au-delà de ce délai : redémarré
+        "timeout": settings.web_graceful_timeout_seconds + 30,
+        "keepalive": settings.web_keepalive_seconds,
+        # Redémarrage périodique des workers (0 = jamais), décalé pour ne pas tous les relancer ensemble
+        "max_requests": settings.web_max_requests,
+        "max_requests_jitter": settings.web_max_requests // 10,
+        "accesslog": "-" if settings.debug else None,
+        "child_exit": child_exit,
+    }
+
+class TravelBotServer(BaseApplication):
+    """Application gunicorn configurée depuis Settings (pas de fichier gunicorn.conf.py)."""
+
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app
+
+        return app
+
+def main() -> None:
+    if settings.metrics_enabled and worker_count() > 1:
+        prepare_metrics_dir()
+    disable_unshared_history_cache(worker_count())
+    from app.core.database import prepare_database
+
+    prepare_database()
+    options = gunicorn_options()
+    print(f"🚀 TravelBot en production : {options['workers']} workers sur {options['bind']}")
+    TravelBotServer(options).run()
+
+if __name__ == "__main__":
+    main()
@@ -3,71 +3,496 @@ Service Chatbot : orchestre le flux complet d'un message.
 
 Quand un utilisateur envoie un message, voici ce qui se passe :
 1. On récupère (ou on crée) la conversation en DB
-2. On sauvegarde le message de l'utilisateur
-3. On récupère l'historique depuis la DB
+2. On récupère l'historique récent depuis la DB, dans un budget de tokens
+3. On sauvegarde le message de l'utilisateur
 4. On l'envoie à LangChain pour obtenir une réponse
 5. On sauvegarde la réponse du bot
 6. On retourne la réponse au frontend
+
+En mode streaming (stream_reply), l'étape 4 produit la réponse morceau par
+morceau et l'étape 5 n'a lieu qu'une fois le flux terminé.
+
+Si le cache de réponses est activé, une question posée sans contexte (premier
+message) peut être servie depuis le cache à l'étape 4, sans appel à OpenAI.
+La réponse est tout de même sauvegardée à l'étape 5.
+
+Les doublons (double-clic, nouvel essai du client) ne sont traités qu'une fois :
+clé d'idempotence (en-tête Idempotency-Key) et regroupement des questions
+identiques en cours (single_flight).
+
+L'appel au modèle (étape 4, plusieurs secondes) se fait sans connexion DB :
+les lectures (étapes 1-2) sont terminées et leur transaction close avant
+l'appel. Les écritures se font en deux transactions courtes : la conversation
+(si nouvelle) et le message utilisateur AVANT l'appel (étape 3, un commit), la
+réponse du bot APRÈS (étape 5, un second commit). Le pool de connexions n'est
+donc pas dimensionné par le nombre d'appels au modèle en cours.
+
+Un tour n'est donc pas atomique : si l'appel au modèle échoue, la question
+reste enregistrée sans réponse. C'est voulu (la question de l'utilisateur
+n'est jamais perdue) et sans doublon au nouvel essai : la clé d'idempotence
+est portée par le message utilisateur, et un nouvel essai avec la même clé
+reprend ce tour pour n'en générer que la réponse.
+
+Avec l'écriture différée (message_writer, WRITE_BEHIND_ENABLED), les étapes 3
+et 5 ne font que mettre chacune son message en file (deux mises en file
+distinctes) : ils sont enregistrés par lots en tâche de fond, et toute
+lecture d'une conversation attend d'abord ses messages en file. Seul le
+message utilisateur d'un envoi avec clé d'idempotence est écrit tout de
+suite : l'unicité de la clé doit être vérifiée avant l'appel au modèle.
+
+Avec le cache d'historique (history_cache), l'étape 2 lit les derniers messages
+en mémoire, tenus à jour à chaque message enregistré : pas de SELECT en régime
+établi.
+
+Chaque étape est chronométrée (app.core.metrics) : histogrammes sur /metrics
+et en-tête Server-Timing de la réponse.
 """
 
-from sqlalchemy.orm import Session
-from typing import Tuple
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, List, Optional, Tuple
 
+from app.core.metrics import (
+    STAGE_BOT_MESSAGE,
+    STAGE_CACHE,
+    STAGE_CONVERSATION,
+    STAGE_HISTORY,
+    STAGE_LLM,
+    STAGE_USER_MESSAGE,
+    record_llm_tokens,
+    timed_stage,
+)
+from app.services.context_builder import ContextBuilder, ContextWindow, count_tokens
+from app.services.history_cache import HistoryCache
 from app.services.langchain_service import LangChainService
+from app.services.message_writer import MessageWriter, message_row
+from app.models import Conversation, Message
+from app.services.response_cache import CacheLookup, ResponseCache, normalize_question
+from app.services.single_flight import SingleFlight
 from app.repositories.conversation_repository import ConversationRepository
 
+@dataclass
+class ChatResult:
+    """Résultat d'un tour de chat."""
+    response: str
+    conversation_id: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached: bool = False
+    # Réponse déjà enregistrée, renvoyée pour une clé d'idempotence connue
+    replayed: bool = False
+
+class TurnInProgressError(Exception):
+    """Même clé d'idempotence déjà prise par un envoi en cours, sans réponse encore (réponse 409)."""
+
+    def __init__(self, detail: str = "Ce message est déjà en cours de traitement, réessayez dans un instant.",
+                 retry_after: float = 1.0):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+def reply_idempotency_key(idempotency_key: str) -> str:
+    """
+    Clé portée par la réponse du bot d'un tour. La clé du client est posée sur
+    le message utilisateur, premier message écrit ; la colonne étant unique, la
+    réponse reçoit une clé dérivée (de longueur fixe, sous les 255 caractères).
+    """
+    return "reply:" + hashlib.sha256(idempotency_key.encode()).hexdigest()
+
+def turn_key(conversation_id: int, message: str, context: ContextWindow) -> Tuple[int, str, str]:
+    """Clé single-flight : conversation, question normalisée et empreinte du contexte."""
+    question = normalize_question(message)
+    history = context.history
+    # Le message utilisateur est enregistré avant l'appel au modèle : une requête
+    # identique arrivée pendant cet appel le trouve en fin d'historique. C'est le
+    # même tour, il ne compte pas dans l'empreinte.
+    if history and history[-1]["role"] == "user" and normalize_question(history[-1]["content"]) == question:
+        history = history[:-1]
+    fingerprint = hashlib.sha256(
+        json.dumps([context.summary, history], ensure_ascii=False).encode()
+    ).hexdigest()
+    return conversation_id, question, fingerprint
+
+def first_turn_key(user_id: int, message: str) -> Tuple[str, int, str]:
+    """Clé single-flight du premier message d'une nouvelle conversation : utilisateur et question normalisée."""
+    return "nouvelle", user_id, normalize_question(message)
+
 class ChatbotService:
-    
-    def __init__(self, db: Session):
-        self.conversation_repository = ConversationRepository(db)
-        self.langchain_service = LangChainService()
-        
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        langchain_service: Optional[LangChainService] = None,
+        response_cache: Optional[ResponseCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        message_writer: Optional[MessageWriter] = None,
+        history_cache: Optional[HistoryCache] = None
+    ):
+        self.conversation_repository = ConversationRepository(db, history_cache)
+        self.langchain_service = langchain_service
+        self.response_cache = response_cache
+        self.single_flight = single_flight
+        self.message_writer = message_writer
+        self.context_builder = ContextBuilder(self.conversation_repository)
+
+    async def load_turn(
+        self,
+        conversation_id: Optional[int],
+        message: str,
+        question: Optional[Message] = None
+    ) -> Tuple[Optional[Conversation], ContextWindow]:
+        """
+        Étapes 1 et 2 en lecture seule : conversation existante (None si elle
+        n'existe pas encore) et contexte à envoyer au modèle. Avec `question`
+        (message utilisateur déjà enregistré par un essai précédent), c'est sa
+        conversation, et le contexte s'arrête avant lui.
+        """
+        if question is not None:
+            conversation_id = question.conversation_id
+        # 1. Récupérer la conversation (créée plus tard si elle n'existe pas)
+        conversation = None
+        if conversation_id:
+            with timed_stage(STAGE_CONVERSATION):
+                await self.wait_for_writes(conversation_id)
+                conversation = await self.conversation_repository.get_conversation(conversation_id)
+
+        # 2. Récupérer l'historique récent qui tient dans le budget de tokens
+        # (avant la question actuelle, qui est envoyée séparément au modèle)
+        with timed_stage(STAGE_HISTORY):
+            context = await self.context_builder.build(
+                conversation, message, before_id=question.id if question is not None else None
+            )
+        return conversation, context
+
+    async def wait_for_writes(self, conversation_id: int) -> None:
+        """Lecture de ses propres écritures : attend les messages encore en file d'écriture."""
+        if self.message_writer is not None:
+            await self.message_writer.wait_for(conversation_id)
+
+    async def ensure_conversation(self, user_id: int, conversation: Optional[Conversation]) -> int:
+        """Crée la conversation si besoin et retourne son ID."""
+        if conversation is not None:
+            return conversation.id
+        with timed_stage(STAGE_CONVERSATION):
+            conversation = await self.conversation_repository.create_conversation(user_id)
+        return conversation.id
+
+    async def save_user_message(
+        self,
+        conversation_id: int,
+        message: str,
+        created_at: Optional[datetime] = None,
+        idempotency_key: Optional[str] = None
+    ) -> None:
+        """Étape 3 : sauvegarder le message utilisateur (porteur de la clé d'idempotence du tour)."""
+        with timed_stage(STAGE_USER_MESSAGE):
+            await self.conversation_repository.add_message(
+                conversation_id=conversation_id,
+                content=message,
+                is_bot=False,
+                token_count=count_tokens(message),
+                idempotency_key=idempotency_key,
+                created_at=created_at
+            )
+
+    async def save_bot_message(self, conversation_id: int, content: str, token_count: int,
+                               idempotency_key: Optional[str] = None) -> None:
+        """Étape 5 : sauvegarder la réponse du bot (en file avec l'écriture différée)."""
+        reply_key = reply_idempotency_key(idempotency_key) if idempotency_key else None
+        with timed_stage(STAGE_BOT_MESSAGE):
+            if self.message_writer is not None:
+                await self.message_writer.enqueue([
+                    message_row(conversation_id, content, True, token_count, reply_key)
+                ])
+                return
+            async with self.conversation_repository.unit_of_work():
+                await self.conversation_repository.add_message(
+                    conversation_id=conversation_id,
+                    content=content,
+                    is_bot=True,
+                    token_count=token_count,
+                    idempotency_key=reply_key
+                )
+
+    async def start_turn(
+        self,
+        user_id: int,
+        message: str,
+        conversation_id: int = None,
+        idempotency_key: Optional[str] = None,
+        question: Optional[Message] = None
+    ) -> Tuple[int, ContextWindow]:
+        """
+        Étapes 1 à 3 : conversation, historique et message utilisateur.
+        Retourne l'ID de la conversation et le contexte à envoyer au modèle.
+
+        Les écritures sont regroupées en une seule transaction (un commit), ou
+        rejoignent celle de l'appelant s'il a ouvert une unit_of_work. Après le
+        commit, la connexion est rendue au pool : le streaming du modèle se fait
+        sans connexion DB.
+
+        Nouvel essai (`question` : message utilisateur de cette clé d'idempotence
+        déjà enregistré, sans réponse, voir find_turn) : on reprend sa
+        conversation sans rien écrire.
+        """
+        async with self.conversation_repository.unit_of_work():
+            conversation, context = await self.load_turn(conversation_id, message, question)
+            if question is None:
+                conversation_id = await self.ensure_conversation(user_id, conversation)
+                await self.save_user_message(conversation_id, message, idempotency_key=idempotency_key)
+            else:
+                conversation_id = question.conversation_id
+
+        return conversation_id, context
+
+    async def lookup_cache(self, message: str, context: ContextWindow) -> Optional[CacheLookup]:
+        """
+        Cherche la réponse dans le cache si la question est posée sans contexte.
+        Retourne None si le cache ne s'applique pas à cette question.
+        """
+        if self.response_cache is None or context.history or context.summary:
+            return None
+        return await self.response_cache.lookup(message)
+
+    async def find_turn(self, idempotency_key: str) -> Tuple[Optional[Message], Optional[ChatResult]]:
+        """
+        État du tour de cette clé d'idempotence : message utilisateur déjà
+        enregistré (ou None) et réponse déjà enregistrée (ou None), en un SELECT.
+        """
+        reply_key = reply_idempotency_key(idempotency_key)
+        pending = self.message_writer.pending_reply(reply_key) if self.message_writer else None
+        if pending is not None:
+            return None, ChatResult(
+                response=pending["content"],
+                conversation_id=pending["conversation_id"],
+                prompt_tokens=0,
+                completion_tokens=pending["token_count"] or 0,
+                replayed=True
+            )
+        question, reply = None, None
+        for stored in await self.conversation_repository.get_messages_by_idempotency_keys([idempotency_key, reply_key]):
+            # Réponse sous la clé du client : tour enregistré avant les clés dérivées
+            if stored.is_bot:
+                reply = stored
+            else:
+                question = stored
+        if reply is None:
+            return question, None
+        return question, ChatResult(
+            response=reply.content,
+            conversation_id=reply.conversation_id,
+            prompt_tokens=0,
+            completion_tokens=reply.token_count or 0,
+            replayed=True
+        )
+
+    async def get_stored_reply(self, idempotency_key: str) -> Optional[ChatResult]:
+        """Réponse déjà enregistrée pour cette clé d'idempotence (nouvel essai d'un client), ou None."""
+        return (await self.find_turn(idempotency_key))[1]
+
+    async def resolve_duplicate(self, idempotency_key: str) -> ChatResult:
+        """
+        Après une violation d'unicité sur la clé d'idempotence (envoi concurrent
+        arrivé le premier) : annule la transaction en échec, puis renvoie la
+        réponse de l'autre envoi, ou TurnInProgressError s'il n'a pas encore répondu.
+        """
+        await self.conversation_repository.rollback()
+        stored = await self.get_stored_reply(idempotency_key)
+        if stored is None:
+            raise TurnInProgressError()
+        return stored
+
     async def process_message(
         self,
         user_id: int,
         message: str,
-        conversation_id: int = None
-    )-> Tuple[str, int]:
+        conversation_id: int = None,
+        idempotency_key: Optional[str] = None
+    )-> ChatResult:
         """
-        Traite un message utilisateur et retourne la réponse du bot et l'ID de la conversation.
+        Traite un message utilisateur et retourne la réponse du bot, l'ID de la conversation,
+        et l'usage en tokens (prompt, réponse).
+
+        Le tour se fait en phases DB courtes, sans connexion gardée pendant
+        l'appel au modèle (qui dure plusieurs secondes) :
+        1. lecture de la conversation et de l'historique, puis fin de transaction :
+           la connexion retourne au pool ;
+        2. écriture de la conversation (si nouvelle) et du message utilisateur,
+           comme start_turn pour /chat/stream : la question est conservée même
+           si l'appel au modèle échoue ou expire ;
+        3. appel au modèle, sans connexion ;
+        4. écriture de la réponse du bot.
+
+        Doublons :
+        - avec une clé d'idempotence déjà utilisée, la réponse enregistrée est
+          renvoyée telle quelle (ni appel au modèle, ni nouveaux messages) ; si
+          seul le message utilisateur a été enregistré (appel au modèle en échec),
+          le tour reprend dans sa conversation et seule la réponse est générée ;
+        - si une question identique (même conversation, même question normalisée,
+          même historique) est en cours de traitement, on attend son résultat
+          au lieu de la traiter une seconde fois (single-flight) ; sans
+          conversation, deux premiers messages identiques du même utilisateur
+          sont regroupés de même et ne créent qu'une conversation ;
+        - deux envois concurrents de la même clé sont départagés par l'unicité de
+          la clé, posée sur le message utilisateur avant l'appel au modèle : le
+          second ne persiste rien et renvoie la réponse du premier (ou 409).
         """
-        # 1. Créer ou récupérer la conversation
-        if conversation_id:
-            conversation = self.conversation_repository.get_conversation(conversation_id)
-            if not conversation:
-                conversation = self.conversation_repository.create_conversation(user_id)
+        question = None
+        if idempotency_key:
+            question, stored = await self.find_turn(idempotency_key)
+            if stored is not None:
+                return stored
+
+        received_at = datetime.now(timezone.utc)
+        try:
+            if conversation_id or question is not None:
+                # Phase 1 : lectures, puis la connexion est rendue au pool
+                async with self.conversation_repository.unit_of_work():
+                    conversation, context = await self.load_turn(conversation_id, message, question)
+            else:
+                # Nouvelle conversation : rien à lire en base
+                conversation, context = await self.load_turn(None, message)
+
+            async def complete() -> ChatResult:
+                return await self._complete_turn(
+                    user_id, conversation, message, context, received_at, idempotency_key,
+                    question_saved=question is not None
+                )
+
+            if self.single_flight is None:
+                return await complete()
+            # Premier message envoyé deux fois (double-clic) : une seule conversation créée
+            key = first_turn_key(user_id, message) if conversation is None else turn_key(conversation.id, message, context)
+            result, _ = await self.single_flight.do(key, complete)
+            return result
+        except IntegrityError:
+            # Même clé d'idempotence envoyée en parallèle : la réponse de l'autre requête fait foi
+            if idempotency_key:
+                return await self.resolve_duplicate(idempotency_key)
+            raise
+
+    async def _complete_turn(
+        self,
+        user_id: int,
+        conversation: Optional[Conversation],
+        message: str,
+        context: ContextWindow,
+        received_at: datetime,
+        idempotency_key: Optional[str] = None,
+        question_saved: bool = False
+    ) -> ChatResult:
+        """Étapes 3 à 5 : message utilisateur, réponse du modèle (ou du cache), puis réponse du bot."""
+        # 3. Sauvegarder le message utilisateur (daté de sa réception) avant l'appel au
+        # modèle, sauf s'il l'a été par un essai précédent. Avec une clé d'idempotence,
+        # l'INSERT est immédiat même en écriture différée : la contrainte d'unicité
+        # départage deux envois concurrents avant tout appel au modèle.
+        if question_saved:
+            conversation_id = conversation.id
+        elif self.message_writer is not None and not idempotency_key:
+            conversation_id = await self._enqueue_user_message(user_id, conversation, message, received_at)
         else:
-            conversation = self.conversation_repository.create_conversation(user_id)
-            
-        # 2. Sauvegarder le message utilisateur
-        self.conversation_repository.add_message(
-            conversation_id=conversation.id,
-            content=message,
-           is_bot=False
-        )
-        
-        # 3. Récupérer l'historique des messages
-        history = self.conversation_repository.get_conversation_history(
-            conversation.id, 
-            limit=10
-        )
-        
-        # 4. Obtenir une réponse de l'IA
-        bot_response = await self.langchain_service.get_response(
-            message=message, 
-            conversation_history=history
-        )
-        
+            async with self.conversation_repository.unit_of_work():
+                conversation_id = await self.ensure_conversation(user_id, conversation)
+                await self.save_user_message(conversation_id, message, received_at, idempotency_key)
+
+        # 4. Obtenir une réponse de l'IA (ou du cache), sans connexion DB
+        with timed_stage(STAGE_CACHE):
+            lookup = await self.lookup_cache(message, context)
+        cached = lookup is not None and lookup.response is not None
+        if cached:
+            bot_response = lookup.response
+        else:
+            with timed_stage(STAGE_LLM):
+                bot_response = await self.langchain_service.get_response(
+                    message=message,
+                    conversation_history=context.history,
+                    summary=context.summary
+                )
+            if lookup is not None:
+                await self.response_cache.store(lookup, bot_response)
+
+        completion_tokens = count_tokens(bot_response)
+        if not cached:
+            record_llm_tokens(context.prompt_tokens, completion_tokens)
+
         # 5. Sauvegarder la réponse du bot
-        self.conversation_repository.add_message(
-            conversation_id=conversation.id,
-            content=bot_response,
-            is_bot=True
-        )
-        
+        await self.save_bot_message(conversation_id, bot_response, completion_tokens, idempotency_key)
+
         # 6. Retourner la réponse et l'ID de la conversation
-        return bot_response, conversation.id
-    
-    def get_conversation_messages(self, conversation_id: int):
-        
-        return self.conversation_repository.get_conversation_messages(conversation_id)
\ No newline at end of file
+        return ChatResult(
+            response=bot_response,
+            conversation_id=conversation_id,
+            prompt_tokens=0 if cached else context.prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached=cached
+        )
+
+    async def _enqueue_user_message(
+        self,
+        user_id: int,
+        conversation: Optional[Conversation],
+        message: str,
+        received_at: datetime
+    ) -> int:
+        """
+        Étape 3 en écriture différée : seule la création d'une nouvelle conversation
+        (dont il faut l'ID) est faite tout de suite ; le message part en file.
+        """
+        if conversation is None:
+            async with self.conversation_repository.unit_of_work():
+                conversation_id = await self.ensure_conversation(user_id, None)
+        else:
+            conversation_id = conversation.id
+        with timed_stage(STAGE_USER_MESSAGE):
+            await self.message_writer.enqueue([
+                message_row(conversation_id, message, False, count_tokens(message), created_at=received_at)
+            ])
+        return conversation_id
+
+    async def stream_reply(
+        self,
+        conversation_id: int,
+        message: str,
+        context: ContextWindow,
+        idempotency_key: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Étapes 4 et 5 en streaming : produit les tokens du bot au fil de l'eau,
+        puis sauvegarde la réponse assemblée une seule fois, à la fin du flux.
+
+        Si le client se déconnecte, le générateur est fermé avant la fin :
+        rien n'est sauvegardé et l'appel au modèle est interrompu.
+        """
+        with timed_stage(STAGE_CACHE):
+            lookup = await self.lookup_cache(message, context)
+        cached = lookup is not None and lookup.response is not None
+        if cached:
+            content = lookup.response
+            yield content
+        else:
+            parts: List[str] = []
+            # Chronomètre la génération complète, y compris le temps d'envoi au client
+            with timed_stage(STAGE_LLM):
+                async for token in self.langchain_service.stream_response(
+                    message=message,
+                    conversation_history=context.history,
+                    summary=context.summary
+                ):
+                    parts.append(token)
+                    yield token
+            content = "".join(parts)
+            if lookup is not None:
+                await self.response_cache.store(lookup, content)
+
+        completion_tokens = count_tokens(content)
+        if not cached:
+            record_llm_tokens(context.prompt_tokens, completion_tokens)
+        await self.save_bot_message(conversation_id, content, completion_tokens, idempotency_key)
+
+    async def get_conversation_messages(self, conversation_id: int):
+        await self.wait_for_writes(conversation_id)
+        return await self.conversation_repository.get_conversation_messages(conversation_id)
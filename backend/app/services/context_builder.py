@@ -0,0 +1,138 @@
+"""
+Construction du contexte envoyé au LLM, dans un budget de tokens.
+
+Au lieu d'un nombre fixe de messages, on remplit un budget de tokens configurable
+(`context_token_budget`) avec les messages les plus récents. Le coût d'un prompt
+devient ainsi prévisible, quelle que soit la longueur des messages.
+
+Le nombre de tokens de chaque message est calculé une seule fois (tiktoken) puis
+stocké en base dans `messages.token_count`.
+
+Pour les longues conversations, le résumé glissant stocké sur la conversation
+(voir summary_service) remplace les messages qu'il couvre : le prompt devient
+résumé + messages récents, et sa taille reste bornée.
+"""
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from app.core.config import settings
+from app.models import Conversation
+from app.repositories.conversation_repository import ConversationRepository
+from app.services.prompts import TRAVELBOT_SYSTEM_PROMPT
+
+if TYPE_CHECKING:
+    import tiktoken
+
+# Surcoût du format chat d'OpenAI par message (rôle + séparateurs).
+MESSAGE_OVERHEAD_TOKENS = 4
+# Tokens ajoutés par OpenAI pour amorcer la réponse de l'assistant.
+REPLY_PRIMING_TOKENS = 3
+
+@lru_cache(maxsize=1)
+def get_encoding() -> Optional["tiktoken.Encoding"]:
+    """Retourne l'encodage tiktoken du modèle, ou None s'il est indisponible (hors ligne)."""
+    try:
+        # Import au premier comptage (ou au préchargement du démarrage), pas à l'import du module
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(settings.openai_model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"⚠️ Encodage tiktoken indisponible, estimation approximative des tokens : {e}")
+        return None
+
+def count_tokens(text: str) -> int:
+    """Compte les tokens d'un texte (≈ 4 caractères par token si tiktoken est indisponible)."""
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+@lru_cache(maxsize=1)
+def system_prompt_tokens() -> int:
+    return count_tokens(TRAVELBOT_SYSTEM_PROMPT) + MESSAGE_OVERHEAD_TOKENS
+
+@dataclass
+class ContextWindow:
+    """Historique retenu pour le prompt, résumé éventuel et nombre de tokens du prompt complet."""
+    history: List[Dict[str, str]] = field(default_factory=list)
+    summary: Optional[str] = None
+    prompt_tokens: int = 0
+
+class ContextBuilder:
+    """Remplit le budget de tokens avec les messages les plus récents d'une conversation."""
+
+    def __init__(
+        self,
+        repository: ConversationRepository,
+        token_budget: Optional[int] = None,
+        max_messages: Optional[int] = None,
+    ):
+        self.repository = repository
+        self.token_budget = token_budget or settings.context_token_budget
+        self.max_messages = max_messages or settings.context_max_messages
+
+    async def build(
+        self,
+        conversation: Optional[Conversation],
+        message: str,
+        before_id: Optional[int] = None
+    ) -> ContextWindow:
+        """
+        Construit le contexte pour la question `message` (conversation=None : nouvelle conversation).
+        Avec `before_id`, seuls les messages antérieurs à ce message comptent
+        (question déjà enregistrée, dont on génère la réponse manquante).
+
+        Les messages postérieurs au résumé sont parcourus du plus récent au plus
+        ancien et ajoutés tant que le budget le permet. Les token_count manquants
+        (anciens messages) sont calculés et attachés aux objets : ils seront
+        sauvegardés au prochain commit.
+        """
+        base_tokens = (
+            system_prompt_tokens()
+            + count_tokens(message) + MESSAGE_OVERHEAD_TOKENS
+            + REPLY_PRIMING_TOKENS
+        )
+        summary = conversation.summary if conversation is not None else None
+        if summary:
+            base_tokens += count_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+        budget = self.token_budget - base_tokens
+        if settings.knowledge_base_enabled:
+            # Place réservée aux extraits de la base de connaissances, ajoutés par LangChainService
+            budget -= settings.knowledge_base_max_tokens + MESSAGE_OVERHEAD_TOKENS
+        used = 0
+        selected = []
+
+        if conversation is not None:
+            messages = await self.repository.get_recent_messages(
+                conversation.id,
+                limit=self.max_messages,
+                after_id=conversation.summary_message_id if summary else None
+            )
+            if before_id is not None:
+                messages = [msg for msg in messages if msg.id < before_id]
+            for msg in reversed(messages):
+                if msg.token_count is None:
+                    msg.token_count = count_tokens(msg.content)
+                cost = msg.token_count + MESSAGE_OVERHEAD_TOKENS
+                if used + cost > budget:
+                    break
+                selected.append(msg)
+                used += cost
+            selected.reverse()
+
+        return ContextWindow(
+            history=[
+                {
+                    "role": "assistant" if msg.is_bot else "user",
+                    "content": msg.content
+                }
+                for msg in selected
+            ],
+            summary=summary,
+            prompt_tokens=base_tokens + used,
+        )
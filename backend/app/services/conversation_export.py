@@ -0,0 +1,247 @@
+"""
+Export et import en masse des conversations (NDJSON : une conversation par
+ligne, avec tous ses messages).
+
+    python -m app.services.conversation_export export --user-id 1 -o conversations.ndjson.gz
+    python -m app.services.conversation_export export --since 2024-01-01 --until 2024-07-01
+    python -m app.services.conversation_export import conversations.ndjson.gz
+
+Export : une seule requête (conversations LEFT JOIN messages, triée par
+conversation) lue en flux par un curseur côté serveur (yield_per) ; les lignes
+sont regroupées à la volée. La mémoire est celle d'une conversation et d'un
+lot de lignes, quel que soit le volume exporté. Même format que les archives
+du job de rétention (app/services/retention.py), qui s'importent donc aussi.
+
+Import : par lots, un INSERT multi-lignes des conversations (RETURNING des
+nouveaux id) puis les messages en executemany, ou COPY sur PostgreSQL
+(asyncpg), et un commit par lot. Les conversations et messages reçoivent de
+nouveaux id ; le résumé glissant n'est pas repris (il pointe vers des id de
+messages de la base d'origine) et sera recalculé. Les clés d'idempotence ne
+sont pas reprises non plus : uniques en base, elles feraient échouer tout le
+lot au second import d'un même fichier (ou si la base d'origine les contient
+encore), et ne servent qu'aux nouvelles tentatives d'un envoi en cours.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import sys
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models import Conversation, Message
+
+# Lignes lues par aller-retour avec la base pendant l'export
+EXPORT_YIELD_PER = 1000
+# Messages par lot d'import (un commit par lot)
+IMPORT_BATCH_MESSAGES = 10_000
+
+# Colonnes des messages importés (sans idempotency_key : voir plus haut)
+MESSAGE_COLUMNS = ["conversation_id", "content", "is_bot", "token_count", "created_at"]
+
+def conversation_record(conversation) -> Dict[str, Any]:
+    return {
+        "id": conversation.id,
+        "user_id": conversation.user_id,
+        "client_id": conversation.client_id,
+        "created_at": conversation.created_at.isoformat(),
+        "summary": conversation.summary,
+        "messages": [],
+    }
+
+async def stream_conversations(db: AsyncSession, *criteria) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Conversations filtrées par `criteria` (conditions sur Conversation), avec
+    leurs messages dans l'ordre chronologique, une à une.
+    """
+    conversations = Conversation.__table__
+    messages = Message.__table__
+    query = (
+        select(
+            conversations.c.id, conversations.c.user_id, conversations.c.client_id,
+            conversations.c.created_at, conversations.c.summary,
+            messages.c.id.label("message_id"), messages.c.content, messages.c.is_bot,
+            messages.c.token_count, messages.c.idempotency_key,
+            messages.c.created_at.label("message_created_at"),
+        )
+        .select_from(conversations.outerjoin(messages, messages.c.conversation_id == conversations.c.id))
+        .where(*criteria)
+        .order_by(conversations.c.id, messages.c.created_at, messages.c.id)
+        .execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+    current: Optional[Dict[str, Any]] = None
+    async for row in await db.stream(query):
+        if current is None or current["id"] != row.id:
+            if current is not None:
+                yield current
+            current = conversation_record(row)
+        if row.message_id is not None:
+            current["messages"].append({
+                "id": row.message_id,
+                "content": row.content,
+                "is_bot": row.is_bot,
+                "token_count": row.token_count,
+                "idempotency_key": row.idempotency_key,
+                "created_at": row.message_created_at.isoformat(),
+            })
+    if current is not None:
+        yield current
+
+def export_criteria(
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List:
+    """Filtre de l'export : conversations d'un utilisateur et/ou créées dans [since, until)."""
+    criteria = []
+    if user_id is not None:
+        criteria.append(Conversation.user_id == user_id)
+    if since is not None:
+        criteria.append(Conversation.created_at >= since)
+    if until is not None:
+        criteria.append(Conversation.created_at < until)
+    return criteria
+
+async def export_ndjson(db: AsyncSession, *criteria) -> AsyncIterator[str]:
+    """Lignes NDJSON de l'export (terminées par un saut de ligne)."""
+    async for record in stream_conversations(db, *criteria):
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+def _parse_datetime(value: str) -> datetime:
+    # Dates sans fuseau (export depuis SQLite) : UTC, comme à l'enregistrement
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+async def _import_batch(db: AsyncSession, records: List[Dict[str, Any]], user_id: Optional[int]) -> int:
+    # RETURNING dans l'ordre des lignes : le n-ième id est celui de la n-ième conversation
+    new_ids = (await db.execute(
+        insert(Conversation.__table__).returning(Conversation.id, sort_by_parameter_order=True),
+        [
+            {
+                "user_id": user_id if user_id is not None else record["user_id"],
+                "client_id": record.get("client_id", 1),
+                "created_at": _parse_datetime(record["created_at"]),
+                "summary": None,
+                "summary_message_id": None,
+            }
+            for record in records
+        ],
+    )).scalars().all()
+
+    rows = [
+        (
+            conversation_id,
+            message["content"],
+            message["is_bot"],
+            message.get("token_count"),
+            _parse_datetime(message["created_at"]),
+        )
+        for conversation_id, record in zip(new_ids, records)
+        for message in record["messages"]
+    ]
+    if not rows:
+        return 0
+    connection = await db.connection()
+    if connection.dialect.name == "postgresql":
+        # COPY : flux binaire, sans une requête par ligne
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Message.__tablename__, records=rows, columns=MESSAGE_COLUMNS
+        )
+    else:
+        await db.execute(insert(Message.__table__), [dict(zip(MESSAGE_COLUMNS, row)) for row in rows])
+    return len(rows)
+
+async def import_ndjson(
+    session_factory: async_sessionmaker,
+    lines: Iterable[str],
+    user_id: Optional[int] = None,
+    batch_messages: int = IMPORT_BATCH_MESSAGES,
+) -> Dict[str, int]:
+    """
+    Importe des conversations NDJSON par lots d'environ `batch_messages` messages.
+    `user_id` rattache toutes les conversations à cet utilisateur.
+    """
+    imported = {"conversations": 0, "messages": 0}
+    batch: List[Dict[str, Any]] = []
+    batch_size = 0
+
+    async def flush() -> None:
+        nonlocal batch, batch_size
+        async with session_factory() as db:
+            imported["messages"] += await _import_batch(db, batch, user_id)
+            await db.commit()
+        imported["conversations"] += len(batch)
+        batch, batch_size = [], 0
+
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        batch.append(record)
+        batch_size += len(record["messages"]) + 1
+        if batch_size >= batch_messages:
+            await flush()
+    if batch:
+        await flush()
+    return imported
+
+def _open(path: str, mode: str):
+    if path == "-":
+        return nullcontext(sys.stdout if "w" in mode else sys.stdin)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+async def run_export(output: str, user_id: Optional[int], since: Optional[datetime], until: Optional[datetime]) -> int:
+    from app.core.database import get_engine, get_session_factory
+
+    count = 0
+    try:
+        with _open(output, "w") as out:
+            async with get_session_factory()() as db:
+                async for line in export_ndjson(db, *export_criteria(user_id, since, until)):
+                    out.write(line)
+                    count += 1
+    finally:
+        await get_engine().dispose()
+    return count
+
+async def run_import(path: str, user_id: Optional[int]) -> Dict[str, int]:
+    from app.core.database import get_engine, get_session_factory
+
+    try:
+        with _open(path, "r") as lines:
+            return await import_ndjson(get_session_factory(), lines, user_id)
+    finally:
+        await get_engine().dispose()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export / import NDJSON des conversations.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="exporte les conversations en NDJSON")
+    export.add_argument("-o", "--output", default="-", help="fichier (.ndjson, .ndjson.gz) ou - (sortie standard)")
+    export.add_argument("--user-id", type=int, default=None)
+    export.add_argument("--since", type=_parse_datetime, default=None, help="conversations créées à partir de (ISO 8601)")
+    export.add_argument("--until", type=_parse_datetime, default=None, help="conversations créées avant (ISO 8601)")
+
+    import_ = commands.add_parser("import", help="importe un fichier NDJSON")
+    import_.add_argument("input", help="fichier (.ndjson, .ndjson.gz) ou - (entrée standard)")
+    import_.add_argument("--user-id", type=int, default=None, help="rattache les conversations à cet utilisateur")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        count = asyncio.run(run_export(args.output, args.user_id, args.since, args.until))
+        print(f"📤 {count} conversations exportées", file=sys.stderr)
+    else:
+        imported = asyncio.run(run_import(args.input, args.user_id))
+        print(f"📥 {imported['conversations']} conversations et {imported['messages']} messages importés", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Magasin d'embeddings des messages, précalculés en tâche de fond.
+
+Les fonctions sémantiques (recherche, cache, RAG sur l'historique) ont besoin
+du vecteur de chaque message. Le calculer à la demande, message par message,
+coûterait un appel au modèle par message et par requête : EmbeddingWorker les
+calcule à l'avance, par lots, et les range dans un fichier partagé.
+
+- Fichier vectors.f16 : matrice float16 dont la ligne i est le vecteur du
+  message d'id i (adressage direct, sans table d'index). Une ligne nulle est
+  un message pas encore plongé (ou un id jamais attribué). Le fichier grandit
+  par paliers de GROWTH_ROWS lignes ; il est creux : les lignes jamais écrites
+  n'occupent pas de disque.
+- Lecture : projection en mémoire (mmap) partagée, en lecture seule. Les pages
+  viennent du cache du système, commun à tous les workers uvicorn. Après
+  chaque bloc parcouru, madvise(MADV_DONTNEED) les retire de l'espace du
+  processus (pas du cache) : la mémoire résidente reste de l'ordre d'un bloc,
+  quelle que soit la taille du fichier.
+- Écriture : un seul processus à la fois (verrou flock sur writer.lock), par
+  pwrite. Les lecteurs voient les nouvelles lignes aussitôt (même cache de
+  pages) et reprojettent le fichier quand il grandit.
+- manifest.json : moteur d'embeddings, dimension et dernier id traité
+  (watermark). Changer de moteur impose de reconstruire le magasin.
+
+Les messages supprimés (rétention, suppression de conversation) gardent leur
+ligne : les résultats d'une recherche sont des ids, relus en base par
+l'appelant, qui ne retrouve donc que les messages existants.
+
+Le traitement suit l'ordre des ids. Les ids sont attribués à l'insertion, pas
+au commit : une transaction lente (import, écriture différée) peut valider un
+id inférieur au watermark après son passage. Chaque lot reprend donc aussi les
+EMBEDDING_RESCAN_IDS derniers ids sous le watermark et plonge ceux dont la
+ligne est encore nulle. Une date de message ne permettrait pas d'attendre ces
+transactions : created_at est la date de réception (ou celle d'origine pour un
+import), pas celle du commit.
+
+    python -m app.services.embedding_store backfill          # rattrapage complet
+    python -m app.services.embedding_store search "plage" --user-id 1
+"""
+
+import argparse
+import asyncio
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Sequence, Set, Tuple, Union
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.core.config import settings
+from app.models import Conversation, Message
+from app.services.embeddings import TextEmbedder, create_embedder, top_indices
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.f16"
+LOCK_FILE = "writer.lock"
+# Le fichier est agrandi par paliers de lignes (un ftruncate, pas de copie)
+GROWTH_ROWS = 65536
+# Lignes lues (et converties en float32) à la fois par une recherche
+SEARCH_BLOCK_ROWS = 8192
+
+class EmbeddingStore:
+    """Vecteurs float16 des messages, indexés par id, dans un fichier projeté en mémoire."""
+
+    def __init__(self, path: Union[str, Path], embedder_name: str, dim: int):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.embedder_name = embedder_name
+        self.dim = dim
+        manifest = self._read_manifest()
+        if manifest is None:
+            self._write_manifest(0)
+        elif (manifest["embedder"], manifest["dim"]) != (embedder_name, dim):
+            raise ValueError(
+                f"Magasin d'embeddings construit avec {manifest['embedder']} (dimension {manifest['dim']}), "
+                f"incompatible avec {embedder_name} (dimension {dim}) : supprimer {self.path} pour le reconstruire"
+            )
+        self._fd = os.open(self.path / VECTORS_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock_fd: Optional[int] = None
+        self._mapped_bytes = -1
+        self._mapping: Tuple[Optional[mmap.mmap], Optional["np.ndarray"]] = (None, None)
+
+    @classmethod
+    def open(cls, path: Optional[Union[str, Path]] = None, embedder: Optional[TextEmbedder] = None) -> "EmbeddingStore":
+        """Magasin configuré (EMBEDDING_STORE_PATH), pour le moteur configuré par défaut."""
+        embedder = embedder or create_embedder()
+        return cls(path or settings.embedding_store_path, embedder.name, embedder.dim)
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * 2
+
+    # --- manifeste ---
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            return json.loads((self.path / MANIFEST_FILE).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, watermark: int) -> None:
+        manifest = {"embedder": self.embedder_name, "dim": self.dim, "watermark": watermark}
+        temporary = self.path / (MANIFEST_FILE + f".{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(temporary, self.path / MANIFEST_FILE)
+
+    @property
+    def watermark(self) -> int:
+        """Plus grand id de message déjà traité (relu sur disque : un autre processus a pu l'avancer)."""
+        return self._read_manifest()["watermark"]
+
+    # --- lecture ---
+
+    def _matrix(self) -> Tuple[Optional[mmap.mmap], "np.ndarray"]:
+        """Projection courante du fichier, refaite s'il a grandi depuis."""
+        import numpy as np
+
+        size = os.fstat(self._fd).st_size
+        if size != self._mapped_bytes:
+            if size == 0:
+                self._mapping = (None, np.zeros((0, self.dim), dtype=np.float16))
+            else:
+                # L'ancienne projection est libérée quand plus aucun tableau ne s'y réfère
+                mapped = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+                self._mapping = (mapped, np.frombuffer(mapped, dtype=np.float16).reshape(-1, self.dim))
+            self._mapped_bytes = size
+        return self._mapping
+
+    def _release(self, mapped: Optional[mmap.mmap], start_row: int, end_row: int) -> None:
+        """Retire de la mémoire du processus les pages des lignes [start_row, end_row) (elles restent en cache)."""
+        if mapped is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        start = start_row * self.row_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+        end = min(end_row * self.row_bytes, len(mapped))
+        if end > start:
+            mapped.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def __len__(self) -> int:
+        """Nombre de lignes du fichier (id maximal adressable + 1)."""
+        return os.fstat(self._fd).st_size // self.row_bytes
+
+    def get(self, message_id: int) -> Optional["np.ndarray"]:
+        """Vecteur float32 d'un message, ou None s'il n'a pas encore été calculé."""
+        import numpy as np
+
+        _, matrix = self._matrix()
+        if not 0 <= message_id < len(matrix):
+            return None
+        vector = np.asarray(matrix[message_id], dtype=np.float32)
+        return vector if vector.any() else None
+
+    def missing(self, ids: Sequence[int]) -> List[int]:
+        """Ids (croissants) parmi `ids` dont le vecteur n'a pas encore été écrit (ligne nulle)."""
+        import numpy as np
+
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return []
+        mapped, matrix = self._matrix()
+        present = np.zeros(len(ids), dtype=bool)
+        inside = (ids >= 0) & (ids < len(matrix))
+        if inside.any():
+            present[inside] = matrix[ids[inside]].any(axis=1)
+            self._release(mapped, int(ids[inside].min()), int(ids[inside].max()) + 1)
+        return sorted(int(message_id) for message_id in ids[~present])
+
+    def search(
+        self,
+        query: "np.ndarray",
+        k: int = 10,
+        ids: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Les `k` messages les plus proches de `query` (similarité cosinus), parmi
+        `ids` si fourni (les messages d'un utilisateur, par exemple), sinon
+        parmi tous : liste de (id, score) par score décroissant.
+        """
+        import numpy as np
+
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+        mapped, matrix = self._matrix()
+
+        found_ids, found_scores = [], []
+        # Tampon float32 réutilisé d'un bloc à l'autre (pas de nouvelle allocation par bloc)
+        buffer = np.empty((SEARCH_BLOCK_ROWS, self.dim), dtype=np.float32)
+
+        def score_block(block_ids: "np.ndarray", rows: "np.ndarray") -> None:
+            block = buffer[:len(rows)]
+            np.copyto(block, rows)
+            scores = block @ query
+            # Lignes nulles (messages pas encore plongés) : score exactement 0, écartées
+            scores[scores == 0] = -np.inf
+            best = top_indices(scores, k)
+            best = best[np.isfinite(scores[best])]
+            found_ids.append(block_ids[best])
+            found_scores.append(scores[best])
+
+        if ids is None:
+            for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+                end = min(start + SEARCH_BLOCK_ROWS, len(matrix))
+                score_block(np.arange(start, end), matrix[start:end])
+                self._release(mapped, start, end)
+        else:
+            ids = np.unique(np.asarray(ids, dtype=np.int64))
+            ids = ids[(ids >= 0) & (ids < len(matrix))]
+            for start in range(0, len(ids), SEARCH_BLOCK_ROWS):
+                block_ids = ids[start:start + SEARCH_BLOCK_ROWS]
+                # Lecture des seules lignes demandées
+                score_block(block_ids, matrix[block_ids])
+                self._release(mapped, int(block_ids[0]), int(block_ids[-1]) + 1)
+
+        if not found_ids:
+            return []
+        all_ids, all_scores = np.concatenate(found_ids), np.concatenate(found_scores)
+        best = top_indices(all_scores, k)
+        return [(int(all_ids[i]), float(all_scores[i])) for i in best]
+
+    # --- écriture (un seul processus : voir acquire_writer) ---
+
+    def acquire_writer(self) -> bool:
+        """Prend le verrou d'écriture sans attendre ; False s'il est tenu par un autre processus."""
+        import fcntl
+
+        if self._lock_fd is not None:
+            return True
+        lock_fd = os.open(self.path / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            return False
+        self._lock_fd = lock_fd
+        return True
+
+    def release_writer(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # libère le verrou flock
+            self._lock_fd = None
+
+    def write(self, ids: Sequence[int], vectors: "np.ndarray") -> None:
+        """Écrit les vecteurs des messages `ids` (croissants), en agrandissant le fichier si besoin."""
+        import numpy as np
+
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float16)
+        rows = (int(ids.max()) // GROWTH_ROWS + 1) * GROWTH_ROWS
+        if rows * self.row_bytes > os.fstat(self._fd).st_size:
+            os.ftruncate(self._fd, rows * self.row_bytes)
+        # Un pwrite par suite d'ids consécutifs (le cas courant : ids attribués en séquence)
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        for run_ids, run_vectors in zip(np.split(ids, breaks), np.split(vectors, breaks)):
+            os.pwrite(self._fd, run_vectors.tobytes(), int(run_ids[0]) * self.row_bytes)
+
+    def set_watermark(self, message_id: int) -> None:
+        self._write_manifest(message_id)
+
+    def close(self) -> None:
+        self.release_writer()
+        self._mapping = (None, None)
+        os.close(self._fd)
+
+class EmbeddingWorker:
+    """Tâche de fond : plonge par lots les messages qui n'ont pas encore de vecteur."""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        store: EmbeddingStore,
+        embedder: Optional[TextEmbedder] = None,
+        batch_size: Optional[int] = None,
+        interval_seconds: Optional[float] = None,
+        rescan_ids: Optional[int] = None,
+    ):
+        self.session_factory = session_factory
+        self.store = store
+        self.embedder = embedder or create_embedder()
+        self.batch_size = batch_size or settings.embedding_batch_size
+        self.interval_seconds = settings.embedding_interval_seconds if interval_seconds is None else interval_seconds
+        self.rescan_ids = settings.embedding_rescan_ids if rescan_ids is None else rescan_ids
+        self._task: Optional[asyncio.Task] = None
+        self.embedded = 0
+        # Messages plongés en vecteur nul (texte vide ou fait de mots vides) : leur
+        # ligne reste nulle, on ne les reprend pas à chaque lot
+        self._empty_ids: Set[int] = set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self) -> None:
+        """Arrête la tâche de fond (le lot en cours est abandonné, il sera refait)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.store.release_writer()
+
+    async def run_once(self) -> int:
+        """
+        Plonge le lot suivant de messages (par id croissant) et avance le
+        watermark, avec les messages validés en retard sous le watermark.
+        Retourne le nombre de messages traités. Le verrou d'écriture doit être
+        tenu (acquire_writer).
+        """
+        watermark = self.store.watermark
+        async with self.session_factory() as db:
+            late_ids: List[int] = []
+            if self.rescan_ids and watermark:
+                result = await db.execute(
+                    select(Message.id).where(Message.id > watermark - self.rescan_ids, Message.id <= watermark)
+                )
+                missing = await asyncio.to_thread(self.store.missing, result.scalars().all())
+                late_ids = [message_id for message_id in missing if message_id not in self._empty_ids][:self.batch_size]
+            late = []
+            if late_ids:
+                result = await db.execute(
+                    select(Message.id, Message.content).where(Message.id.in_(late_ids)).order_by(Message.id)
+                )
+                late = result.all()
+            result = await db.execute(
+                select(Message.id, Message.content)
+                .where(Message.id > watermark)
+                .order_by(Message.id)
+                .limit(self.batch_size)
+            )
+            fresh = result.all()
+        rows = late + fresh
+        if not rows:
+            return 0
+        vectors = await asyncio.to_thread(self.embedder.embed, [row.content for row in rows])
+        await asyncio.to_thread(self.store.write, [row.id for row in rows], vectors)
+        self._empty_ids = {message_id for message_id in self._empty_ids if message_id > watermark - self.rescan_ids}
+        self._empty_ids.update(row.id for row, vector in zip(rows, vectors) if not vector.any())
+        if fresh:
+            self.store.set_watermark(fresh[-1].id)
+        self.embedded += len(rows)
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            # Un seul worker uvicorn écrit ; les autres retentent (relève si l'écrivain s'arrête)
+            processed = 0
+            if self.store.acquire_writer():
+                try:
+                    processed = await self.run_once()
+                except Exception as e:
+                    print(f"⚠️ Calcul des embeddings en échec, nouvel essai plus tard : {e}")
+            # Rattrapage : on enchaîne les lots pleins sans attendre
+            if processed < self.batch_size:
+                await asyncio.sleep(self.interval_seconds)
+
+async def backfill(session_factory: async_sessionmaker, store: EmbeddingStore, embedder: TextEmbedder) -> int:
+    """Plonge tous les messages existants (CLI) ; retourne le nombre de messages traités."""
+    if not store.acquire_writer():
+        raise RuntimeError(f"Le magasin {store.path} est déjà en cours d'écriture (application démarrée ?)")
+    worker = EmbeddingWorker(session_factory, store, embedder)
+    try:
+        while await worker.run_once():
+            pass
+    finally:
+        store.release_writer()
+    return worker.embedded
+
+async def _search(session_factory: async_sessionmaker, store: EmbeddingStore, embedder: TextEmbedder,
+                  query: str, user_id: Optional[int], k: int) -> None:
+    ids = None
+    async with session_factory() as db:
+        if user_id is not None:
+            result = await db.execute(
+                select(Message.id).join(Conversation, Conversation.id == Message.conversation_id)
+                .where(Conversation.user_id == user_id)
+            )
+            ids = result.scalars().all()
+        hits = store.search(embedder.embed([query])[0], k=k, ids=ids)
+        contents = dict((await db.execute(
+            select(Message.id, Message.content).where(Message.id.in_([message_id for message_id, _ in hits]))
+        )).all())
+    for message_id, score in hits:
+        if message_id in contents:
+            print(f"{score:.3f}  #{message_id}  {contents[message_id][:120]}")
+
+def main() -> None:
+    from app.core.database import get_engine, get_session_factory
+
+    parser = argparse.ArgumentParser(description="Magasin d'embeddings des messages.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("backfill", help="calcule les embeddings de tous les messages pas encore traités")
+    search = subparsers.add_parser("search", help="messages les plus proches d'un texte")
+    search.add_argument("query")
+    search.add_argument("--user-id", type=int, default=None, help="messages de cet utilisateur uniquement")
+    search.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    embedder = create_embedder()
+    store = EmbeddingStore.open(embedder=embedder)
+
+    async def run() -> None:
+        try:
+            if args.command == "backfill":
+                count = await backfill(get_session_factory(), store, embedder)
+                print(f"✅ {count} messages plongés (watermark {store.watermark})")
+            else:
+                await _search(get_session_factory(), store, embedder, args.query, args.user_id, args.k)
+        finally:
+            store.close()
+            await get_engine().dispose()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
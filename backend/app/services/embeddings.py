@@ -0,0 +1,192 @@
+"""
+Embeddings calculés localement, par lots, sans appel réseau.
+
+Trois moteurs interchangeables (EMBEDDING_BACKEND), qui exposent tous `name`,
+`dim` et `embed(texts)` -> matrice float32 de vecteurs normalisés :
+- "hashing" (défaut) : HashingEmbedder, sans modèle ni dépendance ;
+- "sentence-transformers" : modèle local (EMBEDDING_MODEL, paquet optionnel
+  `sentence-transformers`), plus fin sur le sens des phrases ;
+- "stub" : vecteurs pseudo-aléatoires déterministes, sans aucun sens, pour les
+  tests et les benchmarks (comme le faux modèle de LLM_BACKEND=fake).
+
+HashingEmbedder projette un texte dans un espace de dimension fixe par
+hachage de caractéristiques ("feature hashing") : mots normalisés (sans
+accents, sans mots vides) et trigrammes de caractères de chaque mot, qui
+rapprochent "hôtel" et "hotels" ou absorbent une faute de frappe. Le hachage
+(crc32) est stable d'un processus à l'autre : un index construit hors ligne
+reste interrogeable par tous les workers. Les vecteurs sont normalisés (norme
+L2 = 1) : le produit scalaire est la similarité cosinus.
+
+top_k() cherche les vecteurs les plus proches dans une matrice éventuellement
+projetée en mémoire (np.memmap), par blocs : seul le bloc en cours est
+chargé (et converti en float32 si besoin).
+
+NumPy est importé au premier usage (l'import de l'application ne l'attend pas).
+"""
+
+import re
+import zlib
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Protocol, Sequence, Tuple
+
+from app.core.config import settings
+from app.repositories.message_search import FRENCH_STOPWORDS
+from app.services.response_cache import normalize_question
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Poids d'un trigramme de caractères relativement à un mot entier
+TRIGRAM_WEIGHT = 0.5
+# Lignes de la matrice chargées (et converties en float32) à la fois par top_k()
+SEARCH_BLOCK_ROWS = 65536
+
+@lru_cache(maxsize=100_000)
+def word_hashes(word: str) -> Tuple[int, ...]:
+    """
+    Hachés (crc32) des caractéristiques d'un mot : le mot sans accents puis
+    ses trigrammes de caractères. Mis en cache (normalisation comprise) : le
+    vocabulaire est bien plus petit que le nombre de mots plongés.
+    """
+    word = normalize_question(word)
+    padded = f"#{word}#"
+    features = [word] + ["#" + padded[i:i + 3] for i in range(len(padded) - 2)]
+    return tuple(zlib.crc32(feature.encode()) for feature in features)
+
+def text_words(text: str) -> List[str]:
+    """Mots d'un texte en minuscules, hors mots vides."""
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in FRENCH_STOPWORDS]
+
+class TextEmbedder(Protocol):
+    """Moteur d'embeddings : `embed` renvoie une matrice float32 (len(texts), dim) de vecteurs normalisés."""
+
+    name: str
+    dim: int
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray": ...
+
+class HashingEmbedder:
+    """Embeddings par hachage de caractéristiques : déterministes, hors ligne, sans modèle."""
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        """Vecteurs normalisés des textes, matrice float32 (len(texts), dim)."""
+        import numpy as np
+
+        hashes, weights, rows = [], [], []
+        for row, text in enumerate(texts):
+            for word in text_words(text):
+                features = word_hashes(word)
+                hashes.extend(features)
+                weights.append(1.0)
+                weights.extend([TRIGRAM_WEIGHT] * (len(features) - 1))
+                rows.extend([row] * len(features))
+        hashes = np.array(hashes, dtype=np.int64)
+        # Le bit de poids fort donne le signe : les collisions se compensent en moyenne
+        signed = np.where(hashes >> 31, -1.0, 1.0) * np.array(weights, dtype=np.float64)
+        # Un seul comptage pour tout le lot : case (texte, dimension) = row * dim + hash % dim
+        cells = np.array(rows, dtype=np.int64) * self.dim + hashes % self.dim
+        counts = np.bincount(cells, weights=signed, minlength=len(texts) * self.dim).reshape(len(texts), self.dim)
+        # Atténue les mots répétés (équivalent signé de 1 + log(tf))
+        vectors = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+class StubEmbedder:
+    """Vecteurs pseudo-aléatoires tirés du crc32 du texte : déterministes, instantanés, sans sens."""
+
+    name = "stub"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        import numpy as np
+
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row] = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(self.dim)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+class SentenceTransformerEmbedder:
+    """
+    Modèle sentence-transformers exécuté localement (CPU). Hors ligne une fois
+    le modèle présent dans le cache Hugging Face (HF_HUB_OFFLINE=1 pour
+    l'imposer) ou si EMBEDDING_MODEL est un dossier local.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "EMBEDDING_BACKEND=sentence-transformers nécessite le paquet `sentence-transformers` "
+                "(pip install sentence-transformers)."
+            ) from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"sentence-transformers:{model_name}"
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        import numpy as np
+
+        vectors = self.model.encode(
+            list(texts), batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        )
+        return vectors.astype(np.float32, copy=False)
+
+@lru_cache(maxsize=None)
+def create_embedder(backend: Optional[str] = None) -> TextEmbedder:
+    """
+    Moteur configuré (EMBEDDING_BACKEND, EMBEDDING_DIM, EMBEDDING_MODEL), créé
+    une fois par processus et partagé : base de connaissances et magasin
+    d'embeddings ne chargent pas deux fois le même modèle.
+    """
+    backend = backend or settings.embedding_backend
+    if backend == "hashing":
+        return HashingEmbedder(settings.embedding_dim)
+    if backend == "sentence-transformers":
+        return SentenceTransformerEmbedder(settings.embedding_model)
+    if backend == "stub":
+        return StubEmbedder(settings.embedding_dim)
+    raise ValueError(f"EMBEDDING_BACKEND inconnu : {backend} (hashing, sentence-transformers ou stub)")
+
+def top_indices(scores: "np.ndarray", k: int) -> "np.ndarray":
+    """Indices des `k` plus grands scores, par score décroissant (argpartition : pas de tri complet)."""
+    import numpy as np
+
+    if k <= 0:
+        # argpartition(scores, -0)[-0:] renverrait tous les indices
+        return np.empty(0, dtype=np.intp)
+    if len(scores) > k:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def top_k(matrix: "np.ndarray", query: "np.ndarray", k: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Indices et scores (produit scalaire) des `k` lignes de `matrix` les plus
+    proches de `query`, par score décroissant. La matrice est parcourue par
+    blocs de SEARCH_BLOCK_ROWS lignes.
+    """
+    import numpy as np
+
+    query = np.asarray(query, dtype=np.float32)
+    best_indices = np.empty(0, dtype=np.intp)
+    best_scores = np.empty(0, dtype=np.float32)
+    for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+        scores = np.asarray(matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32) @ query
+        candidates = top_indices(scores, k)
+        best_indices = np.concatenate([best_indices, candidates + start])
+        best_scores = np.concatenate([best_scores, scores[candidates]])
+        keep = top_indices(best_scores, k)
+        best_indices, best_scores = best_indices[keep], best_scores[keep]
+    return best_indices, best_scores
@@ -0,0 +1,135 @@
+"""
+Faux modèle de chat, remplaçant local et déterministe de ChatOpenAI.
+
+Activé avec LLM_BACKEND=fake : toute l'application (chat, streaming, résumés)
+fonctionne alors sans réseau ni clé OpenAI, ce qui permet de mesurer le débit
+du serveur lui-même (voir benchmarks/load_test.py).
+
+Le comportement est paramétrable :
+- latence avant le premier token (`latency_seconds`) ;
+- débit de génération (`tokens_per_second`) et longueur de réponse (`completion_tokens`) ;
+- taux d'erreur (`error_rate`), tiré avec un générateur aléatoire initialisé par
+  `seed` : deux exécutions avec les mêmes paramètres échouent aux mêmes appels.
+
+Un "token" est ici un mot suivi d'une espace.
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+
+from app.core.config import settings
+
+# Vocabulaire des réponses générées
+WORDS = (
+    "Nice", "offre", "une", "promenade", "le", "long", "de", "la", "mer",
+    "avec", "des", "plages", "de", "galets", "et", "un", "vieux", "port",
+    "animé", "à", "découvrir", "en", "fin", "de", "journée", "🏖️",
+)
+
+class FakeChatOpenAI(BaseChatModel):
+    """Modèle de chat simulé : latence, débit et erreurs configurables, réponses déterministes."""
+
+    latency_seconds: float = 0.5
+    tokens_per_second: float = 50.0
+    completion_tokens: int = 60
+    error_rate: float = 0.0
+    seed: int = 42
+
+    _rng: random.Random = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+
+    @classmethod
+    def from_settings(cls) -> "FakeChatOpenAI":
+        return cls(
+            latency_seconds=settings.fake_llm_latency_seconds,
+            tokens_per_second=settings.fake_llm_tokens_per_second,
+            completion_tokens=settings.fake_llm_completion_tokens,
+            error_rate=settings.fake_llm_error_rate,
+            seed=settings.fake_llm_seed,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-openai"
+
+    def _maybe_fail(self) -> None:
+        """Simule une erreur réseau d'OpenAI avec la probabilité error_rate."""
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise openai.APIConnectionError(
+                message="Erreur simulée (faux modèle)",
+                request=httpx.Request("POST", "https://fake-llm.local/v1/chat/completions"),
+            )
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        """Réponse déterministe : dépend uniquement de la longueur de la dernière question."""
+        offset = len(messages[-1].content) if messages else 0
+        return [f"{WORDS[(offset + i) % len(WORDS)]} " for i in range(self.completion_tokens)]
+
+    def _generation_seconds(self) -> float:
+        return self.completion_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        self._maybe_fail()
+        time.sleep(self._generation_seconds())
+        content = "".join(self._tokens(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        self._maybe_fail()
+        await asyncio.sleep(self._generation_seconds())
+        content = "".join(self._tokens(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_seconds)
+        self._maybe_fail()
+        for token in self._tokens(messages):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_seconds)
+        self._maybe_fail()
+        for token in self._tokens(messages):
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
@@ -0,0 +1,414 @@
+"""
+Cache des derniers messages de chaque conversation (historique "chaud").
+
+À chaque tour, le contexte envoyé au modèle est construit à partir des derniers
+messages de la conversation : les mêmes lignes que le tour précédent vient
+d'écrire. Ce cache garde en mémoire une fenêtre des `history_cache_window`
+derniers messages par conversation :
+
+- écriture immédiate (write-through) : le repository ajoute chaque message
+  enregistré à la fenêtre, après le commit ; une conversation créée démarre
+  avec une fenêtre vide et complète. En régime établi, la lecture de
+  l'historique ne fait donc plus de SELECT ;
+- une fenêtre est "complète" quand elle contient toute la conversation : elle
+  sert alors aussi GET /api/conversations/{id} ;
+- durée de vie (TTL), éviction LRU au-delà de `history_cache_max_bytes`
+  (taille estimée des messages), compteurs exposés par /api/cache/history/stats ;
+- remplissage conditionnel : chaque ajout ou invalidation incrémente la
+  génération de la conversation. Une fenêtre lue en base n'est enregistrée que
+  si la génération n'a pas changé depuis le début de la lecture : un message
+  validé entre le SELECT et l'enregistrement (dont l'ajout ne trouvait pas de
+  fenêtre à compléter) ne peut pas être masqué jusqu'à l'expiration du TTL.
+
+Le cache en mémoire est local au processus. Avec plusieurs workers, chaque
+worker aurait sa propre copie, périmée dès qu'un autre worker écrit : il faut
+alors un stockage partagé, HISTORY_CACHE_URL (Redis, paquet `redis` requis).
+"""
+
+import json
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Request
+
+from app.core.config import settings
+
+# Taille estimée d'un message en mémoire, hors texte (objet, attributs, date)
+MESSAGE_OVERHEAD_BYTES = 250
+# Générations conservées en mémoire (conversations récemment écrites)
+MAX_TRACKED_GENERATIONS = 100_000
+
+@dataclass
+class CachedMessage:
+    """Copie d'un message, indépendante de la session SQLAlchemy qui l'a chargé."""
+    id: int
+    conversation_id: int
+    content: str
+    is_bot: bool
+    token_count: Optional[int]
+    created_at: datetime
+
+    @classmethod
+    def from_message(cls, message: Any) -> "CachedMessage":
+        return cls(
+            id=message.id,
+            conversation_id=message.conversation_id,
+            content=message.content,
+            is_bot=message.is_bot,
+            token_count=message.token_count,
+            created_at=message.created_at,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "conversation_id": self.conversation_id,
+            "content": self.content,
+            "is_bot": self.is_bot,
+            "created_at": self.created_at.isoformat()
+        }
+
+    def size(self) -> int:
+        return sys.getsizeof(self.content) + MESSAGE_OVERHEAD_BYTES
+
+@dataclass
+class HistoryWindow:
+    """Derniers messages d'une conversation, en ordre chronologique."""
+    messages: List[CachedMessage]
+    # True si la fenêtre contient tous les messages de la conversation
+    complete: bool
+
+    def append(self, message: CachedMessage, size: int) -> None:
+        """Ajoute un message à sa place (created_at, id) et garde les `size` derniers."""
+        key = (message.created_at, message.id)
+        index = len(self.messages)
+        while index > 0 and (self.messages[index - 1].created_at, self.messages[index - 1].id) > key:
+            index -= 1
+        self.messages.insert(index, message)
+        if len(self.messages) > size:
+            del self.messages[:len(self.messages) - size]
+            self.complete = False
+
+class HistoryCacheStore(ABC):
+    """Stockage des fenêtres (en mémoire, ou partagé entre workers)."""
+
+    @abstractmethod
+    async def get(self, conversation_id: int) -> Optional[HistoryWindow]:
+        """Fenêtre en cache de la conversation, ou None."""
+
+    @abstractmethod
+    async def generation(self, conversation_id: int) -> int:
+        """Compteur incrémenté par chaque ajout ou suppression sur la conversation."""
+
+    @abstractmethod
+    async def set(self, conversation_id: int, window: HistoryWindow, generation: Optional[int] = None) -> bool:
+        """
+        Enregistre la fenêtre ; si `generation` est donnée, seulement si la
+        génération de la conversation n'a pas changé. Retourne True si enregistrée.
+        """
+
+    @abstractmethod
+    async def append(self, message: CachedMessage, size: int) -> None:
+        """Ajoute un message à la fenêtre de sa conversation, si elle est en cache (et incrémente la génération)."""
+
+    @abstractmethod
+    async def delete(self, conversation_id: int) -> None:
+        """Supprime la fenêtre et incrémente la génération."""
+
+    def stats(self) -> Dict[str, float]:
+        return {}
+
+    async def aclose(self) -> None:
+        pass
+
+class InMemoryHistoryCacheStore(HistoryCacheStore):
+    """Fenêtres en mémoire du processus : LRU borné en octets, avec TTL."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # {conversation_id: (fenêtre, date de chargement, taille estimée)}
+        self._windows: "OrderedDict[int, Tuple[HistoryWindow, float, int]]" = OrderedDict()
+        self.memory_bytes = 0
+        self.evictions = 0
+        # Générations issues d'un compteur global croissant : une conversation
+        # oubliée (au-delà de MAX_TRACKED_GENERATIONS) prend la plus grande
+        # génération oubliée, jamais une valeur déjà lue avant une écriture.
+        self._generations: "OrderedDict[int, int]" = OrderedDict()
+        self._generation_counter = 0
+        self._forgotten_generation = 0
+
+    async def get(self, conversation_id: int) -> Optional[HistoryWindow]:
+        cached = self._windows.get(conversation_id)
+        if cached is None:
+            return None
+        window, loaded_at, _ = cached
+        if time.monotonic() - loaded_at > self.ttl_seconds:
+            self._drop(conversation_id)
+            return None
+        self._windows.move_to_end(conversation_id)
+        return window
+
+    async def generation(self, conversation_id: int) -> int:
+        return self._generations.get(conversation_id, self._forgotten_generation)
+
+    async def set(self, conversation_id: int, window: HistoryWindow, generation: Optional[int] = None) -> bool:
+        if generation is not None and generation != await self.generation(conversation_id):
+            return False
+        self._drop(conversation_id)
+        self._store(conversation_id, window, time.monotonic())
+        return True
+
+    async def append(self, message: CachedMessage, size: int) -> None:
+        self._bump(message.conversation_id)
+        cached = self._windows.pop(message.conversation_id, None)
+        if cached is None:
+            return
+        window, loaded_at, window_bytes = cached
+        self.memory_bytes -= window_bytes
+        window.append(message, size)
+        # Le TTL court depuis le chargement : une fenêtre très active est tout de même relue de temps en temps
+        self._store(message.conversation_id, window, loaded_at)
+
+    async def delete(self, conversation_id: int) -> None:
+        self._bump(conversation_id)
+        self._drop(conversation_id)
+
+    def _drop(self, conversation_id: int) -> None:
+        cached = self._windows.pop(conversation_id, None)
+        if cached is not None:
+            self.memory_bytes -= cached[2]
+
+    def _bump(self, conversation_id: int) -> None:
+        self._generation_counter += 1
+        self._generations.pop(conversation_id, None)
+        self._generations[conversation_id] = self._generation_counter
+        while len(self._generations) > MAX_TRACKED_GENERATIONS:
+            _, forgotten = self._generations.popitem(last=False)
+            self._forgotten_generation = max(self._forgotten_generation, forgotten)
+
+    def _store(self, conversation_id: int, window: HistoryWindow, loaded_at: float) -> None:
+        window_bytes = sum(message.size() for message in window.messages) + MESSAGE_OVERHEAD_BYTES
+        self._windows[conversation_id] = (window, loaded_at, window_bytes)
+        self.memory_bytes += window_bytes
+        while self.memory_bytes > self.max_bytes and len(self._windows) > 1:
+            _, (_, _, evicted_bytes) = self._windows.popitem(last=False)
+            self.memory_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "conversations": len(self._windows),
+            "memory_bytes": self.memory_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+# Ajout atomique d'un message à une fenêtre stockée en JSON (si elle existe),
+# avec incrément de la génération (KEYS[2]).
+# cjson encode une liste vide en objet ({}) : on la relit comme une liste vide.
+REDIS_APPEND_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+local raw = redis.call('GET', KEYS[1])
+if not raw then return 0 end
+local window = cjson.decode(raw)
+local messages = {}
+if type(window.messages) == 'table' then
+  for _, message in ipairs(window.messages) do table.insert(messages, message) end
+end
+table.insert(messages, cjson.decode(ARGV[1]))
+local size = tonumber(ARGV[2])
+while #messages > size do
+  table.remove(messages, 1)
+  window.complete = false
+end
+window.messages = messages
+redis.call('SET', KEYS[1], cjson.encode(window), 'KEEPTTL')
+return 1
+"""
+
+# Enregistrement d'une fenêtre si la génération (KEYS[2]) vaut toujours ARGV[3]
+REDIS_SET_IF_GENERATION_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[3]) then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+REDIS_DELETE_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return redis.call('DEL', KEYS[1])
+"""
+
+class RedisHistoryCacheStore(HistoryCacheStore):
+    """Fenêtres partagées entre workers, dans Redis (TTL et mémoire gérés par Redis)."""
+
+    def __init__(self, url: str, ttl_seconds: float, prefix: str = "travelbot:history:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("HISTORY_CACHE_URL nécessite le paquet `redis` (pip install redis).") from e
+        self.client = redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        # Une génération survit largement à la fenêtre qu'elle protège
+        self.generation_ttl_seconds = max(86400, 2 * int(ttl_seconds))
+        self._append = self.client.register_script(REDIS_APPEND_SCRIPT)
+        self._set_if_generation = self.client.register_script(REDIS_SET_IF_GENERATION_SCRIPT)
+        self._delete = self.client.register_script(REDIS_DELETE_SCRIPT)
+
+    def _keys(self, conversation_id: int) -> List[str]:
+        return [self.prefix + str(conversation_id), self.prefix + "generation:" + str(conversation_id)]
+
+    @staticmethod
+    def _encode_message(message: CachedMessage) -> Dict[str, Any]:
+        data = asdict(message)
+        data["created_at"] = message.created_at.isoformat()
+        return data
+
+    @staticmethod
+    def _decode_message(data: Dict[str, Any]) -> CachedMessage:
+        data["created_at"] = datetime.fromisoformat(data["created_at"])
+        return CachedMessage(**data)
+
+    async def get(self, conversation_id: int) -> Optional[HistoryWindow]:
+        raw = await self.client.get(self.prefix + str(conversation_id))
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        messages = data["messages"] or []  # {} : liste vide encodée par cjson
+        return HistoryWindow([self._decode_message(m) for m in messages], data["complete"])
+
+    async def generation(self, conversation_id: int) -> int:
+        return int(await self.client.get(self._keys(conversation_id)[1]) or 0)
+
+    async def set(self, conversation_id: int, window: HistoryWindow, generation: Optional[int] = None) -> bool:
+        data = {"messages": [self._encode_message(m) for m in window.messages], "complete": window.complete}
+        raw = json.dumps(data, ensure_ascii=False)
+        ttl = max(1, int(self.ttl_seconds))
+        if generation is None:
+            await self.client.set(self.prefix + str(conversation_id), raw, ex=ttl)
+            return True
+        return bool(await self._set_if_generation(keys=self._keys(conversation_id), args=[raw, ttl, generation]))
+
+    async def append(self, message: CachedMessage, size: int) -> None:
+        await self._append(
+            keys=self._keys(message.conversation_id),
+            args=[json.dumps(self._encode_message(message), ensure_ascii=False), size, self.generation_ttl_seconds]
+        )
+
+    async def delete(self, conversation_id: int) -> None:
+        await self._delete(keys=self._keys(conversation_id), args=[self.generation_ttl_seconds])
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+class HistoryCache:
+    """Fenêtres des derniers messages par conversation, avec compteurs de hits."""
+
+    def __init__(
+        self,
+        store: Optional[HistoryCacheStore] = None,
+        window_size: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+    ):
+        self.window_size = window_size or settings.history_cache_window
+        self.store = store or InMemoryHistoryCacheStore(
+            max_bytes or settings.history_cache_max_bytes,
+            ttl_seconds or settings.history_cache_ttl_seconds
+        )
+        self.hits = 0
+        self.misses = 0
+
+    async def recent(self, conversation_id: int, limit: int, after_id: Optional[int] = None) -> Optional[List[CachedMessage]]:
+        """
+        Les `limit` derniers messages (postérieurs à after_id), ou None si la
+        fenêtre en cache ne suffit pas à répondre (ou est absente).
+        """
+        window = await self.store.get(conversation_id)
+        result = window_recent(window, limit, after_id) if window is not None else None
+        self._count(result is not None)
+        return result
+
+    async def first(self, conversation_id: int, limit: int) -> Optional[List[CachedMessage]]:
+        """Les `limit` premiers messages, si la fenêtre contient toute la conversation ; sinon None."""
+        window = await self.store.get(conversation_id)
+        result = window.messages[:limit] if window is not None and window.complete else None
+        self._count(result is not None)
+        return result
+
+    async def generation(self, conversation_id: int) -> int:
+        """Génération de la conversation, à lire avant le SELECT qui remplira la fenêtre."""
+        return await self.store.generation(conversation_id)
+
+    async def put(
+        self,
+        conversation_id: int,
+        messages: List[Any],
+        complete: bool,
+        generation: Optional[int] = None
+    ) -> bool:
+        """
+        Enregistre la fenêtre (les window_size derniers messages) lue en base.
+        Avec `generation`, la fenêtre est abandonnée si un message a été ajouté
+        (ou la conversation invalidée) depuis : retourne alors False.
+        """
+        cached = [CachedMessage.from_message(message) for message in messages[-self.window_size:]]
+        window = HistoryWindow(cached, complete and len(messages) <= self.window_size)
+        return await self.store.set(conversation_id, window, generation)
+
+    async def append(self, message: Any) -> None:
+        await self.store.append(CachedMessage.from_message(message), self.window_size)
+
+    async def invalidate(self, conversation_id: int) -> None:
+        await self.store.delete(conversation_id)
+
+    def _count(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "window_size": self.window_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            **self.store.stats(),
+        }
+
+    async def aclose(self) -> None:
+        await self.store.aclose()
+
+def window_recent(window: HistoryWindow, limit: int, after_id: Optional[int] = None) -> Optional[List[CachedMessage]]:
+    """
+    Les `limit` derniers messages d'id > after_id, si la fenêtre permet de répondre :
+    elle contient toute la conversation, ou remonte avant after_id, ou compte
+    au moins `limit` messages après after_id.
+    """
+    messages = window.messages
+    reaches_after_id = after_id is not None and any(m.id <= after_id for m in messages)
+    if after_id is not None:
+        messages = [m for m in messages if m.id > after_id]
+    if window.complete or reaches_after_id or len(messages) >= limit:
+        return messages[-limit:] if limit else []
+    return None
+
+def create_history_cache(url: Optional[str] = None) -> HistoryCache:
+    url = url or settings.history_cache_url
+    if url:
+        return HistoryCache(RedisHistoryCacheStore(url, settings.history_cache_ttl_seconds))
+    return HistoryCache()
+
+def get_history_cache(request: Request) -> Optional[HistoryCache]:
+    """Dépendance FastAPI : cache partagé créé dans le lifespan, ou None s'il est désactivé."""
+    return getattr(request.app.state, "history_cache", None)
@@ -0,0 +1,294 @@
+"""
+Base de connaissances locale des destinations (RAG, hors ligne).
+
+Le prompt système demande au modèle des prix, horaires et moyens de
+transport : sans données, il les devine ou multiplie les précautions. On lui
+fournit donc, pour chaque question, les fiches de lieux (POI) les plus
+pertinentes, extraites d'une base construite à l'avance :
+
+1. Ingestion : fichiers CSV ou JSON de POI (nom, ville, catégorie,
+   description, adresse, horaires, prix, accès).
+2. Découpage : chaque POI donne un ou plusieurs extraits de CHUNK_MAX_CHARS
+   caractères au plus, coupés entre deux phrases et préfixés par l'en-tête du
+   lieu (nom, catégorie, ville) pour rester compréhensibles seuls.
+3. Embeddings calculés hors ligne (embeddings.create_embedder), sans réseau.
+4. Index : vecteurs float32 dans un fichier brut (vectors.f32) projeté en
+   mémoire (np.memmap), extraits dans chunks.jsonl, description dans
+   manifest.json. Le système partage les pages du fichier entre les workers.
+   Pas de float16 : NumPy n'a pas de produit matriciel rapide en float16 et
+   la conversion de chaque bloc quadruplerait le temps de recherche.
+
+Construction (depuis backend/) :
+    python -m app.services.knowledge_base build data/pois/*.csv data/pois/*.json
+    python -m app.services.knowledge_base search "horaires du musée des Confluences"
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from app.core.config import settings
+from app.services.context_builder import count_tokens
+from app.services.embeddings import TextEmbedder, create_embedder, top_k
+from app.services.prompts import KNOWLEDGE_PREFIX
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.jsonl"
+VECTORS_FILE = "vectors.f32"
+# Longueur maximale d'un extrait (en-tête compris)
+CHUNK_MAX_CHARS = 600
+# Extraits plongés et écrits à la fois pendant la construction
+BUILD_BATCH_SIZE = 512
+
+@dataclass
+class PointOfInterest:
+    name: str
+    city: str
+    category: str = ""
+    country: str = ""
+    description: str = ""
+    address: str = ""
+    opening_hours: str = ""
+    price: str = ""
+    transport: str = ""
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "PointOfInterest":
+        """POI depuis une ligne CSV ou un objet JSON (colonnes inconnues ignorées, nom et ville obligatoires)."""
+        values = {
+            field.name: str(record.get(field.name) or "").strip()
+            for field in fields(cls)
+        }
+        if not values["name"] or not values["city"]:
+            raise ValueError(f"POI sans nom ou sans ville : {record}")
+        return cls(**values)
+
+    @property
+    def header(self) -> str:
+        category = f" ({self.category})" if self.category else ""
+        place = f"{self.city}, {self.country}" if self.country else self.city
+        return f"{self.name}{category}, {place}"
+
+@dataclass
+class Chunk:
+    poi: str
+    city: str
+    text: str
+
+@dataclass
+class KnowledgeHit:
+    chunk: Chunk
+    score: float
+
+def load_pois(path: Union[str, Path]) -> Iterator[PointOfInterest]:
+    """POI d'un fichier CSV (en-tête de colonnes) ou JSON (liste, ou objet {"pois": [...]})."""
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with path.open(encoding="utf-8-sig", newline="") as file:
+            for record in csv.DictReader(file):
+                yield PointOfInterest.from_record(record)
+    elif path.suffix.lower() == ".json":
+        with path.open(encoding="utf-8") as file:
+            data = json.load(file)
+        for record in data["pois"] if isinstance(data, dict) else data:
+            yield PointOfInterest.from_record(record)
+    else:
+        raise ValueError(f"Format non pris en charge (CSV ou JSON attendu) : {path}")
+
+def chunk_poi(poi: PointOfInterest, max_chars: int = CHUNK_MAX_CHARS) -> List[Chunk]:
+    """
+    Découpe un POI en extraits : informations pratiques puis description,
+    regroupées phrase par phrase tant que l'extrait reste sous `max_chars`.
+    """
+    facts = [
+        f"{label} : {value.rstrip('.')}."
+        for label, value in (
+            ("Adresse", poi.address),
+            ("Horaires", poi.opening_hours),
+            ("Prix", poi.price),
+            ("Accès", poi.transport),
+        )
+        if value
+    ]
+    sentences = facts + re.split(r"(?<=[.!?])\s+", " ".join(poi.description.split()))
+    prefix = poi.header + " — "
+    chunks, current = [], ""
+    for sentence in filter(None, sentences):
+        candidate = f"{current} {sentence}" if current else sentence
+        if current and len(prefix) + len(candidate) > max_chars:
+            chunks.append(current)
+            candidate = sentence
+        current = candidate
+    if current or not chunks:
+        chunks.append(current)
+    # Une phrase plus longue que max_chars est tronquée plutôt que perdue
+    return [Chunk(poi=poi.name, city=poi.city, text=(prefix + text if text else poi.header)[:max_chars]) for text in chunks]
+
+def build_index(
+    sources: Iterable[Union[str, Path]],
+    output_dir: Union[str, Path],
+    embedder: Optional[TextEmbedder] = None,
+    batch_size: int = BUILD_BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    Construit l'index à partir des fichiers de POI, par lots de `batch_size`
+    extraits : la mémoire utilisée ne dépend pas du nombre de POI.
+
+    Les fichiers sont écrits sous un nom temporaire et ne remplacent l'index
+    existant qu'une fois complets : une construction interrompue le laisse
+    intact. Retourne le manifeste.
+    """
+    import numpy as np
+
+    embedder = embedder or create_embedder()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    sources = [str(source) for source in sources]
+    count = pois = 0
+
+    def chunks() -> Iterator[Chunk]:
+        nonlocal pois
+        for source in sources:
+            for poi in load_pois(source):
+                pois += 1
+                yield from chunk_poi(poi)
+
+    with open(output_dir / (CHUNKS_FILE + ".tmp"), "w", encoding="utf-8") as chunks_file, \
+            open(output_dir / (VECTORS_FILE + ".tmp"), "wb") as vectors_file:
+        batch: List[Chunk] = []
+        for chunk in chunks():
+            batch.append(chunk)
+            if len(batch) < batch_size:
+                continue
+            _write_batch(batch, embedder, chunks_file, vectors_file)
+            count += len(batch)
+            batch = []
+        if batch:
+            _write_batch(batch, embedder, chunks_file, vectors_file)
+            count += len(batch)
+        for file in (chunks_file, vectors_file):
+            file.flush()
+            os.fsync(file.fileno())
+
+    manifest = {
+        "embedder": embedder.name,
+        "dim": embedder.dim,
+        "dtype": np.dtype(np.float32).name,
+        "chunks": count,
+        "pois": pois,
+        "sources": sources,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+    (output_dir / (MANIFEST_FILE + ".tmp")).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    for name in (CHUNKS_FILE, VECTORS_FILE, MANIFEST_FILE):
+        os.replace(output_dir / (name + ".tmp"), output_dir / name)
+    return manifest
+
+def _write_batch(batch: Sequence[Chunk], embedder: TextEmbedder, chunks_file, vectors_file) -> None:
+    import numpy as np
+
+    vectors = embedder.embed([chunk.text for chunk in batch]).astype(np.float32, copy=False)
+    vectors_file.write(vectors.tobytes())
+    for chunk in batch:
+        chunks_file.write(json.dumps(asdict(chunk), ensure_ascii=False) + "\n")
+
+class KnowledgeBase:
+    """Index chargé : recherche des extraits les plus proches d'une question."""
+
+    def __init__(self, vectors: "np.ndarray", chunks: List[Chunk], embedder: TextEmbedder):
+        self.vectors = vectors
+        self.chunks = chunks
+        self.embedder = embedder
+
+    @classmethod
+    def load(cls, path: Union[str, Path], embedder: Optional[TextEmbedder] = None) -> "KnowledgeBase":
+        """
+        Ouvre un index construit par build_index. Les vecteurs restent sur
+        disque (np.memmap, lecture seule) ; lève ValueError si l'index a été
+        construit avec un autre embedder.
+        """
+        import numpy as np
+
+        path = Path(path)
+        embedder = embedder or create_embedder()
+        manifest = json.loads((path / MANIFEST_FILE).read_text(encoding="utf-8"))
+        if (manifest["embedder"], manifest["dim"]) != (embedder.name, embedder.dim):
+            raise ValueError(
+                f"Index construit avec {manifest['embedder']} (dimension {manifest['dim']}), "
+                f"incompatible avec {embedder.name} (dimension {embedder.dim}) : reconstruire l'index"
+            )
+        with open(path / CHUNKS_FILE, encoding="utf-8") as file:
+            chunks = [Chunk(**json.loads(line)) for line in file]
+        if manifest["chunks"]:
+            vectors = np.memmap(path / VECTORS_FILE, dtype=manifest["dtype"], mode="r", shape=(manifest["chunks"], manifest["dim"]))
+        else:
+            # np.memmap refuse les fichiers vides
+            vectors = np.zeros((0, manifest["dim"]), dtype=manifest["dtype"])
+        return cls(vectors, chunks, embedder)
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, question: str, k: Optional[int] = None, min_score: Optional[float] = None) -> List[KnowledgeHit]:
+        """Les `k` extraits les plus proches de la question, de score (cosinus) au moins `min_score`."""
+        k = k or settings.knowledge_base_top_k
+        min_score = settings.knowledge_base_min_score if min_score is None else min_score
+        if not self.chunks:
+            return []
+        query = self.embedder.embed([question])[0]
+        indices, scores = top_k(self.vectors, query, k)
+        return [
+            KnowledgeHit(chunk=self.chunks[index], score=float(score))
+            for index, score in zip(indices, scores)
+            if score >= min_score
+        ]
+
+    def context_for(self, question: str, max_tokens: Optional[int] = None) -> Optional[str]:
+        """
+        Texte injecté dans le prompt : les extraits pertinents, du plus proche au
+        plus lointain, dans la limite de `max_tokens`. None si rien n'est pertinent.
+        """
+        budget = (max_tokens or settings.knowledge_base_max_tokens) - count_tokens(KNOWLEDGE_PREFIX)
+        lines = []
+        for hit in self.search(question):
+            line = f"- {hit.chunk.text}"
+            cost = count_tokens(line) + 1
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        if not lines:
+            return None
+        return KNOWLEDGE_PREFIX + "\n".join(lines)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Base de connaissances locale des destinations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="construit l'index à partir de fichiers CSV / JSON de POI")
+    build.add_argument("sources", nargs="+", help="fichiers de POI (.csv ou .json)")
+    build.add_argument("--output", default=None, help="dossier de l'index (défaut : KNOWLEDGE_BASE_PATH)")
+    search = subparsers.add_parser("search", help="affiche les extraits les plus proches d'une question")
+    search.add_argument("question")
+    search.add_argument("-k", type=int, default=None, help="nombre d'extraits (défaut : KNOWLEDGE_BASE_TOP_K)")
+    search.add_argument("--path", default=None, help="dossier de l'index (défaut : KNOWLEDGE_BASE_PATH)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        manifest = build_index(args.sources, args.output or settings.knowledge_base_path)
+        print(f"✅ Index construit : {manifest['pois']} POI, {manifest['chunks']} extraits")
+    else:
+        knowledge_base = KnowledgeBase.load(args.path or settings.knowledge_base_path)
+        for hit in knowledge_base.search(args.question, k=args.k, min_score=0.0):
+            print(f"{hit.score:.3f}  {hit.chunk.text}")
+
+if __name__ == "__main__":
+    main()
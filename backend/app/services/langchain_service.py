@@ -1,122 +1,267 @@
 """
 Service LangChain : tout ce qui concerne l'IA.
-Gère la configuration du modèle, le prompt, la mémoire, et les appels à OpenAI.
+Gère la configuration du modèle, le prompt, et les appels à OpenAI.
+
+Une seule instance est créée au démarrage (lifespan) et partagée par toutes
+les requêtes : le client HTTP (pool de connexions keep-alive HTTP/2) et le
+prompt ne sont construits qu'une fois. Par requête, on ne fait plus que
+formater les messages.
+
+Si une base de connaissances locale est chargée (knowledge_base), les extraits
+les plus proches de la question sont ajoutés au prompt, juste après le prompt
+système : le modèle répond avec des prix, horaires et accès vérifiés.
+
+LangChain, OpenAI et httpx (plusieurs centaines de ms d'import) ne sont pas
+importés avec ce module : ils sont chargés au premier usage, ou en tâche de
+fond dès le démarrage (preload_ai_modules). Importer l'application, démarrer
+un worker ou répondre à /health ne les attend pas.
 """
 
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from typing import List, Dict
+import asyncio
+from functools import lru_cache
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Optional
+
+from fastapi import Request
 
 from app.core.config import settings
+from app.services.llm_resilience import ResilientLLM
+from app.services.prompts import SUMMARY_PREFIX, SUMMARY_SYSTEM_PROMPT, TRAVELBOT_SYSTEM_PROMPT
+from app.services.rate_limiter import ConcurrencyLimiter
 
-# ─────────────────────────────────────
-# PROMPT SYSTÈME : la "personnalité" du bot
-# ─────────────────────────────────────
-# Ce texte est envoyé à chaque requête comme contexte de base.
-# Il définit comment le bot doit se comporter.
-TRAVELBOT_SYSTEM_PROMPT = """
-Tu es TravelBot, un assistant touristique intelligent et enthousiaste.
-
-PERSONNALITÉ :
-- Chaleureux et accueillant
-- Expert en tourisme et voyage
-- Pratique et orienté solutions
-- Toujours positif
-
-RÈGLES :
-1. Réponds TOUJOURS en français
-2. Donne des recommandations personnalisées basées sur le contexte
-3. Inclus des détails pratiques (prix indicatifs, horaires, moyens de transport)
-4. Si tu ne sais pas quelque chose, dis-le honnêtement
-5. Reste concis (2-3 paragraphes max par réponse)
-
-SPÉCIALITÉS :
-- Activités touristiques et loisirs
-- Restaurants et gastronomie locale
-- Hébergements (hôtels, locations)
-- Transport et itinéraires
-- Événements culturels
-- Conseils pratiques de voyage
-
-STYLE :
-- Utilise des emojis occasionnellement (🏖️ 🍽️ 🎭)
-- Pose des questions de clarification si nécessaire
-- Propose des alternatives
-
-Ton objectif : Aider le voyageur à profiter au maximum de son expérience !
-"""
+if TYPE_CHECKING:
+    import httpx
+    import openai
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_core.messages import BaseMessage
+
+    from app.services.knowledge_base import KnowledgeBase
+
+def preload_ai_modules() -> None:
+    """
+    Importe LangChain, OpenAI et tiktoken, et charge l'encodage tiktoken.
+    Appelé dans un thread au démarrage : la première requête les trouve prêts.
+    """
+    try:
+        import langchain.prompts  # noqa: F401
+        import langchain_openai  # noqa: F401
+        import openai  # noqa: F401
+        from app.services.context_builder import get_encoding
+
+        get_encoding()
+        prompt_template()
+    except Exception as e:
+        # Pas bloquant : l'import sera retenté (et l'erreur levée) au premier usage
+        print(f"⚠️ Préchargement des modules IA impossible : {e}")
+
+@lru_cache(maxsize=1)
+def prompt_template() -> "ChatPromptTemplate":
+    """Construit une seule fois : le prompt ne dépend que des extraits, du résumé, de l'historique et de la question."""
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    return ChatPromptTemplate.from_messages([
+        ("system", TRAVELBOT_SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="knowledge"),
+        MessagesPlaceholder(variable_name="summary"),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "{input}"),
+    ])
+
+def create_http_client() -> "httpx.AsyncClient":
+    """Client HTTP partagé vers OpenAI : connexions keep-alive réutilisées, HTTP/2."""
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_connections,
+            keepalive_expiry=settings.openai_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+
+def to_langchain_messages(conversation_history: List[Dict[str, str]] = None) -> List["BaseMessage"]:
+    """Convertit l'historique [{"role": ..., "content": ...}] en messages LangChain."""
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    return [
+        AIMessage(content=item["content"]) if item["role"] == "assistant"
+        else HumanMessage(content=item["content"])
+        for item in (conversation_history or [])
+    ]
 
 class LangChainService:
     """
     Orchestre les appels à OpenAI via LangChain.
     """
-    def __init__(self):
+    def __init__(
+        self,
+        http_client: Optional["httpx.AsyncClient"] = None,
+        concurrency_limiter: Optional[ConcurrencyLimiter] = None,
+        knowledge_base: Optional["KnowledgeBase"] = None
+    ):
+        self._http_client = http_client
+        # Plafond global d'appels simultanés au modèle (protège le quota OpenAI)
+        self.concurrency_limiter = concurrency_limiter or ConcurrencyLimiter()
+        # Base de connaissances locale des destinations (optionnelle)
+        self.knowledge_base = knowledge_base
+        # Construits au premier usage (imports d'OpenAI et de LangChain)
+        self._openai_client: Optional["openai.AsyncOpenAI"] = None
+        self._llm: Optional[ResilientLLM] = None
+
+    @property
+    def http_client(self) -> "httpx.AsyncClient":
+        if self._http_client is None:
+            self._http_client = create_http_client()
+        return self._http_client
+
+    @property
+    def openai_client(self) -> "openai.AsyncOpenAI":
+        if self._openai_client is None:
+            import openai
+
+            self._openai_client = openai.AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                http_client=self.http_client,
+            )
+        return self._openai_client
+
+    @property
+    def llm(self) -> ResilientLLM:
+        """
+        Modèle principal puis modèle de repli éventuel, derrière la politique de
+        résilience (timeouts, tentatives, hedging, disjoncteurs).
+        """
+        if self._llm is None:
+            model_names = [settings.openai_model]
+            if settings.openai_fallback_model:
+                model_names.append(settings.openai_fallback_model)
+            self._llm = ResilientLLM([(name, self._create_chat_model(name)) for name in model_names])
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm: ResilientLLM) -> None:
+        self._llm = llm
+
+    @property
+    def prompt_template(self) -> "ChatPromptTemplate":
+        return prompt_template()
+
+    def _create_chat_model(self, model_name: str):
+        if settings.llm_backend == "fake":
+            # Faux modèle local (tests de charge) : aucun appel réseau
+            from app.services.fake_llm import FakeChatOpenAI
+            return FakeChatOpenAI.from_settings()
         # Le modèle OpenAI — temperature contrôle la créativité
-        # 0.0 = très déterministe, 1.0 = très créatif
-        self.llm = ChatOpenAI(
-            model=settings.openai_model,
+        # 0.0 = très déterministe, 1.0 = très créatif.
+        # max_retries=0 : les nouvelles tentatives sont gérées par ResilientLLM.
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            model=model_name,
             temperature=settings.openai_temperature,
             openai_api_key=settings.openai_api_key,
+            async_client=self.openai_client.with_options(max_retries=0).chat.completions,
+            max_retries=0,
         )
-        
-        self.prompt_template = ChatPromptTemplate.from_messages([
-            ("system", TRAVELBOT_SYSTEM_PROMPT),
-            MessagesPlaceholder(variable_name="history"),
-            ("human", "{input}"),
-        ])
-        
-    def create_conversation_chain(self, memory_type: str = "buffer") -> ConversationChain:
-        if memory_type == "buffer":
-            memory = ConversationBufferMemory(
-                return_messages=True,
-                memory_key="history"
-            )
-        elif memory_type == "window":
-            from langchain.memory import ConversationBufferWindowMemory
-            memory = ConversationBufferWindowMemory(
-                k=10,
-                return_messages=True,
-                memory_key="history"
-            )
-        else:
-            from langchain.memory import ConversationSummaryMemory
-            memory = ConversationSummaryMemory(
-                llm=self.llm,
-                return_messages=True,
-                memory_key="history"
-            )
-            
-        return ConversationChain(
-            llm=self.llm,
-            prompt=self.prompt_template,
-            memory=memory,
-            verbose=settings.debug,
-        )
-        
-    def load_history_into_memory(self, conversation:ConversationChain, history: List[Dict[str, str]]):
+
+    async def aclose(self) -> None:
+        """Ferme le pool de connexions HTTP (appelé à l'arrêt de l'application)."""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+
+    async def retrieve_knowledge(self, message: str) -> Optional[str]:
+        """
+        Extraits de la base de connaissances pertinents pour la question (None
+        sans base ou si rien n'est pertinent). Recherche faite dans un thread :
+        le calcul de similarité ne bloque pas la boucle d'événements.
         """
-        Charge l'historique depuis la DB dans la mémoire LangChain.
-        
-        history = [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}, ...]
+        if self.knowledge_base is None:
+            return None
+        return await asyncio.to_thread(self.knowledge_base.context_for, message)
+
+    def build_messages(
+        self,
+        message: str,
+        conversation_history: List[Dict[str, str]] = None,
+        summary: Optional[str] = None,
+        knowledge: Optional[str] = None
+    ) -> List["BaseMessage"]:
         """
-        for message in history:
-            if message["role"]=="user":
-                conversation.memory.chat_memory.add_user_message(message["content"])
-            elif message["role"]=="assistant":
-                conversation.memory.chat_memory.add_ai_message(message["content"])
-    
-    async def get_response(self, message:str, conversation_history: List[Dict[str, str]]=None) -> str:
+        Construit la liste des messages envoyés au modèle :
+        prompt système, extraits de la base de connaissances, résumé éventuel,
+        historique récent, question.
+
+        conversation_history = [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}, ...]
+        """
+        from langchain_core.messages import SystemMessage
+
+        return self.prompt_template.format_messages(
+            knowledge=[SystemMessage(content=knowledge)] if knowledge else [],
+            summary=[SystemMessage(content=SUMMARY_PREFIX + summary)] if summary else [],
+            history=to_langchain_messages(conversation_history),
+            input=message
+        )
+
+    async def get_response(
+        self,
+        message:str,
+        conversation_history: List[Dict[str, str]]=None,
+        summary: Optional[str] = None
+    ) -> str:
         """
         Obtient une réponse du bot pour un message donné et un historique.
         """
-        conversation = self.create_conversation_chain()
-        
-        if conversation_history:
-            self.load_history_into_memory(conversation, conversation_history)
-        
-        response = await conversation.apredict(input=message)
-        
-        return response
-        
\ No newline at end of file
+        knowledge = await self.retrieve_knowledge(message)
+        messages = self.build_messages(message, conversation_history, summary, knowledge)
+
+        async with self.concurrency_limiter.slot():
+            response = await self.llm.ainvoke(messages)
+
+        return response.content
+
+    async def stream_response(
+        self,
+        message: str,
+        conversation_history: List[Dict[str, str]] = None,
+        summary: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Produit la réponse du bot morceau par morceau, au fur et à mesure de la génération.
+        """
+        knowledge = await self.retrieve_knowledge(message)
+        messages = self.build_messages(message, conversation_history, summary, knowledge)
+
+        async with self.concurrency_limiter.slot():
+            async for chunk in self.llm.astream(messages):
+                if chunk.content:
+                    yield chunk.content
+
+    async def embed(self, text: str) -> List[float]:
+        """Calcule l'embedding d'un texte (utilisé par le cache sémantique des réponses)."""
+        response = await self.openai_client.embeddings.create(
+            model=settings.openai_embedding_model,
+            input=text,
+        )
+        return response.data[0].embedding
+
+    async def summarize(self, previous_summary: Optional[str], conversation_history: List[Dict[str, str]]) -> str:
+        """
+        Met à jour un résumé de conversation avec de nouveaux échanges (appelé en tâche de fond).
+        """
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        exchanges = "\n".join(
+            f"{'TravelBot' if item['role'] == 'assistant' else 'Voyageur'} : {item['content']}"
+            for item in conversation_history
+        )
+        async with self.concurrency_limiter.slot():
+            response = await self.llm.ainvoke([
+                SystemMessage(content=SUMMARY_SYSTEM_PROMPT),
+                HumanMessage(content=f"Résumé existant :\n{previous_summary or '(aucun)'}\n\nNouveaux échanges :\n{exchanges}"),
+            ])
+        return response.content
+
+def get_langchain_service(request: Request) -> LangChainService:
+    """Dépendance FastAPI : retourne l'instance partagée créée dans le lifespan."""
+    return request.app.state.langchain_service
@@ -0,0 +1,290 @@
+"""
+Appels au modèle résistants aux pannes et aux lenteurs du fournisseur.
+
+ResilientLLM enveloppe un ou plusieurs modèles de chat LangChain (le modèle
+principal puis, optionnellement, un modèle de repli moins cher ou plus rapide)
+et borne la latence de queue :
+
+- délai maximal par tentative (`llm_timeout_seconds`) et pour l'appel complet,
+  tentatives et repli compris (`llm_total_timeout_seconds`) ;
+- nouvelles tentatives sur les erreurs transitoires (timeout, réseau, 429, 5xx),
+  avec un délai exponentiel aléatoire ("full jitter") ;
+- requête doublée (hedging, optionnelle) : si la réponse n'est pas arrivée après
+  le p95 des latences observées, une seconde requête identique est lancée et la
+  première réponse reçue l'emporte ;
+- disjoncteur par modèle : après `circuit_breaker_failure_threshold` échecs
+  consécutifs, le modèle n'est plus appelé pendant `circuit_breaker_reset_seconds`
+  (on passe directement au repli), puis un appel d'essai décide de sa réouverture.
+
+En streaming, les tentatives et le repli ne s'appliquent qu'avant le premier
+token : une réponse déjà commencée ne peut pas être rejouée. Ensuite, chaque
+token doit arriver dans `llm_timeout_seconds` et avant la fin du délai total,
+sinon le flux s'arrête sur LLMUnavailableError.
+"""
+
+import asyncio
+import random
+import statistics
+import time
+from collections import deque
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.metrics import LLM_ATTEMPTS, LLM_FALLBACKS, LLM_HEDGES
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+@lru_cache(maxsize=1)
+def retryable_errors() -> Tuple[type, ...]:
+    """Erreurs transitoires : une nouvelle tentative a des chances de réussir (openai importé au premier appel)."""
+    import openai
+
+    return (
+        asyncio.TimeoutError,
+        openai.APIConnectionError,  # inclut APITimeoutError
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+class LLMUnavailableError(Exception):
+    """Aucun modèle n'a pu répondre dans le délai imparti (réponse 503)."""
+
+    def __init__(self, detail: str, retry_after: float = 1.0):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Disjoncteur : fermé (appels autorisés), ouvert (refusés), puis un appel d'essai."""
+
+    def __init__(self, failure_threshold: Optional[int] = None, reset_seconds: Optional[float] = None):
+        self.failure_threshold = failure_threshold or settings.circuit_breaker_failure_threshold
+        self.reset_seconds = reset_seconds or settings.circuit_breaker_reset_seconds
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self.retry_after() == 0 else "open"
+
+    def retry_after(self) -> float:
+        """Secondes avant qu'un appel d'essai soit autorisé (0 si fermé ou déjà possible)."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self.retry_after() > 0 or self._trial_in_flight:
+            return False
+        self._trial_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def abandon(self) -> None:
+        """Appel annulé avant sa fin : ni succès ni échec, un nouvel appel d'essai est permis."""
+        self._trial_in_flight = False
+
+class LatencyTracker:
+    """Latences récentes des appels réussis, pour le seuil de hedging (p95)."""
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self._samples) < self.MIN_SAMPLES:
+            return None
+        return statistics.quantiles(self._samples, n=20)[-1]
+
+class ResilientLLM:
+    """Modèle principal + repli, avec timeouts, tentatives, hedging et disjoncteurs."""
+
+    def __init__(
+        self,
+        models: Sequence[Tuple[str, Any]],
+        timeout: Optional[float] = None,
+        total_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_base_delay: Optional[float] = None,
+        retry_max_delay: Optional[float] = None,
+        hedge_after: Optional[float] = None,
+        hedging: Optional[bool] = None,
+    ):
+        self.models = list(models)
+        self.timeout = timeout or settings.llm_timeout_seconds
+        self.total_timeout = total_timeout or settings.llm_total_timeout_seconds
+        self.max_retries = max_retries if max_retries is not None else settings.llm_max_retries
+        self.retry_base_delay = retry_base_delay if retry_base_delay is not None else settings.llm_retry_base_delay_seconds
+        self.retry_max_delay = retry_max_delay or settings.llm_retry_max_delay_seconds
+        self.hedging = hedging if hedging is not None else settings.llm_hedging_enabled
+        self.hedge_after = hedge_after or settings.llm_hedge_after_seconds
+        self.breakers = {name: CircuitBreaker() for name, _ in self.models}
+        self.latencies = {name: LatencyTracker() for name, _ in self.models}
+
+    def _backoff(self, attempt: int) -> float:
+        """Délai avant la tentative suivante : aléatoire entre 0 et base * 2^attempt (plafonné)."""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    def _hedge_delay(self, name: str) -> Optional[float]:
+        if not self.hedging:
+            return None
+        return self.latencies[name].p95() or self.hedge_after
+
+    async def _call(self, name: str, model: Any, messages: List["BaseMessage"], timeout: float) -> "BaseMessage":
+        """Une tentative, doublée après le seuil de hedging si la réponse tarde."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        hedge_delay = self._hedge_delay(name)
+        tasks = {asyncio.ensure_future(model.ainvoke(messages))}
+        error: Optional[BaseException] = None
+        try:
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    LLM_HEDGES.labels(name).inc()
+                    tasks.add(asyncio.ensure_future(model.ainvoke(messages)))
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks,
+                    timeout=max(0.0, deadline - loop.time()),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _attempts(self, name: str, operation, deadline: float):
+        """
+        Exécute operation(timeout) avec tentatives et disjoncteur.
+        Retourne son résultat, ou None si le modèle est indisponible (disjoncteur,
+        échecs répétés ou délai total épuisé). Les erreurs non transitoires sont levées.
+        """
+        loop = asyncio.get_running_loop()
+        breaker = self.breakers[name]
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not breaker.allow():
+                return None
+            start = loop.time()
+            try:
+                result = await operation(min(self.timeout, remaining))
+            except retryable_errors() as e:
+                outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                LLM_ATTEMPTS.labels(name, outcome).inc()
+                breaker.record_failure()
+                print(f"⚠️ Appel au modèle {name} échoué (tentative {attempt + 1}) : {type(e).__name__}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(min(self._backoff(attempt), max(0.0, deadline - loop.time())))
+                continue
+            except Exception:
+                # Erreur non transitoire (requête invalide, authentification) : pas de
+                # nouvel essai. Elle ne dit rien de la santé du modèle : ni succès ni
+                # échec pour le disjoncteur (un appel d'essai ne le referme pas).
+                LLM_ATTEMPTS.labels(name, "error").inc()
+                breaker.abandon()
+                raise
+            except BaseException:
+                # Annulation (client déconnecté, copie de hedging, délai total) : sans
+                # cela, un appel d'essai annulé laisserait le disjoncteur bloqué.
+                breaker.abandon()
+                raise
+            LLM_ATTEMPTS.labels(name, "success").inc()
+            breaker.record_success()
+            self.latencies[name].record(loop.time() - start)
+            return result
+        return None
+
+    def _unavailable(self) -> LLMUnavailableError:
+        retry_after = min(
+            (breaker.retry_after() for breaker in self.breakers.values() if breaker.retry_after() > 0),
+            default=1.0
+        )
+        return LLMUnavailableError("Le modèle est momentanément indisponible, réessayez plus tard.", retry_after)
+
+    async def ainvoke(self, messages: List["BaseMessage"]) -> "BaseMessage":
+        deadline = asyncio.get_running_loop().time() + self.total_timeout
+        for index, (name, model) in enumerate(self.models):
+            if index > 0:
+                LLM_FALLBACKS.labels(name).inc()
+
+            async def operation(timeout: float, name=name, model=model):
+                return await self._call(name, model, messages, timeout)
+
+            result = await self._attempts(name, operation, deadline)
+            if result is not None:
+                return result
+        raise self._unavailable()
+
+    async def astream(self, messages: List["BaseMessage"]) -> AsyncIterator[Any]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout
+        for index, (name, model) in enumerate(self.models):
+            if index > 0:
+                LLM_FALLBACKS.labels(name).inc()
+            opened: List[Tuple[AsyncIterator[Any], Any]] = []
+
+            async def operation(timeout: float, model=model):
+                # La tentative réussit dès que le premier morceau arrive dans le délai
+                stream = model.astream(messages)
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    first = None  # réponse vide
+                except BaseException:
+                    await stream.aclose()
+                    raise
+                opened.append((stream, first))
+                return True
+
+            if await self._attempts(name, operation, deadline):
+                stream, first = opened[-1]
+                try:
+                    if first is not None:
+                        yield first
+                    while True:
+                        # Chaque morceau suivant doit arriver dans le délai par tentative
+                        # et avant la fin du délai total : un flux bloqué ne tient pas la
+                        # requête indéfiniment.
+                        timeout = min(self.timeout, deadline - loop.time())
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), max(0.0, timeout))
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            LLM_ATTEMPTS.labels(name, "timeout").inc()
+                            self.breakers[name].record_failure()
+                            print(f"⚠️ Flux du modèle {name} interrompu : aucun token depuis {timeout:.1f} s")
+                            raise self._unavailable()
+                        yield chunk
+                finally:
+                    await stream.aclose()
+                return
+        raise self._unavailable()
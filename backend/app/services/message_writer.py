@@ -0,0 +1,195 @@
+"""
+Écriture différée des messages (write-behind, optionnelle).
+
+Avec WRITE_BEHIND_ENABLED=True, un tour de chat ne fait plus les INSERT de ses
+messages avant de répondre : le message utilisateur (avant l'appel au modèle)
+puis la réponse du bot (après) sont placés dans une file en mémoire, et une
+tâche de fond les enregistre par lots (un seul INSERT multi-lignes et un commit
+par lot). La réponse part donc sans attendre la base. Exception : le message
+utilisateur d'un envoi avec clé d'idempotence est écrit tout de suite par le
+service de chat (voir chatbot_service).
+
+- Mémoire bornée : la file contient au plus `write_behind_max_pending` envois.
+  Quand elle est pleine, enqueue() attend qu'une place se libère : les requêtes
+  ralentissent au rythme de la base au lieu d'accumuler des messages (backpressure).
+- Lecture de ses propres écritures : avant de lire une conversation (historique
+  d'un nouveau tour, GET /api/conversations/{id}), on attend que ses messages en
+  file soient enregistrés (wait_for). Le délai est celui d'un lot, pas d'un tour.
+- Arrêt : aclose(), appelé dans le lifespan, enregistre tout ce qui reste en file.
+- Chaque mise en file (enqueue) est enregistrée en entier ou pas du tout :
+  ses lignes sont toujours dans le même INSERT. Le message utilisateur et la
+  réponse d'un tour de chat sont deux mises en file distinctes : la question
+  peut être enregistrée sans sa réponse (appel au modèle en échec).
+
+La file est locale au processus (un worker) : un message en file est perdu si
+le processus est tué brutalement (SIGKILL). Un arrêt normal la vide.
+"""
+
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.core.config import settings
+from app.core.metrics import WRITE_BEHIND_BATCH_ROWS, WRITE_BEHIND_PENDING
+from app.models import Message
+from app.services.history_cache import HistoryCache
+
+# Ligne de la table messages, prête pour l'INSERT
+MessageRow = Dict[str, Any]
+
+def message_row(
+    conversation_id: int,
+    content: str,
+    is_bot: bool,
+    token_count: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+    created_at: Optional[datetime] = None,
+) -> MessageRow:
+    """Valeurs d'un message (toutes les colonnes : l'INSERT multi-lignes exige les mêmes clés)."""
+    return {
+        "conversation_id": conversation_id,
+        "content": content,
+        "is_bot": is_bot,
+        "token_count": token_count,
+        "idempotency_key": idempotency_key,
+        "created_at": created_at or datetime.now(timezone.utc),
+    }
+
+class MessageWriter:
+    """File de messages à enregistrer, vidée par lots par une tâche de fond."""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        history_cache: Optional[HistoryCache] = None,
+    ):
+        self.session_factory = session_factory
+        # Les lignes sont écrites sans RETURNING : les fenêtres en cache des
+        # conversations écrites sont invalidées (relues au prochain tour).
+        self.history_cache = history_cache
+        self.batch_size = batch_size or settings.write_behind_batch_size
+        # Chaque élément de la file est un envoi (liste de lignes écrites ensemble)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending or settings.write_behind_max_pending)
+        # Lignes en attente par conversation, et réponses en attente par clé d'idempotence
+        self._pending: Counter = Counter()
+        self._pending_replies: Dict[str, MessageRow] = {}
+        self._flushed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def pending(self, conversation_id: Optional[int] = None) -> int:
+        """Lignes pas encore enregistrées (d'une conversation, ou au total)."""
+        if conversation_id is None:
+            return sum(self._pending.values())
+        return self._pending[conversation_id]
+
+    def pending_reply(self, idempotency_key: str) -> Optional[MessageRow]:
+        """Réponse du bot encore en file pour cette clé d'idempotence, ou None."""
+        return self._pending_replies.get(idempotency_key)
+
+    async def enqueue(self, rows: List[MessageRow]) -> None:
+        """Ajoute des messages à la file (enregistrés ensemble) ; attend une place si elle est pleine."""
+        for row in rows:
+            self._pending[row["conversation_id"]] += 1
+            if row["idempotency_key"]:
+                self._pending_replies[row["idempotency_key"]] = row
+        WRITE_BEHIND_PENDING.inc(len(rows))
+        await self._queue.put(rows)
+
+    async def wait_for(self, conversation_id: int) -> None:
+        """Attend que les messages en file de cette conversation soient enregistrés."""
+        if not self._pending[conversation_id]:
+            return
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: not self._pending[conversation_id])
+
+    async def flush(self) -> None:
+        """Attend que toute la file soit enregistrée."""
+        await self._queue.join()
+
+    async def aclose(self) -> None:
+        """Enregistre ce qui reste en file puis arrête la tâche de fond (arrêt de l'application)."""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        print(f"💾 File d'écriture vidée ({self.written} messages enregistrés, {self.dropped} perdus)")
+
+    async def _run(self) -> None:
+        while True:
+            # Un lot = le premier tour attendu + tout ce qui est déjà en file : sous
+            # charge les lots grossissent, au repos un tour est écrit aussitôt.
+            batch = [await self._queue.get()]
+            rows = len(batch[0])
+            while rows < self.batch_size and not self._queue.empty():
+                turn = self._queue.get_nowait()
+                batch.append(turn)
+                rows += len(turn)
+            try:
+                await self._write(batch)
+            finally:
+                await self._release(batch)
+
+    async def _write(self, batch: List[List[MessageRow]]) -> None:
+        rows = [row for turn in batch for row in turn]
+        try:
+            async with self.session_factory() as db:
+                await db.execute(insert(Message).values(rows))
+                await db.commit()
+            self.written += len(rows)
+            WRITE_BEHIND_BATCH_ROWS.observe(len(rows))
+            await self._invalidate(rows)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                self.dropped += len(rows)
+                print(f"❌ Écriture différée : tour perdu (conversation {rows[0]['conversation_id']}) : {e}")
+                return
+            print(f"⚠️ Écriture différée : lot de {len(rows)} messages refusé ({type(e).__name__}), écriture tour par tour")
+        # Un tour invalide (conversation supprimée, clé d'idempotence en double)
+        # ne doit pas faire perdre les autres tours du lot.
+        for turn in batch:
+            await self._write([turn])
+
+    async def _invalidate(self, rows: List[MessageRow]) -> None:
+        if self.history_cache is None:
+            return
+        for conversation_id in {row["conversation_id"] for row in rows}:
+            try:
+                await self.history_cache.invalidate(conversation_id)
+            except Exception as e:
+                print(f"⚠️ Écriture différée : invalidation du cache d'historique impossible : {e}")
+
+    async def _release(self, batch: List[List[MessageRow]]) -> None:
+        for turn in batch:
+            for row in turn:
+                self._pending[row["conversation_id"]] -= 1
+                if not self._pending[row["conversation_id"]]:
+                    del self._pending[row["conversation_id"]]
+                if row["idempotency_key"]:
+                    self._pending_replies.pop(row["idempotency_key"], None)
+            WRITE_BEHIND_PENDING.dec(len(turn))
+            self._queue.task_done()
+        async with self._flushed:
+            self._flushed.notify_all()
+
+def get_message_writer(request: Request) -> Optional[MessageWriter]:
+    """Dépendance FastAPI : file d'écriture partagée créée dans le lifespan, ou None si désactivée."""
+    return getattr(request.app.state, "message_writer", None)
@@ -0,0 +1,173 @@
+"""
+Limitation de débit devant le modèle.
+
+Deux protections complémentaires :
+- par utilisateur : un seau à jetons (token bucket) de `rate_limit_burst` jetons,
+  rechargé à `rate_limit_per_minute` jetons par minute. Une requête sans jeton
+  disponible attend son jeton si l'attente reste sous `rate_limit_max_wait_seconds`,
+  sinon elle est refusée (429 + Retry-After) ;
+- globale : au plus `llm_max_concurrency` appels au modèle simultanés
+  (sémaphore, voir LangChainService). Au-delà, la requête attend une place
+  pendant `llm_queue_timeout_seconds`, puis reçoit un 429.
+
+L'état des seaux est en mémoire (un worker). Avec plusieurs workers, on peut le
+partager via RATE_LIMIT_STORE_URL (Redis, paquet `redis` requis).
+"""
+
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import Request
+
+from app.core.config import settings
+
+class RateLimitExceeded(Exception):
+    """Limite atteinte : le client peut réessayer après `retry_after` secondes (réponse 429)."""
+
+    def __init__(self, retry_after: float, detail: str = "Trop de requêtes, réessayez plus tard."):
+        super().__init__(detail)
+        self.retry_after = retry_after
+        self.detail = detail
+
+class RateLimitStore(ABC):
+    """Stockage de l'état des seaux à jetons (en mémoire, ou partagé entre workers)."""
+
+    @abstractmethod
+    async def reserve(self, key: str, rate: float, capacity: int, max_wait: float) -> Tuple[bool, float]:
+        """
+        Réserve un jeton dans le seau `key`.
+        Retourne (accepté, attente) : si l'attente avant que le jeton soit disponible
+        dépasse max_wait, rien n'est réservé et l'attente sert de Retry-After.
+        """
+
+    async def aclose(self) -> None:
+        pass
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """Seaux en mémoire du processus : {clé: (jetons, date de mise à jour)}."""
+
+    # Au-delà, on oublie les seaux pleins (utilisateurs inactifs)
+    MAX_KEYS = 10_000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def reserve(self, key: str, rate: float, capacity: int, max_wait: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        # Le solde peut devenir négatif : ce sont des jetons réservés par des requêtes en attente
+        tokens = min(capacity, tokens + (now - updated_at) * rate) - 1
+        wait = -tokens / rate if tokens < 0 else 0.0
+        if wait > max_wait:
+            return False, wait
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.MAX_KEYS:
+            self._prune(now, rate, capacity)
+        return True, wait
+
+    def _prune(self, now: float, rate: float, capacity: int) -> None:
+        for key, (tokens, updated_at) in list(self._buckets.items()):
+            if tokens + (now - updated_at) * rate >= capacity:
+                del self._buckets[key]
+
+# Même algorithme qu'InMemoryRateLimitStore, exécuté atomiquement par Redis.
+# Les flottants sont renvoyés en texte (Redis tronque les nombres Lua en entiers).
+REDIS_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated_at) * rate) - 1
+local wait = 0
+if tokens < 0 then wait = -tokens / rate end
+if wait > max_wait then return {0, tostring(wait)} end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate + max_wait) + 1)
+return {1, tostring(wait)}
+"""
+
+class RedisRateLimitStore(RateLimitStore):
+    """Seaux partagés entre workers, dans Redis (script Lua atomique)."""
+
+    def __init__(self, url: str, prefix: str = "travelbot:ratelimit:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_STORE_URL nécessite le paquet `redis` (pip install redis).") from e
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(REDIS_TOKEN_BUCKET_SCRIPT)
+
+    async def reserve(self, key: str, rate: float, capacity: int, max_wait: float) -> Tuple[bool, float]:
+        allowed, wait = await self._script(keys=[self.prefix + key], args=[rate, capacity, max_wait])
+        return bool(int(allowed)), float(wait)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+def create_rate_limit_store(url: Optional[str] = None) -> RateLimitStore:
+    url = url or settings.rate_limit_store_url
+    return RedisRateLimitStore(url) if url else InMemoryRateLimitStore()
+
+class UserRateLimiter:
+    """Seau à jetons par utilisateur, avec attente bornée avant refus."""
+
+    def __init__(
+        self,
+        store: Optional[RateLimitStore] = None,
+        per_minute: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_wait_seconds: Optional[float] = None,
+    ):
+        self.store = store or InMemoryRateLimitStore()
+        self.rate = (per_minute or settings.rate_limit_per_minute) / 60
+        self.capacity = burst or settings.rate_limit_burst
+        self.max_wait = max_wait_seconds if max_wait_seconds is not None else settings.rate_limit_max_wait_seconds
+
+    async def acquire(self, user_id: int) -> None:
+        """Attend le jeton de l'utilisateur, ou lève RateLimitExceeded si l'attente serait trop longue."""
+        allowed, wait = await self.store.reserve(f"user:{user_id}", self.rate, self.capacity, self.max_wait)
+        if not allowed:
+            raise RateLimitExceeded(
+                retry_after=wait,
+                detail=f"Trop de messages pour l'utilisateur {user_id}, réessayez dans {wait:.0f} s."
+            )
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def aclose(self) -> None:
+        await self.store.aclose()
+
+class ConcurrencyLimiter:
+    """Nombre maximal d'appels simultanés au modèle, avec file d'attente bornée dans le temps."""
+
+    def __init__(self, max_concurrency: Optional[int] = None, queue_timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency or settings.llm_max_concurrency
+        self.queue_timeout = queue_timeout if queue_timeout is not None else settings.llm_queue_timeout_seconds
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Occupe une place pendant l'appel ; RateLimitExceeded si aucune ne se libère à temps."""
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise RateLimitExceeded(
+                retry_after=max(self.queue_timeout, 1.0),
+                detail="Le service est saturé, réessayez dans quelques secondes."
+            )
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+def get_user_rate_limiter(request: Request) -> Optional[UserRateLimiter]:
+    """Dépendance FastAPI : limiteur partagé créé dans le lifespan, ou None s'il est désactivé."""
+    return getattr(request.app.state, "user_rate_limiter", None)
@@ -0,0 +1,193 @@
+"""
+Cache des réponses aux questions touristiques fréquentes (optionnel).
+
+Beaucoup de questions se répètent à quelques variantes près ("meilleures activités
+à Nice", "Meilleures activités à Nice ?"). Pour une question posée SANS contexte
+(premier message d'une conversation), la réponse ne dépend que de la question :
+on peut la resservir sans appeler OpenAI.
+
+- Clé exacte : texte normalisé (minuscules, sans accents ni ponctuation).
+- Optionnellement, similarité sémantique : les questions sont plongées dans un
+  espace vectoriel (embeddings) et comparées par similarité cosinus avec un index
+  NumPy en mémoire, local au processus.
+- Taille bornée (éviction LRU), durée de vie (TTL), invalidation par question.
+- Compteurs de hits / misses exposés par /api/cache/stats.
+
+Le calcul d'embedding est un appel distant (OpenAI) : il est borné par
+RESPONSE_CACHE_EMBED_TIMEOUT_SECONDS et son échec ne fait jamais échouer le
+tour. La recherche se limite alors à la clé exacte, et la réponse est
+enregistrée sans vecteur.
+"""
+
+import asyncio
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import Request
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Fonction d'embedding asynchrone : texte -> vecteur
+Embedder = Callable[[str], Awaitable[List[float]]]
+
+def normalize_question(text: str) -> str:
+    """Normalise une question : minuscules, sans accents, sans ponctuation, espaces simples."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+@dataclass
+class CacheEntry:
+    response: str
+    created_at: float
+    vector: Optional["np.ndarray"] = None
+
+@dataclass
+class CacheLookup:
+    """Résultat d'une recherche : la réponse si hit, sinon de quoi l'enregistrer ensuite."""
+    key: str
+    response: Optional[str] = None
+    vector: Optional["np.ndarray"] = None
+
+class ResponseCache:
+    """Cache LRU + TTL des réponses, avec recherche sémantique optionnelle."""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        embedder: Optional[Embedder] = None,
+        similarity_threshold: Optional[float] = None,
+        embed_timeout_seconds: Optional[float] = None,
+    ):
+        self.max_entries = max_entries or settings.response_cache_max_entries
+        self.ttl_seconds = ttl_seconds or settings.response_cache_ttl_seconds
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold or settings.response_cache_similarity_threshold
+        self.embed_timeout_seconds = embed_timeout_seconds or settings.response_cache_embed_timeout_seconds
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Index vectoriel (matrice des vecteurs normalisés), reconstruit à la demande
+        self._index_keys: List[str] = []
+        self._index_matrix: Optional["np.ndarray"] = None
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.embed_errors = 0
+
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._index_matrix = None
+
+    def _search_similar(self, vector: "np.ndarray") -> Optional[str]:
+        """Retourne la clé de l'entrée la plus proche si elle dépasse le seuil de similarité."""
+        import numpy as np
+
+        if self._index_matrix is None:
+            self._index_keys = [key for key, entry in self._entries.items() if entry.vector is not None]
+            if not self._index_keys:
+                return None
+            self._index_matrix = np.stack([self._entries[key].vector for key in self._index_keys])
+
+        scores = self._index_matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity_threshold:
+            return self._index_keys[best]
+        return None
+
+    async def lookup(self, question: str) -> CacheLookup:
+        """Cherche une réponse pour la question (clé exacte, puis similarité si activée)."""
+        key = normalize_question(question)
+        result = CacheLookup(key=key)
+
+        entry = self._entries.get(key)
+        semantic = False
+        if entry is None and self.embedder is not None:
+            result.vector = await self._embed(key)
+            similar_key = self._search_similar(result.vector) if result.vector is not None else None
+            if similar_key is not None:
+                key, entry, semantic = similar_key, self._entries[similar_key], True
+
+        if entry is not None and self._is_expired(entry):
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return result
+
+        self.hits += 1
+        if semantic:
+            self.semantic_hits += 1
+        self._entries.move_to_end(key)
+        result.response = entry.response
+        return result
+
+    async def store(self, lookup: CacheLookup, response: str) -> None:
+        """Enregistre la réponse obtenue après un miss."""
+        vector = lookup.vector
+        if vector is None and self.embedder is not None:
+            vector = await self._embed(lookup.key)
+
+        self._remove(lookup.key)
+        self._entries[lookup.key] = CacheEntry(response=response, created_at=time.monotonic(), vector=vector)
+        self._index_matrix = None
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _embed(self, text: str) -> Optional["np.ndarray"]:
+        """Vecteur normalisé du texte, ou None si l'embedding échoue ou dépasse le délai."""
+        # NumPy n'est chargé que si la recherche sémantique est activée
+        import numpy as np
+
+        try:
+            embedding = await asyncio.wait_for(self.embedder(text), timeout=self.embed_timeout_seconds)
+        except Exception as e:
+            self.embed_errors += 1
+            print(f"⚠️ Cache des réponses : embedding indisponible ({type(e).__name__}), recherche exacte seulement")
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def invalidate(self, question: str) -> bool:
+        """Supprime l'entrée d'une question. Retourne True si elle existait."""
+        key = normalize_question(question)
+        existed = key in self._entries
+        self._remove(key)
+        return existed
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._index_matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "embed_errors": self.embed_errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+def get_response_cache(request: Request) -> Optional[ResponseCache]:
+    """Dépendance FastAPI : retourne le cache partagé, ou None s'il est désactivé."""
+    return getattr(request.app.state, "response_cache", None)
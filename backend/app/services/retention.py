@@ -0,0 +1,248 @@
+"""
+Rétention des conversations : archivage puis suppression des conversations
+inactives, et maintenance des partitions de messages (PostgreSQL).
+
+    python -m app.services.retention            # depuis backend/, chaque jour (cron)
+    python -m app.services.retention --days 180
+
+Une conversation est expirée quand elle a été créée et n'a reçu aucun message
+depuis `retention_days` jours. Par lots de `retention_batch_size` conversations :
+1. ses messages sont lus en flux (curseur côté serveur, jamais tout en mémoire)
+   et écrits dans un fichier JSONL compressé (une ligne par conversation) ;
+2. le fichier est renommé à son nom final une fois complet ;
+3. les conversations du lot sont supprimées par un seul DELETE, les messages
+   par la base (ON DELETE CASCADE). Une conversation qui a reçu un message
+   entre-temps n'est pas supprimée (elle figure aussi dans l'archive).
+
+Sur PostgreSQL, messages est partitionnée par mois (migration 0002) : le job
+crée les partitions des mois à venir (en y déplaçant les messages du mois déjà
+tombés dans la partition par défaut), puis supprime (DROP TABLE, sans VACUUM)
+les partitions antérieures à la date limite devenues vides. Une partition qui
+contient encore des messages de conversations actives est gardée jusqu'à ce
+qu'elles expirent à leur tour.
+
+Le cache d'historique des workers n'est pas invalidé : une conversation
+inactive depuis des mois n'y figure que si elle a été lue dans les
+`history_cache_ttl_seconds` précédents, et en sort à l'expiration.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, async_sessionmaker
+
+from app.core.config import settings
+from app.models import Conversation, Message
+from app.services.conversation_export import stream_conversations
+
+# Nom des partitions mensuelles créées par la migration 0002 : messages_pYYYYMM
+PARTITION_PREFIX = "messages_p"
+
+@dataclass
+class RetentionReport:
+    conversations: int = 0
+    messages: int = 0
+    archives: List[str] = field(default_factory=list)
+    created_partitions: List[str] = field(default_factory=list)
+    dropped_partitions: List[str] = field(default_factory=list)
+
+def month_start(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(month: datetime) -> datetime:
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+def partition_bounds(moment: datetime) -> Tuple[str, datetime, datetime]:
+    """Nom et bornes [début, fin) de la partition mensuelle qui contient `moment`."""
+    start = month_start(moment)
+    return f"{PARTITION_PREFIX}{start:%Y%m}", start, next_month(start)
+
+def expired_conversations(cutoff: datetime):
+    """Conversations créées avant `cutoff` et sans message depuis."""
+    recent_message = (
+        select(Message.id)
+        .where(Message.conversation_id == Conversation.id, Message.created_at >= cutoff)
+        .exists()
+    )
+    return Conversation.created_at < cutoff, ~recent_message
+
+async def archive_expired_conversations(
+    session_factory: async_sessionmaker,
+    cutoff: datetime,
+    archive_dir: Path,
+    batch_size: Optional[int] = None,
+    report: Optional[RetentionReport] = None,
+) -> RetentionReport:
+    """Archive puis supprime, lot par lot, les conversations expirées à `cutoff`."""
+    batch_size = batch_size or settings.retention_batch_size
+    report = report or RetentionReport()
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    last_id = 0
+    while True:
+        async with session_factory() as db:
+            # Pagination par id : chaque lot reprend après le précédent
+            ids = list((await db.execute(
+                select(Conversation.id)
+                .where(Conversation.id > last_id, *expired_conversations(cutoff))
+                .order_by(Conversation.id)
+                .limit(batch_size)
+            )).scalars())
+            if not ids:
+                return report
+            last_id = ids[-1]
+
+            path = archive_dir / f"conversations-{cutoff:%Y%m%d}-{ids[0]:010d}-{ids[-1]:010d}.jsonl.gz"
+            messages = await _write_archive(db, ids, path)
+
+            result = await db.execute(
+                delete(Conversation).where(Conversation.id.in_(ids), *expired_conversations(cutoff))
+            )
+            await db.commit()
+
+        report.conversations += result.rowcount
+        report.messages += messages
+        report.archives.append(str(path))
+        print(f"🗄️ {result.rowcount} conversations ({messages} messages) archivées dans {path.name}")
+
+async def _write_archive(db, ids: Sequence[int], path: Path) -> int:
+    """Écrit les conversations `ids` et leurs messages dans `path` ; retourne le nombre de messages."""
+    count = 0
+    partial = path.with_name(path.name + ".part")
+    # Même format que l'export NDJSON (réimportable), messages lus en flux
+    with gzip.open(partial, "wt", encoding="utf-8") as archive:
+        async for record in stream_conversations(db, Conversation.id.in_(ids)):
+            archive.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += len(record["messages"])
+    # Archive complète sur disque avant la suppression des lignes
+    with open(partial, "rb") as archive:
+        os.fsync(archive.fileno())
+    os.replace(partial, path)
+    return count
+
+async def ensure_partitions(conn: AsyncConnection, months_ahead: Optional[int] = None) -> List[str]:
+    """PostgreSQL : crée les partitions mensuelles manquantes jusqu'à `months_ahead` mois après le mois courant."""
+    if conn.dialect.name != "postgresql":
+        return []
+    months_ahead = settings.partition_months_ahead if months_ahead is None else months_ahead
+    existing = set(await _partitions(conn))
+    created = []
+    month = month_start(datetime.now(timezone.utc))
+    for _ in range(months_ahead + 1):
+        name, start, end = partition_bounds(month)
+        if name not in existing:
+            # Un mois en échec est sauté (savepoint) : les autres sont quand même créés
+            try:
+                async with conn.begin_nested():
+                    await _create_partition(conn, name, start, end)
+                created.append(name)
+            except Exception as e:
+                print(f"⚠️ Partition {name} non créée, réessayée au prochain passage : {e}")
+        month = end
+    return created
+
+async def _create_partition(conn: AsyncConnection, name: str, start: datetime, end: datetime) -> None:
+    """
+    Crée la partition [start, end[. PostgreSQL refuse de la créer si la partition
+    par défaut contient déjà des lignes de ce mois : elles y sont alors déplacées
+    (partition par défaut détachée le temps du déplacement, puis rattachée).
+    """
+    bounds = {"start": start, "end": end}
+    in_month = "created_at >= :start AND created_at < :end"
+    create = text(
+        f"CREATE TABLE {name} PARTITION OF messages "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+    if not await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM messages_default WHERE {in_month})"), bounds):
+        await conn.execute(create)
+        return
+
+    await conn.execute(text("ALTER TABLE messages DETACH PARTITION messages_default"))
+    await conn.execute(create)
+    # L'INSERT dans la partition réclame à nouveau les clés d'idempotence (trigger) :
+    # celles des lignes déplacées sont d'abord libérées.
+    await conn.execute(text(
+        "DELETE FROM message_idempotency_keys WHERE idempotency_key IN "
+        f"(SELECT idempotency_key FROM messages_default WHERE {in_month} AND idempotency_key IS NOT NULL)"
+    ), bounds)
+    # Colonnes du modèle : la colonne générée search_vector (migration 0003) est recalculée
+    columns = ", ".join(column.name for column in Message.__table__.columns)
+    moved = await conn.execute(text(
+        f"WITH moved AS (DELETE FROM messages_default WHERE {in_month} RETURNING {columns}) "
+        f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved"
+    ), bounds)
+    await conn.execute(text("ALTER TABLE messages ATTACH PARTITION messages_default DEFAULT"))
+    print(f"🗂️ {moved.rowcount} messages déplacés de messages_default vers {name}")
+
+async def drop_expired_partitions(conn: AsyncConnection, cutoff: datetime) -> List[str]:
+    """PostgreSQL : supprime les partitions entièrement antérieures à `cutoff` et vides."""
+    if conn.dialect.name != "postgresql":
+        return []
+    dropped = []
+    for name in await _partitions(conn):
+        start = datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m").replace(tzinfo=timezone.utc)
+        if next_month(start) > cutoff:
+            continue
+        if await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {name})")):
+            continue
+        await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        await conn.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    return dropped
+
+async def _partitions(conn: AsyncConnection) -> List[str]:
+    """Partitions mensuelles de messages (hors partition par défaut), par ordre chronologique."""
+    names = (await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'messages'::regclass"
+    ))).scalars()
+    return sorted(name for name in names if name.startswith(PARTITION_PREFIX) and name[len(PARTITION_PREFIX):].isdigit())
+
+async def run_retention(
+    days: Optional[int] = None,
+    archive_dir: Optional[str] = None,
+    batch_size: Optional[int] = None,
+) -> RetentionReport:
+    from app.core.database import get_engine, get_session_factory
+
+    days = settings.retention_days if days is None else days
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    report = RetentionReport()
+    try:
+        async with get_engine().begin() as conn:
+            report.created_partitions = await ensure_partitions(conn)
+
+        await archive_expired_conversations(
+            get_session_factory(), cutoff, Path(archive_dir or settings.retention_archive_dir), batch_size, report
+        )
+
+        async with get_engine().begin() as conn:
+            report.dropped_partitions = await drop_expired_partitions(conn, cutoff)
+    finally:
+        await get_engine().dispose()
+    return report
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Archive puis supprime les conversations inactives.")
+    parser.add_argument("--days", type=int, default=None, help="inactivité en jours (défaut : RETENTION_DAYS)")
+    parser.add_argument("--archive-dir", default=None, help="dossier des archives (défaut : RETENTION_ARCHIVE_DIR)")
+    parser.add_argument("--batch-size", type=int, default=None, help="conversations par lot")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_retention(args.days, args.archive_dir, args.batch_size))
+    print(
+        f"✅ Rétention : {report.conversations} conversations et {report.messages} messages archivés "
+        f"({len(report.archives)} fichiers), partitions créées {report.created_partitions or '-'}, "
+        f"supprimées {report.dropped_partitions or '-'}"
+    )
+
+if __name__ == "__main__":
+    main()
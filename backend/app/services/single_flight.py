@@ -0,0 +1,69 @@
+"""
+Regroupement des requêtes identiques en cours (single-flight).
+
+Quand un client renvoie la même question pendant que la première est encore
+traitée (double-clic, nouvel essai du frontend), on ne relance ni l'appel au
+modèle ni l'enregistrement des messages : les doublons attendent le résultat de
+la première requête et le partagent. Si la première requête est annulée (client
+déconnecté), un doublon en attente reprend le travail avec sa propre requête au
+lieu d'échouer avec elle.
+
+Le regroupement est local au processus (un worker). Entre workers, les nouvelles
+tentatives d'un client sont couvertes par l'en-tête Idempotency-Key.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from fastapi import Request
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """Exécute une seule fois les appels concurrents de même clé."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.shared = 0
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Exécute fn() si aucun appel de même clé n'est en cours, sinon attend son résultat.
+        Retourne (résultat, partagé). Une erreur du premier appel est transmise aux suivants ;
+        s'il est annulé, un appel en attente exécute son propre fn() à sa place.
+        """
+        while (future := self._calls.get(key)) is not None:
+            self.shared += 1
+            try:
+                # shield : l'annulation d'un appel en attente ne doit pas annuler le premier
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                # Premier appel annulé (client déconnecté) : les appels en attente ne
+                # sont pas annulés avec lui, le premier d'entre eux reprend le travail.
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Marque l'exception comme lue s'il n'y a aucun appel en attente
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+def get_single_flight(request: Request) -> Optional[SingleFlight]:
+    """Dépendance FastAPI : instance partagée créée dans le lifespan, ou None."""
+    return getattr(request.app.state, "single_flight", None)
@@ -0,0 +1,102 @@
+"""
+Service de résumé glissant des conversations.
+
+Le résumé d'une conversation est stocké en base (conversations.summary) et mis à
+jour en tâche de fond, APRÈS l'envoi de la réponse : la requête de l'utilisateur
+ne paie jamais l'appel LLM supplémentaire.
+
+Fonctionnement : dès que 2×K messages ne sont pas couverts par le résumé, on
+résume les plus anciens (tous sauf les K derniers) avec le résumé précédent.
+Le résumé avance donc par paquets d'environ K messages, et seuls les nouveaux
+échanges sont envoyés au modèle (mise à jour incrémentale). Une conversation
+très en retard (ancienne, jamais résumée) est rattrapée par appels successifs
+sur au plus 5×K messages, des plus anciens aux plus récents : aucun message
+n'est sauté.
+"""
+
+from typing import Optional, Set
+
+from fastapi import Request
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.core.config import settings
+from app.repositories.conversation_repository import ConversationRepository
+from app.services.langchain_service import LangChainService
+
+class ConversationSummarizer:
+    """Met à jour le résumé stocké d'une conversation quand elle a grandi de K messages."""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        langchain_service: LangChainService,
+        every_messages: Optional[int] = None,
+    ):
+        self.session_factory = session_factory
+        self.langchain_service = langchain_service
+        self.every_messages = every_messages or settings.summary_every_messages
+        # Conversations en cours de résumé (évite deux résumés concurrents)
+        self._running: Set[int] = set()
+
+    async def update_if_needed(self, conversation_id: int) -> bool:
+        """
+        Résume les anciens messages si nécessaire. Retourne True si le résumé a été mis à jour.
+        Les erreurs sont journalisées mais jamais propagées (tâche de fond).
+        """
+        if not settings.summary_enabled or conversation_id in self._running:
+            return False
+
+        self._running.add(conversation_id)
+        try:
+            updated = False
+            while True:
+                # Lecture dans une session courte, fermée avant l'appel au modèle :
+                # aucune connexion n'est tenue pendant le résumé.
+                async with self.session_factory() as db:
+                    repository = ConversationRepository(db)
+                    conversation = await repository.get_conversation(conversation_id)
+                    if conversation is None:
+                        return updated
+                    previous_summary = conversation.summary
+                    summary_message_id = conversation.summary_message_id
+                    # Les 5×K plus anciens messages non résumés : chaque appel de
+                    # résumé reste de taille bornée.
+                    pending = await repository.get_messages_after(
+                        conversation_id,
+                        after_id=summary_message_id,
+                        limit=5 * self.every_messages
+                    )
+                    if len(pending) < 2 * self.every_messages:
+                        return updated
+
+                    # On garde les K derniers messages hors du résumé : ils restent
+                    # envoyés tels quels au modèle.
+                    to_summarize = [
+                        {
+                            "role": "assistant" if msg.is_bot else "user",
+                            "content": msg.content
+                        }
+                        for msg in pending[:-self.every_messages]
+                    ]
+                    last_message_id = pending[-self.every_messages - 1].id
+
+                summary = await self.langchain_service.summarize(previous_summary, to_summarize)
+
+                # Écriture dans une nouvelle session courte, seulement si le résumé
+                # n'a pas avancé entre-temps (autre worker).
+                async with self.session_factory() as db:
+                    repository = ConversationRepository(db)
+                    conversation = await repository.get_conversation(conversation_id)
+                    if conversation is None or conversation.summary_message_id != summary_message_id:
+                        return updated
+                    await repository.update_summary(conversation, summary, last_message_id)
+                updated = True
+        except Exception as e:
+            print(f"❌ Erreur résumé de la conversation {conversation_id} : {e}")
+            return False
+        finally:
+            self._running.discard(conversation_id)
+
+def get_summarizer(request: Request) -> ConversationSummarizer:
+    """Dépendance FastAPI : retourne le service de résumé créé dans le lifespan."""
+    return request.app.state.summarizer
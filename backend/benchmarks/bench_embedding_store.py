@@ -0,0 +1,113 @@
+"""
+Benchmark : magasin d'embeddings des messages (float16, projeté en mémoire).
+
+Mesure :
+- le débit d'embedding par lots comparé au calcul message par message ;
+- l'écriture de N vecteurs dans le magasin ;
+- la latence d'une recherche cosinus sur tout le magasin et sur les messages
+  d'un utilisateur (quelques milliers d'ids) ;
+- la mémoire résidente du processus (VmRSS, Linux) après un parcours complet,
+  comparée à la taille brute des vecteurs.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_embedding_store
+    python -m benchmarks.bench_embedding_store --vectors 2000000 --dim 384
+"""
+
+import argparse
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from app.services.embedding_store import EmbeddingStore
+from app.services.embeddings import HashingEmbedder
+
+SENTENCES = [
+    "Quel hôtel me conseilles-tu à Lyon pour un week-end ?",
+    "Le musée des Beaux-Arts est ouvert du mercredi au lundi.",
+    "Je cherche une plage calme près de Biarritz avec des enfants.",
+    "Pour aller à la colline du Château, prenez l'ascenseur depuis le quai.",
+]
+
+
+def resident_mb() -> float:
+    """Mémoire résidente du processus (Mo), ou -1 hors Linux."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return -1
+
+
+def timed(function: Callable[[], object], iterations: int) -> List[float]:
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return sorted(durations)
+
+
+def summary(durations: List[float]) -> str:
+    return f"p50 {statistics.median(durations):7.2f} ms | p95 {durations[int(len(durations) * 0.95) - 1]:7.2f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vectors", type=int, default=500_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--user-messages", type=int, default=2_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    embedder = HashingEmbedder(args.dim)
+    texts = [f"{random.choice(SENTENCES)} (message {i})" for i in range(2_000)]
+    start = time.perf_counter()
+    for text in texts:
+        embedder.embed([text])
+    one_by_one = len(texts) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    embedder.embed(texts)
+    batched = len(texts) / (time.perf_counter() - start)
+    print(f"embedding : {one_by_one:,.0f} messages/s un par un, {batched:,.0f} messages/s par lots")
+
+    workdir = tempfile.mkdtemp(prefix="bench_embedding_store_")
+    try:
+        store = EmbeddingStore(workdir, "stub", args.dim)
+        rng = np.random.default_rng(42)
+        start = time.perf_counter()
+        for first in range(1, args.vectors + 1, 10_000):
+            count = min(10_000, args.vectors + 1 - first)
+            vectors = rng.standard_normal((count, args.dim), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            store.write(np.arange(first, first + count), vectors)
+        elapsed = time.perf_counter() - start
+        raw_mb = args.vectors * args.dim * 2 / 1e6
+        print(f"écriture : {args.vectors} vecteurs en {elapsed:.1f} s ({args.vectors / elapsed:,.0f}/s), {raw_mb:.0f} Mo en float16")
+
+        reader = EmbeddingStore(workdir, "stub", args.dim)
+        query = embedder.embed(["plage calme avec des enfants"])[0]
+        before = resident_mb()
+        full = timed(lambda: reader.search(query, k=10), args.iterations)
+        after = resident_mb()
+        print(f"recherche complète      : {summary(full)}")
+        user_ids = rng.choice(np.arange(1, args.vectors + 1), size=args.user_messages, replace=False)
+        scoped = timed(lambda: reader.search(query, k=10, ids=user_ids), args.iterations * 10)
+        print(f"recherche {args.user_messages} messages : {summary(scoped)}")
+        print(f"mémoire résidente : {before:.0f} Mo avant, {after:.0f} Mo après parcours complet (vecteurs : {raw_mb:.0f} Mo)")
+        reader.close()
+        store.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
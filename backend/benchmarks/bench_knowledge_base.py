@@ -0,0 +1,113 @@
+"""
+Benchmark : construction et interrogation de la base de connaissances locale.
+
+On génère un fichier CSV de POI synthétiques, on construit l'index (découpage,
+embeddings hors ligne, écriture des vecteurs float16) puis on mesure la
+latence d'une recherche complète (embedding de la question + top-k sur les
+vecteurs projetés en mémoire) et de la construction du texte injecté dans le
+prompt. Aucun accès réseau.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_knowledge_base
+    python -m benchmarks.bench_knowledge_base --pois 200000 --dim 384
+"""
+
+import argparse
+import csv
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from app.services.embeddings import HashingEmbedder
+from app.services.knowledge_base import VECTORS_FILE, KnowledgeBase, build_index
+
+CITIES = ["Lyon", "Nice", "Marseille", "Bordeaux", "Lille", "Strasbourg", "Nantes", "Annecy", "Biarritz", "Colmar"]
+CATEGORIES = ["musée", "restaurant", "plage", "marché", "cathédrale", "parc", "château", "belvédère", "bouchon", "quartier"]
+SENTENCES = [
+    "Incontournable pour une première visite de {city}.",
+    "Très fréquenté le week-end : venir tôt le matin.",
+    "Vue remarquable au coucher du soleil depuis la terrasse.",
+    "Visites guidées en français et en anglais toute l'année.",
+    "Spécialités locales servies midi et soir, réservation conseillée.",
+    "Accessible aux personnes à mobilité réduite.",
+    "Idéal en famille, avec un espace dédié aux enfants.",
+]
+QUESTIONS = [
+    "Quels sont les horaires du musée 17 à Lyon ?",
+    "Combien coûte l'entrée du château de Colmar ?",
+    "Une plage accessible en famille à Biarritz ?",
+    "Un restaurant avec terrasse pour le coucher du soleil à Nice",
+]
+
+
+def generate_csv(path: Path, pois: int) -> None:
+    rng = random.Random(42)
+    with path.open("w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["name", "city", "category", "description", "opening_hours", "price", "transport"])
+        for i in range(pois):
+            city, category = rng.choice(CITIES), rng.choice(CATEGORIES)
+            writer.writerow([
+                f"{category.capitalize()} {i}",
+                city,
+                category,
+                " ".join(sentence.format(city=city) for sentence in rng.sample(SENTENCES, 4)),
+                f"{rng.randint(7, 10)}h-{rng.randint(17, 23)}h",
+                f"{rng.randint(0, 30)} €",
+                f"Ligne de bus {rng.randint(1, 40)}",
+            ])
+
+
+def timed(function: Callable[[], object], iterations: int) -> List[float]:
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return sorted(durations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pois", type=int, default=50_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="bench_knowledge_base_"))
+    try:
+        source = workdir / "pois.csv"
+        generate_csv(source, args.pois)
+        embedder = HashingEmbedder(args.dim)
+
+        start = time.perf_counter()
+        manifest = build_index([source], workdir / "index", embedder=embedder)
+        elapsed = time.perf_counter() - start
+        size = (workdir / "index" / VECTORS_FILE).stat().st_size
+        print(
+            f"construction : {manifest['pois']} POI, {manifest['chunks']} extraits en {elapsed:.1f} s "
+            f"({manifest['chunks'] / elapsed:,.0f} extraits/s), vecteurs {size / 1e6:.1f} Mo"
+        )
+
+        start = time.perf_counter()
+        knowledge_base = KnowledgeBase.load(workdir / "index", embedder=embedder)
+        print(f"chargement : {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        for question in QUESTIONS:
+            search = timed(lambda: knowledge_base.search(question), args.iterations)
+            context = timed(lambda: knowledge_base.context_for(question), args.iterations)
+            print(
+                f"{question[:45]:<45} | recherche p50 {statistics.median(search):6.2f} ms "
+                f"p95 {search[int(len(search) * 0.95) - 1]:6.2f} ms | "
+                f"contexte p50 {statistics.median(context):6.2f} ms"
+            )
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Micro-benchmark : coût par requête de la préparation de l'appel LLM (sans réseau).
+
+- avant : un LangChainService par requête (ChatOpenAI + client HTTP + prompt),
+          puis ConversationChain + mémoire chargée avec l'historique ;
+- après : service partagé, on ne fait plus que formater les messages.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_llm_overhead --iterations 200
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from langchain.chains import ConversationChain
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_openai import ChatOpenAI
+
+from app.core.config import settings
+from app.services.langchain_service import LangChainService, TRAVELBOT_SYSTEM_PROMPT
+
+HISTORY = [
+    {"role": "assistant" if i % 2 else "user", "content": f"Message numéro {i} sur Nice et ses plages."}
+    for i in range(10)
+]
+
+
+def per_request_before() -> None:
+    """Reproduit l'ancien chemin : tout est reconstruit à chaque requête."""
+    llm = ChatOpenAI(
+        model=settings.openai_model,
+        temperature=settings.openai_temperature,
+        openai_api_key=settings.openai_api_key,
+    )
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", TRAVELBOT_SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "{input}"),
+    ])
+    memory = ConversationBufferMemory(return_messages=True, memory_key="history")
+    chain = ConversationChain(llm=llm, prompt=prompt, memory=memory)
+    for message in HISTORY:
+        if message["role"] == "user":
+            chain.memory.chat_memory.add_user_message(message["content"])
+        else:
+            chain.memory.chat_memory.add_ai_message(message["content"])
+    chain.prep_inputs({"input": "Que faire à Nice ?"})
+    prompt.format_messages(history=chain.memory.chat_memory.messages, input="Que faire à Nice ?")
+
+
+def timed(label: str, func, iterations: int) -> float:
+    func()  # échauffement
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call = (time.perf_counter() - start) / iterations
+    print(f"{label:<6} | {per_call * 1e6:10.1f} µs / requête")
+    return per_call
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    service = LangChainService(http_client=httpx.AsyncClient(http2=True))
+
+    before = timed("avant", per_request_before, args.iterations)
+    after = timed("après", lambda: service.build_messages("Que faire à Nice ?", HISTORY), args.iterations)
+    print(f"gain   | x{before / after:.0f}")
+
+    await service.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,3 +1,9 @@
 #!/bin/bash
+# Développement : un seul processus (rechargement automatique si DEBUG=True).
+# Production : ./run.sh prod (gunicorn + workers uvicorn, voir app/server.py).
 source venv/bin/activate
-python -m app.main
\ No newline at end of file
+if [ "$1" = "prod" ]; then
+    python -m app.server
+else
+    python -m app.main
+fi
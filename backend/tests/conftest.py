@@ -0,0 +1,118 @@
+"""
+Configuration commune des tests : base de données SQLite asynchrone (aiosqlite).
+"""
+import os
+
+# Réglages obligatoires, lus au premier accès à settings (pas à l'import de l'app) :
+# la suite tourne sans .env ni variables d'environnement.
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("SECRET_KEY", "test")
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.main import app
+from app.core.database import Base, get_db, sqlite_foreign_keys
+from app.services.langchain_service import LangChainService, get_langchain_service
+from app.services.summary_service import ConversationSummarizer, get_summarizer
+
+
+# ─────────────────────────────────────
+# SETUP : base de données de test
+# ─────────────────────────────────────
+
+# On crée une DB séparée pour les tests (pour ne pas toucher aux données réelles)
+TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"  # SQLite pour les tests (pas besoin de PostgreSQL)
+
+# NullPool : chaque test a sa propre boucle d'événements, on ne réutilise
+# donc pas les connexions aiosqlite d'un test à l'autre.
+test_engine = create_async_engine(TEST_DATABASE_URL, poolclass=NullPool)
+# Comme en production : suppressions en cascade faites par la base
+event.listen(test_engine.sync_engine, "connect", sqlite_foreign_keys)
+TestSessionLocal = async_sessionmaker(
+    bind=test_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+async def override_get_db():
+    """Remplace get_db par une version qui utilise la DB de test."""
+    async with TestSessionLocal() as db:
+        yield db
+
+
+# Remplacer la dépendance get_db par notre version de test
+app.dependency_overrides[get_db] = override_get_db
+
+# Le lifespan n'est pas exécuté par ASGITransport : on fournit le service LLM
+# partagé directement (les tests remplacent ses appels réseau par monkeypatch).
+test_langchain_service = LangChainService()
+app.dependency_overrides[get_langchain_service] = lambda: test_langchain_service
+test_summarizer = ConversationSummarizer(TestSessionLocal, test_langchain_service)
+app.dependency_overrides[get_summarizer] = lambda: test_summarizer
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def setup_test_db():
+    """Crée les tables avant chaque test, les supprime après."""
+    from app.models import User
+
+    async with test_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # Utilisateur de démo (id=1) comme en production : les clés étrangères
+        # sont vérifiées, les requêtes des tests d'API lui sont rattachées.
+        await conn.execute(User.__table__.insert().values(email="demo@travelbot.local", name="Utilisateur Demo"))
+    yield
+    async with test_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+
+
+@pytest_asyncio.fixture
+async def db_session():
+    """Session de test utilisable directement par les tests de repository."""
+    async with TestSessionLocal() as db:
+        yield db
+
+
+@pytest_asyncio.fixture
+async def user(db_session):
+    """Utilisateur de test."""
+    from app.models import User
+
+    user = User(email="test@travelbot.local", name="Test")
+    db_session.add(user)
+    await db_session.commit()
+    return user
+
+
+class QueryCounter:
+    """Compte les requêtes SQL et les commits exécutés sur la DB de test."""
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def reset(self):
+        self.statements = []
+        self.commits = 0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def _on_commit(self, conn):
+        self.commits += 1
+
+
+@pytest.fixture
+def query_counter():
+    counter = QueryCounter()
+    event.listen(test_engine.sync_engine, "before_cursor_execute", counter._before_cursor_execute)
+    event.listen(test_engine.sync_engine, "commit", counter._on_commit)
+    yield counter
+    event.remove(test_engine.sync_engine, "before_cursor_execute", counter._before_cursor_execute)
+    event.remove(test_engine.sync_engine, "commit", counter._on_commit)
@@ -2,47 +2,14 @@
 Tests de l'API Chat.
 On utilise httpx pour simuler des requêtes HTTP sans serveur réel.
 """
-from sqlalchemy.orm import sessionmaker, Session
+import json
+
 import pytest
 from httpx import AsyncClient, ASGITransport
 
 
 from app.main import app
-from app.core.database import Base, engine, SessionLocal, get_db
-
-
-# ─────────────────────────────────────
-# SETUP : base de données de test
-# ─────────────────────────────────────
-
-# On crée une DB séparée pour les tests (pour ne pas toucher aux données réelles)
-from sqlalchemy import create_engine as ce
-TEST_DATABASE_URL = "sqlite:///./test.db"  # SQLite pour les tests (pas besoin de PostgreSQL)
-test_engine = ce(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
-TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
-
-from sqlalchemy.orm import sessionmaker
-
-
-def override_get_db():
-    """Remplace get_db par une version qui utilise la DB de test."""
-    db = TestSessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-# Remplacer la dépendance get_db par notre version de test
-app.dependency_overrides[get_db] = override_get_db
-
-
-@pytest.fixture(autouse=True)
-def setup_test_db():
-    """Crée les tables avant chaque test, les supprime après."""
-    Base.metadata.create_all(bind=test_engine)
-    yield
-    Base.metadata.drop_all(bind=test_engine)
+from app.services.langchain_service import LangChainService
 
 
 # ─────────────────────────────────────
@@ -111,4 +78,62 @@ async def test_conversation_introuvable():
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
         response = await client.get("/api/conversations/9999")
     
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_chat_sauvegarde_la_conversation(monkeypatch):
+    """Un message valide crée une conversation et enregistre les deux messages."""
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        return f"Réponse à : {message}"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/api/chat", json={
+            "message": "Bonjour",
+            "user_id": 1
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert data["response"] == "Réponse à : Bonjour"
+        assert data["prompt_tokens"] > 0
+
+        history = await client.get(f"/api/conversations/{data['conversation_id']}")
+
+    assert history.status_code == 200
+    messages = history.json()["messages"]
+    assert [m["is_bot"] for m in messages] == [False, True]
+
+
+def _fake_stream(tokens):
+    async def fake_stream_response(self, message, conversation_history=None, summary=None):
+        for token in tokens:
+            yield token
+    return fake_stream_response
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_envoie_les_tokens(monkeypatch):
+    """Le streaming envoie les tokens en SSE et sauvegarde la réponse assemblée une seule fois."""
+    monkeypatch.setattr(LangChainService, "stream_response", _fake_stream(["Nice ", "est ", "superbe"]))
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/api/chat/stream", json={
+            "message": "Que faire à Nice ?",
+            "user_id": 1
+        })
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        events = [block for block in response.text.split("\n\n") if block]
+        assert events[0].startswith("event: start")
+        assert events[-1].startswith("event: end")
+        tokens = [json.loads(e.split("data: ", 1)[1])["token"] for e in events if e.startswith("event: token")]
+        assert "".join(tokens) == "Nice est superbe"
+
+        conversation_id = json.loads(events[0].split("data: ", 1)[1])["conversation_id"]
+        history = await client.get(f"/api/conversations/{conversation_id}")
+
+    bot_messages = [m for m in history.json()["messages"] if m["is_bot"]]
+    assert [m["content"] for m in bot_messages] == ["Nice est superbe"]
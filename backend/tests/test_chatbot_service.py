@@ -0,0 +1,271 @@
+"""
+Tests du ChatbotService et de la construction du contexte (sans appel à OpenAI).
+"""
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.core.database import create_engine_for_url
+from app.models import Message
+from app.services.chatbot_service import ChatbotService
+from app.services.context_builder import ContextBuilder, count_tokens
+from app.services.langchain_service import LangChainService
+
+
+@pytest.mark.asyncio
+async def test_stream_interrompu_ne_sauvegarde_rien(db_session, user, monkeypatch):
+    """Un flux fermé avant la fin (client déconnecté) ne sauvegarde pas de réponse partielle."""
+    async def fake_stream_response(self, message, conversation_history=None, summary=None):
+        for token in ["Bon", "jour", " !"]:
+            yield token
+
+    monkeypatch.setattr(LangChainService, "stream_response", fake_stream_response)
+    service = ChatbotService(db_session, LangChainService())
+    conversation_id, context = await service.start_turn(user.id, "Bonjour")
+
+    stream = service.stream_reply(conversation_id, "Bonjour", context)
+    assert await stream.__anext__() == "Bon"
+    await stream.aclose()
+
+    messages = await service.conversation_repository.get_messages(conversation_id)
+    assert [m.is_bot for m in messages] == [False]
+
+
+@pytest.mark.asyncio
+async def test_history_exclut_la_question_actuelle(db_session, user):
+    """La question en cours n'apparaît pas dans l'historique (elle est envoyée à part)."""
+    service = ChatbotService(db_session, LangChainService())
+    conversation_id, context = await service.start_turn(user.id, "Bonjour")
+    assert context.history == []
+
+    await service.conversation_repository.add_message(conversation_id, "Salut !", is_bot=True)
+    _, context = await service.start_turn(user.id, "Que faire à Nice ?", conversation_id)
+
+    assert [item["content"] for item in context.history] == ["Bonjour", "Salut !"]
+
+
+@pytest.mark.asyncio
+async def test_contexte_respecte_le_budget_de_tokens(db_session, user):
+    """Seuls les messages les plus récents qui tiennent dans le budget sont retenus."""
+    service = ChatbotService(db_session, LangChainService())
+    conversation_id, empty = await service.start_turn(user.id, "Bonjour")
+    for i in range(20):
+        await service.conversation_repository.add_message(conversation_id, f"Réponse numéro {i} " * 20, is_bot=True)
+
+    budget = empty.prompt_tokens + 3 * (count_tokens("Réponse numéro 19 " * 20) + 4)
+    builder = ContextBuilder(service.conversation_repository, token_budget=budget)
+    conversation = await service.conversation_repository.get_conversation(conversation_id)
+    context = await builder.build(conversation, "Bonjour")
+
+    assert len(context.history) == 3
+    assert context.history[-1]["content"].startswith("Réponse numéro 19")
+    assert empty.prompt_tokens < context.prompt_tokens <= budget
+
+
+@pytest.mark.asyncio
+async def test_token_count_est_enregistre(db_session, user):
+    """Le nombre de tokens est stocké avec le message, et calculé pour les anciens messages."""
+    service = ChatbotService(db_session, LangChainService())
+    conversation_id, _ = await service.start_turn(user.id, "Bonjour")
+    db_session.add(Message(conversation_id=conversation_id, content="Ancien message", is_bot=True))
+    await db_session.commit()
+
+    await service.start_turn(user.id, "Et à Lyon ?", conversation_id)
+
+    messages = await service.conversation_repository.get_messages(conversation_id)
+    assert all(m.token_count for m in messages)
+    assert messages[0].token_count == count_tokens("Bonjour")
+
+
+@pytest.mark.asyncio
+async def test_resume_glissant(db_session, user, monkeypatch):
+    """Après 2×K messages, les plus anciens sont résumés et remplacés par le résumé dans le contexte."""
+    from tests.conftest import TestSessionLocal
+    from app.services.summary_service import ConversationSummarizer
+
+    summarized = []
+
+    async def fake_summarize(self, previous_summary, conversation_history):
+        summarized.append(conversation_history)
+        return f"Résumé de {len(conversation_history)} messages"
+
+    monkeypatch.setattr(LangChainService, "summarize", fake_summarize)
+    service = ChatbotService(db_session, LangChainService())
+    summarizer = ConversationSummarizer(TestSessionLocal, service.langchain_service, every_messages=3)
+    conversation_id, _ = await service.start_turn(user.id, "Message 0")
+    for i in range(1, 5):
+        await service.conversation_repository.add_message(conversation_id, f"Message {i}", is_bot=bool(i % 2))
+
+    # 5 messages < 2×3 : pas encore de résumé
+    assert await summarizer.update_if_needed(conversation_id) is False
+    await service.conversation_repository.add_message(conversation_id, "Message 5", is_bot=True)
+    assert await summarizer.update_if_needed(conversation_id) is True
+    assert [item["content"] for item in summarized[0]] == ["Message 0", "Message 1", "Message 2"]
+
+    db_session.expire_all()
+    conversation = await service.conversation_repository.get_conversation(conversation_id)
+    context = await service.context_builder.build(conversation, "Et ensuite ?")
+
+    assert context.summary == "Résumé de 3 messages"
+    assert [item["content"] for item in context.history] == ["Message 3", "Message 4", "Message 5"]
+    messages = service.langchain_service.build_messages("Et ensuite ?", context.history, context.summary)
+    assert "Résumé de 3 messages" in messages[1].content
+
+
+@pytest.mark.asyncio
+async def test_resume_d_une_longue_conversation_sans_saut(db_session, user, monkeypatch):
+    """Conversation jamais résumée de plus de 5×K messages : rattrapée des plus anciens aux plus récents."""
+    from tests.conftest import TestSessionLocal
+    from app.services.summary_service import ConversationSummarizer
+
+    summarized = []
+
+    async def fake_summarize(self, previous_summary, conversation_history):
+        summarized.extend(item["content"] for item in conversation_history)
+        return f"Résumé jusqu'à {conversation_history[-1]['content']}"
+
+    monkeypatch.setattr(LangChainService, "summarize", fake_summarize)
+    repository = ChatbotService(db_session).conversation_repository
+    conversation_id = (await repository.create_conversation(user.id)).id
+    for i in range(40):
+        await repository.add_message(conversation_id, f"Message {i}", is_bot=bool(i % 2))
+
+    summarizer = ConversationSummarizer(TestSessionLocal, LangChainService(), every_messages=3)
+    assert await summarizer.update_if_needed(conversation_id) is True
+
+    # Lots de 15 (5×K) dont les 3 derniers attendent : 3 appels, 4 messages restants (< 2×K)
+    assert summarized == [f"Message {i}" for i in range(36)]
+    db_session.expire_all()
+    conversation = await repository.get_conversation(conversation_id)
+    assert conversation.summary == "Résumé jusqu'à Message 35"
+
+
+@pytest.mark.asyncio
+async def test_resume_sans_session_ouverte_pendant_l_appel(db_session, user, monkeypatch):
+    """Aucune session (donc aucune connexion) n'est ouverte pendant l'appel de résumé."""
+    from contextlib import asynccontextmanager
+    from tests.conftest import TestSessionLocal
+    from app.services.summary_service import ConversationSummarizer
+
+    open_sessions = 0
+    seen = []
+
+    @asynccontextmanager
+    async def counting_session_factory():
+        nonlocal open_sessions
+        open_sessions += 1
+        try:
+            async with TestSessionLocal() as session:
+                yield session
+        finally:
+            open_sessions -= 1
+
+    async def fake_summarize(self, previous_summary, conversation_history):
+        seen.append(open_sessions)
+        return "Résumé"
+
+    monkeypatch.setattr(LangChainService, "summarize", fake_summarize)
+    repository = ChatbotService(db_session).conversation_repository
+    conversation_id = (await repository.create_conversation(user.id)).id
+    for i in range(20):
+        await repository.add_message(conversation_id, f"Message {i}", is_bot=bool(i % 2))
+
+    summarizer = ConversationSummarizer(counting_session_factory, LangChainService(), every_messages=3)
+    assert await summarizer.update_if_needed(conversation_id) is True
+    assert seen and set(seen) == {0}
+
+
+@pytest.mark.asyncio
+async def test_ecritures_d_un_tour(db_session, user, query_counter, monkeypatch):
+    """Un tour de chat = deux transactions d'écriture courtes, sans SELECT de refresh après les INSERT."""
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        return "Réponse"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    service = ChatbotService(db_session, LangChainService())
+    first = await service.process_message(user.id, "Bonjour")
+
+    # Nouvelle conversation : INSERT conversation et message utilisateur (avant
+    # l'appel au modèle), puis INSERT réponse
+    assert query_counter.commits == 2
+    assert [q.split()[0] for q in query_counter.statements] == ["INSERT", "INSERT", "INSERT"]
+
+    query_counter.reset()
+    await service.process_message(user.id, "Et à Lyon ?", first.conversation_id)
+
+    # Conversation existante : lecture conversation + historique (transaction close
+    # avant l'appel au modèle), INSERT message utilisateur, puis INSERT réponse
+    assert query_counter.commits == 3
+    assert [q.split()[0] for q in query_counter.statements] == ["SELECT", "SELECT", "INSERT", "INSERT"]
+
+
+@pytest.mark.asyncio
+async def test_aucune_transaction_pendant_l_appel_au_modele(db_session, user, monkeypatch):
+    """La session n'a ni transaction ni connexion ouverte pendant l'appel au modèle."""
+    in_transaction = []
+
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        in_transaction.append(db_session.in_transaction())
+        return "Réponse"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    service = ChatbotService(db_session, LangChainService())
+    first = await service.process_message(user.id, "Bonjour")
+    await service.process_message(user.id, "Et à Lyon ?", first.conversation_id)
+
+    assert in_transaction == [False, False]
+    messages = await service.conversation_repository.get_recent_messages(first.conversation_id, limit=10)
+    assert [m.content for m in messages] == ["Bonjour", "Réponse", "Et à Lyon ?", "Réponse"]
+
+
+@pytest.mark.asyncio
+async def test_pool_d_une_connexion_pour_des_chats_concurrents(user, monkeypatch):
+    """
+    Avec une seule connexion dans le pool, des chats concurrents aboutissent :
+    aucune requête ne garde la connexion pendant l'appel au modèle (qui, sinon,
+    ferait dépasser pool_timeout aux requêtes suivantes).
+    """
+    async def slow_get_response(self, message, conversation_history=None, summary=None):
+        await asyncio.sleep(0.3)
+        return "Réponse"
+
+    monkeypatch.setattr(LangChainService, "get_response", slow_get_response)
+    engine = create_engine_for_url(
+        "sqlite:///./test.db", poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.5
+    )
+    sessions = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    langchain_service = LangChainService()
+    user_id = user.id
+
+    async def chat(index: int) -> str:
+        async with sessions() as db:
+            service = ChatbotService(db, langchain_service)
+            first = await service.process_message(user_id, f"Question {index}")
+            second = await service.process_message(user_id, "Et ensuite ?", first.conversation_id)
+            return second.response
+
+    try:
+        assert await asyncio.gather(*(chat(index) for index in range(6))) == ["Réponse"] * 6
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_echec_du_modele_conserve_la_question(db_session, user, monkeypatch):
+    """Si l'appel au modèle échoue, la question reste enregistrée (sans réponse du bot)."""
+    async def failing_get_response(self, message, conversation_history=None, summary=None):
+        raise RuntimeError("OpenAI indisponible")
+
+    monkeypatch.setattr(LangChainService, "get_response", failing_get_response)
+    service = ChatbotService(db_session, LangChainService())
+    user_id = user.id
+
+    with pytest.raises(RuntimeError):
+        await service.process_message(user_id, "Bonjour")
+
+    conversations = await service.conversation_repository.get_user_conversations(user_id)
+    assert len(conversations) == 1
+    messages = await service.conversation_repository.get_messages(conversations[0].id)
+    assert [(m.content, m.is_bot) for m in messages] == [("Bonjour", False)]
@@ -0,0 +1,76 @@
+"""
+Tests du chargement des relations : nombre de requêtes constant (pas de N+1).
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.main import app
+from app.models import Conversation, Message
+from app.repositories.conversation_repository import ConversationRepository
+
+
+async def _seed(db, user, conversations: int = 5, messages: int = 4) -> None:
+    start = datetime.now(timezone.utc)
+    for c in range(conversations):
+        conversation = Conversation(user_id=user.id, created_at=start + timedelta(minutes=c))
+        conversation.messages = [
+            Message(
+                content=f"Conversation {c} message {m}",
+                is_bot=bool(m % 2),
+                created_at=start + timedelta(minutes=c, seconds=m)
+            )
+            for m in range(messages)
+        ]
+        db.add(conversation)
+    await db.commit()
+    db.expunge_all()
+
+
+@pytest.mark.asyncio
+async def test_conversations_avec_messages_en_deux_requetes(db_session, user, query_counter):
+    user_id = user.id
+    await _seed(db_session, user)
+    repository = ConversationRepository(db_session)
+
+    query_counter.reset()
+    conversations = await repository.get_user_conversations(user_id, include_messages=True)
+    data = [c.to_dict(include_messages=True) for c in conversations]
+
+    assert len(query_counter.statements) == 2
+    assert len(data) == 5
+    assert [m["content"] for m in data[0]["messages"]] == [
+        f"Conversation 4 message {m}" for m in range(4)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_dernier_message_de_chaque_conversation_en_une_requete(db_session, user, query_counter):
+    user_id = user.id
+    await _seed(db_session, user)
+    repository = ConversationRepository(db_session)
+
+    query_counter.reset()
+    rows = await repository.get_user_conversations_with_last_message(user_id)
+
+    assert len(query_counter.statements) == 2
+    assert [last.content for _, last in rows] == [
+        f"Conversation {c} message 3" for c in reversed(range(5))
+    ]
+
+
+@pytest.mark.asyncio
+async def test_liste_api_avec_dernier_message(db_session, user, query_counter):
+    user_id = user.id
+    await _seed(db_session, user, conversations=3)
+    db_session.add(Conversation(user_id=user_id, created_at=datetime.now(timezone.utc) + timedelta(hours=1)))
+    await db_session.commit()
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        query_counter.reset()
+        page = (await client.get(f"/api/users/{user_id}/conversations")).json()
+
+    assert len(query_counter.statements) == 2
+    assert page["items"][0]["last_message"] is None
+    assert page["items"][1]["last_message"]["content"] == "Conversation 2 message 3"
@@ -0,0 +1,152 @@
+"""
+Tests du magasin d'embeddings (fichier float16 projeté en mémoire, recherche, calcul par lots en tâche de fond).
+"""
+import numpy as np
+import pytest
+
+from app.services.chatbot_service import ChatbotService
+from app.services.embedding_store import GROWTH_ROWS, EmbeddingStore, EmbeddingWorker, backfill
+from app.services.embeddings import HashingEmbedder, StubEmbedder, create_embedder
+from tests.conftest import TestSessionLocal
+
+
+def random_vectors(count, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_vecteurs_adresses_par_id_et_visibles_des_autres_processus(tmp_path):
+    writer = EmbeddingStore(tmp_path, "stub", 32)
+    reader = EmbeddingStore(tmp_path, "stub", 32)
+    vectors = random_vectors(4)
+
+    writer.write([1, 2, 3, 70000], vectors)
+
+    assert len(reader) == 2 * GROWTH_ROWS
+    assert reader.get(0) is None and reader.get(4) is None and reader.get(10**9) is None
+    assert np.allclose(reader.get(2), vectors[1], atol=1e-3)
+    assert np.allclose(reader.get(70000), vectors[3], atol=1e-3)
+    # Le fichier est creux : les lignes jamais écrites n'occupent pas de disque
+    assert (tmp_path / "vectors.f16").stat().st_blocks * 512 < len(reader) * 32 * 2
+
+
+def test_recherche_complete_et_restreinte(tmp_path, monkeypatch):
+    import app.services.embedding_store as embedding_store_module
+
+    monkeypatch.setattr(embedding_store_module, "SEARCH_BLOCK_ROWS", 100)
+    store = EmbeddingStore(tmp_path, "stub", 32)
+    vectors = random_vectors(1000)
+    ids = np.arange(1, 1001)
+    store.write(ids, vectors)
+    query = vectors[500] + 0.1 * vectors[10]
+
+    hits = store.search(query, k=5)
+
+    stored = vectors.astype(np.float16).astype(np.float32)
+    expected = np.argsort(-(stored @ (query / np.linalg.norm(query))))[:5] + 1
+    assert [message_id for message_id, _ in hits] == list(expected)
+    assert hits[0][0] == 501 and hits[0][1] > 0.9
+
+    restricted = store.search(query, k=3, ids=[11, 12, 13, 999999])
+    assert [message_id for message_id, _ in restricted][0] == 11
+    assert {message_id for message_id, _ in restricted} <= {11, 12, 13}
+    assert store.search(query, k=0) == []
+
+
+def test_lignes_vides_ignorees(tmp_path):
+    store = EmbeddingStore(tmp_path, "stub", 32)
+    store.write([5], random_vectors(1))
+
+    assert [message_id for message_id, _ in store.search(random_vectors(1, seed=1)[0], k=10)] == [5]
+    assert store.search(np.zeros(32), k=10) == []
+
+
+def test_moteur_incompatible(tmp_path):
+    EmbeddingStore(tmp_path, "stub", 32)
+
+    with pytest.raises(ValueError):
+        EmbeddingStore(tmp_path, "hashing", 32)
+
+
+def test_un_seul_ecrivain(tmp_path):
+    first, second = EmbeddingStore(tmp_path, "stub", 32), EmbeddingStore(tmp_path, "stub", 32)
+
+    assert first.acquire_writer()
+    assert not second.acquire_writer()
+    first.release_writer()
+    assert second.acquire_writer()
+
+
+def test_moteurs_configurables():
+    assert isinstance(create_embedder("hashing"), HashingEmbedder)
+    stub = create_embedder("stub")
+    assert isinstance(stub, StubEmbedder)
+    vectors = stub.embed(["a", "b", "a"])
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert np.array_equal(vectors[0], vectors[2])
+    with pytest.raises(ValueError):
+        create_embedder("inconnu")
+
+
+async def _messages(db_session, user, contents):
+    service = ChatbotService(db_session)
+    conversation = await service.conversation_repository.create_conversation(user.id)
+    for content in contents:
+        await service.conversation_repository.add_message(conversation.id, content, is_bot=False)
+    await db_session.commit()
+    return await service.conversation_repository.get_messages(conversation.id)
+
+
+@pytest.mark.asyncio
+async def test_worker_par_lots_et_watermark(db_session, user, tmp_path):
+    messages = await _messages(db_session, user, [f"Message {i} sur la plage de Nice" for i in range(5)])
+    embedder = HashingEmbedder(dim=64)
+    store = EmbeddingStore(tmp_path, embedder.name, embedder.dim)
+    worker = EmbeddingWorker(TestSessionLocal, store, embedder, batch_size=2)
+    assert store.acquire_writer()
+
+    assert await worker.run_once() == 2
+    assert store.watermark == messages[1].id
+    assert store.get(messages[2].id) is None
+    assert await worker.run_once() == 2
+    assert await worker.run_once() == 1
+    assert await worker.run_once() == 0
+
+    assert np.allclose(store.get(messages[4].id), embedder.embed([messages[4].content])[0], atol=1e-3)
+    await worker.aclose()
+
+
+@pytest.mark.asyncio
+async def test_messages_valides_sous_le_watermark_repris(db_session, user, tmp_path):
+    messages = await _messages(db_session, user, ["Bonjour", "Et le", "Quel temps à Nice ?", "Merci"])
+    embedder = HashingEmbedder(dim=64)
+    store = EmbeddingStore(tmp_path, embedder.name, embedder.dim)
+    worker = EmbeddingWorker(TestSessionLocal, store, embedder)
+    assert await worker.run_once() == 4
+    assert store.watermark == messages[3].id
+
+    # Message validé après le passage du watermark (transaction plus lente) : ligne encore nulle
+    store.write([messages[2].id], np.zeros((1, embedder.dim), dtype=np.float32))
+    assert store.missing([m.id for m in messages]) == [messages[1].id, messages[2].id]
+
+    # Repris au lot suivant ; "Et le" (mots vides, vecteur nul) n'est pas replongé à chaque lot
+    assert await worker.run_once() == 1
+    assert np.allclose(store.get(messages[2].id), embedder.embed([messages[2].content])[0], atol=1e-3)
+    assert await worker.run_once() == 0
+    assert store.watermark == messages[3].id
+
+
+@pytest.mark.asyncio
+async def test_backfill_puis_recherche_semantique(db_session, user, tmp_path):
+    messages = await _messages(db_session, user, [
+        "Quel hôtel pas cher à Lyon ?",
+        "Les meilleures plages de Biarritz pour surfer",
+        "Un restaurant de fruits de mer à Marseille",
+    ])
+    embedder = HashingEmbedder(dim=128)
+    store = EmbeddingStore(tmp_path, embedder.name, embedder.dim)
+
+    assert await backfill(TestSessionLocal, store, embedder) == 3
+
+    hits = store.search(embedder.embed(["surf à Biarritz"])[0], k=1, ids=[m.id for m in messages])
+    assert hits[0][0] == messages[1].id
@@ -0,0 +1,100 @@
+"""
+Tests de l'export NDJSON en flux et de l'import en masse des conversations.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import func, select
+
+from app.main import app
+from app.models import Conversation, Message
+from app.repositories.conversation_repository import ConversationRepository
+from app.services.conversation_export import export_ndjson, import_ndjson
+from tests.conftest import TestSessionLocal
+
+
+async def _seed(db_session, user_id, count=3, messages=4):
+    repository = ConversationRepository(db_session)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    ids = []
+    for i in range(count):
+        conversation = await repository.create_conversation(user_id)
+        conversation.created_at = start + timedelta(days=30 * i)
+        for j in range(messages):
+            await repository.add_message(
+                conversation.id, f"Message {i}.{j}", is_bot=bool(j % 2),
+                created_at=start + timedelta(days=30 * i, minutes=j)
+            )
+        ids.append(conversation.id)
+    await db_session.commit()
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_export_en_flux_par_utilisateur_et_periode(db_session, user):
+    ids = await _seed(db_session, user.id)
+    # Conversation d'un autre utilisateur et conversation sans message
+    await ConversationRepository(db_session).create_conversation(1)
+    empty = await ConversationRepository(db_session).create_conversation(user.id)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/api/export/conversations", params={"user_id": user.id})
+        period = await client.get("/api/export/conversations", params={
+            "user_id": user.id, "since": "2024-01-15T00:00:00Z", "until": "2024-03-15T00:00:00Z"
+        })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["id"] for r in records] == ids + [empty.id]
+    assert [m["content"] for m in records[0]["messages"]] == [f"Message 0.{j}" for j in range(4)]
+    assert records[-1]["messages"] == []
+    assert [json.loads(line)["id"] for line in period.text.splitlines()] == ids[1:3]
+
+
+@pytest.mark.asyncio
+async def test_export_en_une_seule_requete(db_session, user, query_counter):
+    await _seed(db_session, user.id, count=5)
+
+    query_counter.reset()
+    lines = [line async for line in export_ndjson(db_session)]
+
+    assert len(lines) == 5
+    assert len(query_counter.statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_import_en_masse_de_l_export(db_session, user):
+    await _seed(db_session, user.id, count=3, messages=4)
+    lines = [line async for line in export_ndjson(db_session)]
+
+    # Petits lots : plusieurs INSERT multi-lignes et commits
+    imported = await import_ndjson(TestSessionLocal, lines, user_id=1, batch_messages=5)
+
+    assert imported == {"conversations": 3, "messages": 12}
+    assert await db_session.scalar(select(func.count()).select_from(Conversation).where(Conversation.user_id == 1)) == 3
+    assert await db_session.scalar(select(func.count()).select_from(Message)) == 24
+    copies = [json.loads(line) async for line in export_ndjson(db_session, Conversation.user_id == 1)]
+    originals = [json.loads(line) for line in lines]
+    assert [[m["content"] for m in c["messages"]] for c in copies] == [[m["content"] for m in c["messages"]] for c in originals]
+    assert copies[0]["created_at"] == originals[0]["created_at"]
+
+
+@pytest.mark.asyncio
+async def test_import_du_meme_fichier_deux_fois(db_session, user):
+    repository = ConversationRepository(db_session)
+    conversation = await repository.create_conversation(user.id)
+    await repository.add_message(conversation.id, "Bonjour")
+    await repository.add_message(conversation.id, "Bienvenue !", is_bot=True, idempotency_key="envoi-1")
+    await db_session.commit()
+    lines = [line async for line in export_ndjson(db_session)]
+    assert json.loads(lines[0])["messages"][1]["idempotency_key"] == "envoi-1"
+
+    for _ in range(2):
+        assert await import_ndjson(TestSessionLocal, lines) == {"conversations": 1, "messages": 2}
+
+    assert await db_session.scalar(select(func.count()).select_from(Message)) == 6
+    keys = (await db_session.execute(select(Message.idempotency_key).where(Message.idempotency_key.is_not(None)))).scalars().all()
+    assert keys == ["envoi-1"]
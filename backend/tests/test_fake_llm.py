@@ -0,0 +1,70 @@
+"""
+Tests du faux modèle (LLM_BACKEND=fake) et du harnais de test de charge.
+"""
+import openai
+import pytest
+from httpx import AsyncClient, ASGITransport
+from langchain_core.messages import HumanMessage
+
+from app.main import app
+from app.services.fake_llm import FakeChatOpenAI
+from app.services.langchain_service import LangChainService
+from benchmarks.load_test import CHAT, CONVERSATION, percentile, run_load
+from tests.conftest import test_engine, test_langchain_service
+
+
+@pytest.mark.asyncio
+async def test_faux_modele_deterministe():
+    llm = FakeChatOpenAI(latency_seconds=0, tokens_per_second=0, completion_tokens=5)
+    messages = [HumanMessage(content="Que faire à Nice ?")]
+
+    response = await llm.ainvoke(messages)
+    chunks = [chunk.content async for chunk in llm.astream(messages)]
+
+    assert len(response.content.split()) == 5
+    assert "".join(chunks) == response.content
+    assert (await llm.ainvoke(messages)).content == response.content
+
+
+@pytest.mark.asyncio
+async def test_faux_modele_taux_erreur_reproductible():
+    async def failures(seed):
+        llm = FakeChatOpenAI(latency_seconds=0, tokens_per_second=0, error_rate=0.5, seed=seed)
+        result = []
+        for _ in range(20):
+            try:
+                await llm.ainvoke([HumanMessage(content="Bonjour")])
+                result.append(False)
+            except openai.APIConnectionError:
+                result.append(True)
+        return result
+
+    first = await failures(seed=7)
+    assert first == await failures(seed=7)
+    assert 0 < sum(first) < 20
+
+
+def test_percentile():
+    values = [i / 100 for i in range(1, 101)]
+
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 95) == 0.95
+    assert percentile(values, 99) == 0.99
+    assert percentile([], 95) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_harnais_de_charge(monkeypatch):
+    monkeypatch.setattr(
+        test_langchain_service, "llm",
+        FakeChatOpenAI(latency_seconds=0, tokens_per_second=0, completion_tokens=10)
+    )
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        report = await run_load(client, concurrency=1, conversations=3, turns=2, engine=test_engine)
+
+    chat, conversation = report["endpoints"][CHAT], report["endpoints"][CONVERSATION]
+    assert (chat["requests"], chat["errors"]) == (6, 0)
+    assert (conversation["requests"], conversation["errors"]) == (3, 0)
+    assert conversation["queries_per_request"] == 1.0
+    assert chat["queries_per_request"] > 0
@@ -0,0 +1,159 @@
+"""
+Tests du cache des derniers messages par conversation (historique chaud).
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.services.chatbot_service import ChatbotService
+from app.services.history_cache import (
+    CachedMessage,
+    HistoryCache,
+    HistoryWindow,
+    InMemoryHistoryCacheStore,
+    window_recent,
+)
+from app.services.langchain_service import LangChainService
+from app.repositories.conversation_repository import ConversationRepository
+from tests.conftest import TestSessionLocal
+
+
+def _message(id, conversation_id=1, content="texte"):
+    return CachedMessage(
+        id=id,
+        conversation_id=conversation_id,
+        content=content,
+        is_bot=bool(id % 2),
+        token_count=None,
+        created_at=datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=id),
+    )
+
+
+def test_fenetre_incomplete_ne_repond_que_si_elle_suffit():
+    window = HistoryWindow([_message(i) for i in range(5, 10)], complete=False)
+
+    assert [m.id for m in window_recent(window, 3)] == [7, 8, 9]
+    # 6 messages demandés, seuls 5 en cache et il en existe de plus anciens
+    assert window_recent(window, 6) is None
+    # La fenêtre remonte avant after_id : tous les messages suivants sont en cache
+    assert [m.id for m in window_recent(window, 10, after_id=6)] == [7, 8, 9]
+    assert window_recent(window, 10, after_id=2) is None
+
+    complete = HistoryWindow([_message(i) for i in range(1, 4)], complete=True)
+    assert [m.id for m in window_recent(complete, 10)] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_fenetre_bornee_et_memoire_plafonnee():
+    cache = HistoryCache(window_size=3, max_bytes=10_000, ttl_seconds=60)
+    await cache.put(1, [], complete=True)
+    for i in range(1, 5):
+        await cache.append(_message(i))
+
+    window = await cache.store.get(1)
+    assert [m.id for m in window.messages] == [2, 3, 4] and not window.complete
+
+    # Fenêtres de ~2 Ko : au-delà de 10 Ko, les moins récemment utilisées sont évincées
+    for conversation_id in range(2, 12):
+        await cache.put(conversation_id, [_message(1, conversation_id, "x" * 2000)], complete=True)
+    stats = cache.stats()
+    assert stats["memory_bytes"] <= 10_000 and stats["evictions"] > 0
+    assert await cache.store.get(2) is None and await cache.store.get(11) is not None
+
+
+@pytest.mark.asyncio
+async def test_ttl_expire_les_fenetres():
+    store = InMemoryHistoryCacheStore(max_bytes=10_000, ttl_seconds=0.0)
+    cache = HistoryCache(store, window_size=10)
+    await cache.put(1, [_message(1)], complete=True)
+
+    assert await cache.recent(1, 10) is None
+    assert store.stats()["conversations"] == 0 and store.memory_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_historique_lu_sans_select_en_regime_etabli(db_session, user, query_counter, monkeypatch):
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        return f"Réponse {len(conversation_history or [])}"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    cache = HistoryCache(window_size=50)
+    service = ChatbotService(db_session, LangChainService(), history_cache=cache)
+    first = await service.process_message(user.id, "Bonjour")
+
+    query_counter.reset()
+    second = await service.process_message(user.id, "Et à Lyon ?", first.conversation_id)
+
+    # Seule la conversation est lue : l'historique vient du cache (écrit au tour précédent)
+    assert [q.split()[0] for q in query_counter.statements] == ["SELECT", "INSERT", "INSERT"]
+    assert second.response == "Réponse 2"
+    assert cache.stats()["hits"] == 1
+
+    query_counter.reset()
+    messages = await service.get_conversation_messages(first.conversation_id)
+    assert query_counter.statements == []
+    assert [m["content"] for m in messages] == ["Bonjour", "Réponse 0", "Et à Lyon ?", "Réponse 2"]
+
+
+@pytest.mark.asyncio
+async def test_ecritures_annulees_absentes_du_cache(db_session, user):
+    cache = HistoryCache(window_size=50)
+    service = ChatbotService(db_session, history_cache=cache)
+    repository = service.conversation_repository
+    conversation_id = (await repository.create_conversation(user.id)).id
+
+    with pytest.raises(RuntimeError):
+        async with repository.unit_of_work():
+            await repository.add_message(conversation_id, "Jamais enregistré")
+            raise RuntimeError("échec du tour")
+
+    assert await repository.get_recent_messages(conversation_id, limit=10) == []
+    assert (await cache.store.get(conversation_id)).messages == []
+
+
+@pytest.mark.asyncio
+async def test_fenetre_lue_pendant_une_ecriture_non_enregistree(db_session, user, monkeypatch):
+    cache = HistoryCache(window_size=50)
+    repository = ConversationRepository(db_session, history_cache=cache)
+    conversation = await repository.create_conversation(user.id)
+    await repository.add_message(conversation.id, "Bonjour")
+    await cache.invalidate(conversation.id)
+    read_window = ConversationRepository._recent_messages
+
+    async def racing_read(self, *args, **kwargs):
+        window = await read_window(self, *args, **kwargs)
+        # Un autre worker valide un message entre le SELECT et l'enregistrement de la fenêtre
+        async with TestSessionLocal() as other_session:
+            other = ConversationRepository(other_session, history_cache=cache)
+            await other.add_message(conversation.id, "Et à Lyon ?")
+        return window
+
+    monkeypatch.setattr(ConversationRepository, "_recent_messages", racing_read)
+    assert [m.content for m in await repository.get_recent_messages(conversation.id)] == ["Bonjour"]
+    monkeypatch.setattr(ConversationRepository, "_recent_messages", read_window)
+
+    # La fenêtre périmée n'a pas été enregistrée : la lecture suivante voit le nouveau message
+    assert await cache.store.get(conversation.id) is None
+    assert [m.content for m in await repository.get_recent_messages(conversation.id)] == ["Bonjour", "Et à Lyon ?"]
+    assert (await cache.store.get(conversation.id)) is not None
+
+
+@pytest.mark.asyncio
+async def test_get_conversation_servi_par_le_cache(db_session, user):
+    cache = HistoryCache(window_size=50)
+    repository = ChatbotService(db_session, history_cache=cache).conversation_repository
+    conversation = await repository.create_conversation(user.id)
+    await repository.add_message(conversation.id, "Bonjour")
+
+    app.state.history_cache = cache
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(f"/api/conversations/{conversation.id}")
+            stats = await client.get("/api/cache/history/stats")
+    finally:
+        del app.state.history_cache
+
+    assert [m["content"] for m in response.json()["messages"]] == ["Bonjour"]
+    assert stats.json()["hits"] == 1 and stats.json()["conversations"] == 1
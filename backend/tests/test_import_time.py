@@ -0,0 +1,60 @@
+"""
+Tests du temps d'import de l'application : LangChain, OpenAI et tiktoken ne
+sont pas chargés avec app.main (démarrage des workers, CLI, migrations).
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Budget du temps d'import cumulé de app.main (ms), ajustable sur une machine lente
+IMPORT_TIME_BUDGET_MS = float(os.environ.get("IMPORT_TIME_BUDGET_MS", "1500"))
+
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_openai", "openai", "tiktoken")
+
+
+def _python(*args, env=None):
+    # Nouvel interpréteur : les modules déjà importés par pytest ne faussent pas la mesure
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env={**(os.environ if env is None else env), "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def test_dependances_ia_absentes_a_l_import():
+    result = _python(
+        "-c",
+        "import sys, app.main; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+    )
+
+    assert result.stdout.strip() == ""
+
+
+def test_temps_d_import_dans_le_budget():
+    result = _python("-X", "importtime", "-c", "import app.main")
+
+    # Lignes "import time: self [us] | cumulative | module" sur stderr
+    cumulative_us = next(
+        int(line.split("|")[1])
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and line.split("|")[2].strip() == "app.main"
+    )
+    assert cumulative_us / 1000 < IMPORT_TIME_BUDGET_MS
+
+
+def test_import_sans_configuration():
+    # Ni moteur ni configuration créés à l'import : DATABASE_URL, OPENAI_API_KEY
+    # et SECRET_KEY ne sont lus qu'au démarrage
+    env = {name: value for name, value in os.environ.items()
+           if name not in ("DATABASE_URL", "OPENAI_API_KEY", "SECRET_KEY")}
+
+    result = _python("-c", "import app.main, app.core.database as db; print(db.get_engine.cache_info().currsize)", env=env)
+
+    assert result.stdout.strip() == "0"
@@ -0,0 +1,136 @@
+"""
+Tests de la base de connaissances locale (ingestion, découpage, index mmap, injection dans le prompt).
+"""
+import json
+
+import numpy as np
+import pytest
+from langchain_core.messages import AIMessage, SystemMessage
+
+from app.services.embeddings import HashingEmbedder, top_k
+from app.services.knowledge_base import KnowledgeBase, PointOfInterest, build_index, chunk_poi, load_pois
+from app.services.langchain_service import LangChainService
+from app.services.prompts import KNOWLEDGE_PREFIX
+
+CSV_POIS = """name,city,country,category,description,opening_hours,price,transport
+Musée des Confluences,Lyon,France,musée,"Musée de sciences et de sociétés au confluent du Rhône et de la Saône.",Du mardi au dimanche 10h30-18h30,12 € plein tarif,Tram T1 arrêt Musée des Confluences
+Parc de la Tête d'Or,Lyon,France,parc,"Grand parc urbain avec lac, roseraie et zoo gratuit.",6h30-22h30 en été,Gratuit,Métro A Masséna puis 10 minutes à pied
+"""
+
+JSON_POIS = {"pois": [
+    {"name": "Plage de la Côte des Basques", "city": "Biarritz", "category": "plage",
+     "description": "Spot de surf réputé, au pied des falaises. Écoles de surf sur place.",
+     "price": "Accès libre"},
+    {"name": "Colline du Château", "city": "Nice", "category": "panorama",
+     "description": "Vue sur la baie des Anges et le vieux Nice, cascade artificielle.",
+     "opening_hours": "8h30-20h en été", "transport": "Ascenseur du château depuis le quai des États-Unis"},
+]}
+
+
+@pytest.fixture
+def knowledge_dir(tmp_path):
+    (tmp_path / "lyon.csv").write_text(CSV_POIS, encoding="utf-8")
+    (tmp_path / "cote.json").write_text(json.dumps(JSON_POIS), encoding="utf-8")
+    output = tmp_path / "index"
+    build_index([tmp_path / "lyon.csv", tmp_path / "cote.json"], output, embedder=HashingEmbedder(dim=256))
+    return output
+
+
+def test_decoupage_entre_phrases_avec_en_tete():
+    poi = PointOfInterest(
+        name="Cité du Vin", city="Bordeaux", category="musée", price="22 €",
+        description=" ".join(f"Phrase numéro {i} sur l'histoire du vin." for i in range(40)),
+    )
+
+    chunks = chunk_poi(poi, max_chars=200)
+
+    assert len(chunks) > 1
+    assert all(len(chunk.text) <= 200 for chunk in chunks)
+    assert all(chunk.text.startswith("Cité du Vin (musée), Bordeaux — ") for chunk in chunks)
+    assert "Prix : 22 €." in chunks[0].text
+    # Aucune phrase coupée en deux
+    assert all(chunk.text.endswith("du vin.") for chunk in chunks[1:])
+
+
+def test_poi_sans_ville_refuse(tmp_path):
+    path = tmp_path / "pois.json"
+    path.write_text(json.dumps([{"name": "Sans ville"}]), encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        list(load_pois(path))
+
+
+def test_embeddings_deterministes_et_normalises():
+    embedder = HashingEmbedder(dim=128)
+    vectors = embedder.embed(["Hôtel pas cher à Lyon", "hotels pas chers a lyon", ""])
+
+    assert vectors.shape == (3, 128) and vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0)
+    assert not vectors[2].any()
+    assert vectors[0] @ vectors[1] > 0.5
+    assert np.array_equal(embedder.embed(["Hôtel pas cher à Lyon"])[0], vectors[0])
+
+
+def test_top_k_par_blocs(monkeypatch):
+    import app.services.embeddings as embeddings_module
+
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((1000, 16)).astype(np.float32)
+    query = rng.standard_normal(16).astype(np.float32)
+    monkeypatch.setattr(embeddings_module, "SEARCH_BLOCK_ROWS", 64)
+
+    indices, scores = top_k(matrix, query, 5)
+
+    expected = np.argsort(-(matrix @ query))[:5]
+    assert list(indices) == list(expected)
+    assert np.allclose(scores, (matrix @ query)[expected])
+
+
+def test_index_mmap_et_recherche(knowledge_dir):
+    knowledge_base = KnowledgeBase.load(knowledge_dir, embedder=HashingEmbedder(dim=256))
+
+    assert isinstance(knowledge_base.vectors, np.memmap)
+    assert len(knowledge_base) == 4
+    hits = knowledge_base.search("Horaires et prix du musée des Confluences ?", k=2, min_score=0.0)
+    assert hits[0].chunk.poi == "Musée des Confluences"
+    assert hits[0].score > hits[1].score
+    assert knowledge_base.search("surf à Biarritz", k=1)[0].chunk.city == "Biarritz"
+
+
+def test_index_incompatible_avec_embedder(knowledge_dir):
+    with pytest.raises(ValueError):
+        KnowledgeBase.load(knowledge_dir, embedder=HashingEmbedder(dim=128))
+
+
+def test_contexte_limite_en_tokens(knowledge_dir):
+    knowledge_base = KnowledgeBase.load(knowledge_dir, embedder=HashingEmbedder(dim=256))
+
+    context = knowledge_base.context_for("musée Lyon horaires", max_tokens=400)
+    assert context.startswith(KNOWLEDGE_PREFIX)
+    assert "10h30-18h30" in context
+    assert knowledge_base.context_for("musée Lyon horaires", max_tokens=10) is None
+
+
+@pytest.mark.asyncio
+async def test_extraits_injectes_dans_le_prompt(knowledge_dir):
+    class RecordingLLM:
+        async def ainvoke(self, messages):
+            self.messages = messages
+            return AIMessage(content="Réponse")
+
+    service = LangChainService(knowledge_base=KnowledgeBase.load(knowledge_dir, embedder=HashingEmbedder(dim=256)))
+    service.llm = RecordingLLM()
+
+    assert await service.get_response("Combien coûte le musée des Confluences ?") == "Réponse"
+
+    knowledge = service.llm.messages[1]
+    assert isinstance(knowledge, SystemMessage)
+    assert knowledge.content.startswith(KNOWLEDGE_PREFIX)
+    assert "12 € plein tarif" in knowledge.content
+    assert service.llm.messages[-1].content == "Combien coûte le musée des Confluences ?"
+
+
+def test_prompt_sans_base_de_connaissances():
+    messages = LangChainService().build_messages("Que faire à Nice ?")
+
+    assert len(messages) == 2
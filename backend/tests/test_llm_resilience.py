@@ -0,0 +1,182 @@
+"""
+Tests de la résilience des appels au modèle (timeouts, tentatives, hedging, repli, disjoncteur).
+"""
+import asyncio
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+from app.services.llm_resilience import CircuitBreaker, LLMUnavailableError, ResilientLLM
+
+MESSAGES = [HumanMessage(content="Que faire à Nice ?")]
+
+
+def network_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+class ScriptedModel:
+    """Modèle de test : chaque appel suit le scénario suivant (délai, réponse ou exception)."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def _next(self):
+        step = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        return step
+
+    async def ainvoke(self, messages):
+        delay, outcome = self._next()
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return AIMessage(content=outcome)
+
+    async def astream(self, messages):
+        delay, outcome = self._next()
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        for word in outcome.split():
+            yield AIMessageChunk(content=word)
+
+
+def resilient(*models, **options):
+    options.setdefault("timeout", 1.0)
+    options.setdefault("total_timeout", 5.0)
+    options.setdefault("max_retries", 2)
+    options.setdefault("retry_base_delay", 0)
+    options.setdefault("hedging", False)
+    return ResilientLLM([(f"modele-{i}", model) for i, model in enumerate(models)], **options)
+
+
+@pytest.mark.asyncio
+async def test_nouvelle_tentative_apres_erreur_transitoire():
+    model = ScriptedModel((0, network_error()), (0, "Bonjour"))
+
+    response = await resilient(model).ainvoke(MESSAGES)
+
+    assert response.content == "Bonjour"
+    assert model.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_timeout_puis_repli_sur_le_second_modele():
+    slow = ScriptedModel((10, "trop tard"))
+    fallback = ScriptedModel((0, "Réponse du repli"))
+
+    response = await resilient(slow, fallback, timeout=0.05, max_retries=1).ainvoke(MESSAGES)
+
+    assert response.content == "Réponse du repli"
+    assert slow.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_erreur_non_transitoire_sans_nouvel_essai():
+    model = ScriptedModel((0, ValueError("requête invalide")))
+
+    with pytest.raises(ValueError):
+        await resilient(model).ainvoke(MESSAGES)
+    assert model.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_erreur_non_transitoire_ne_referme_pas_le_disjoncteur():
+    model = ScriptedModel((0, ValueError("requête invalide")))
+    llm = resilient(model, max_retries=0)
+    breaker = llm.breakers["modele-0"] = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+    breaker.record_failure()
+    await asyncio.sleep(0.02)
+
+    with pytest.raises(ValueError):
+        await llm.ainvoke(MESSAGES)
+
+    assert breaker.state == "half_open"
+    assert breaker.failures == 1
+    assert breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_hedging_la_requete_doublee_gagne():
+    model = ScriptedModel((10, "lente"), (0, "rapide"))
+
+    llm = resilient(model, hedging=True, hedge_after=0.05)
+    response = await asyncio.wait_for(llm.ainvoke(MESSAGES), timeout=0.5)
+
+    assert response.content == "rapide"
+    assert model.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_disjoncteur_ouvert_evite_le_modele_en_panne():
+    failing = ScriptedModel((0, network_error()))
+    fallback = ScriptedModel((0, "Réponse du repli"))
+    llm = resilient(failing, fallback, max_retries=0)
+    llm.breakers["modele-0"] = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+
+    for _ in range(3):
+        assert (await llm.ainvoke(MESSAGES)).content == "Réponse du repli"
+
+    assert failing.calls == 2
+    assert llm.breakers["modele-0"].state == "open"
+
+
+@pytest.mark.asyncio
+async def test_appel_d_essai_annule_ne_bloque_pas_le_disjoncteur():
+    model = ScriptedModel((10, "Trop tard"), (0, "Bonjour"))
+    llm = resilient(model, max_retries=0)
+    breaker = llm.breakers["modele-0"] = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+    breaker.record_failure()
+    await asyncio.sleep(0.02)
+    assert breaker.state == "half_open"
+
+    trial = asyncio.ensure_future(llm.ainvoke(MESSAGES))
+    await asyncio.sleep(0.05)
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+
+    assert (await llm.ainvoke(MESSAGES)).content == "Bonjour"
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_tous_les_modeles_indisponibles():
+    llm = resilient(ScriptedModel((0, network_error())), max_retries=1)
+
+    with pytest.raises(LLMUnavailableError):
+        await llm.ainvoke(MESSAGES)
+
+
+@pytest.mark.asyncio
+async def test_streaming_nouvel_essai_avant_le_premier_token():
+    model = ScriptedModel((0, network_error()), (0, "Nice est superbe"))
+
+    chunks = [chunk.content async for chunk in resilient(model).astream(MESSAGES)]
+
+    assert chunks == ["Nice", "est", "superbe"]
+    assert model.calls == 2
+
+
+class StallingModel:
+    """Modèle de test dont le flux s'arrête de répondre après le premier token."""
+
+    async def astream(self, messages):
+        yield AIMessageChunk(content="Nice")
+        await asyncio.sleep(10)
+        yield AIMessageChunk(content="trop tard")
+
+
+@pytest.mark.asyncio
+async def test_streaming_bloque_apres_le_premier_token():
+    chunks = []
+
+    with pytest.raises(LLMUnavailableError):
+        async for chunk in resilient(StallingModel(), timeout=0.05).astream(MESSAGES):
+            chunks.append(chunk.content)
+
+    assert chunks == ["Nice"]
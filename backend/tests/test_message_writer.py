@@ -0,0 +1,107 @@
+"""
+Tests de l'écriture différée des messages (write-behind).
+"""
+import asyncio
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.services.chatbot_service import ChatbotService
+from app.services.langchain_service import LangChainService
+from app.services.message_writer import MessageWriter, message_row
+from tests.conftest import TestSessionLocal
+
+
+async def _conversation_id(db_session, user):
+    service = ChatbotService(db_session)
+    conversation = await service.conversation_repository.create_conversation(user.id)
+    return conversation.id
+
+
+@pytest.mark.asyncio
+async def test_tours_en_file_ecrits_en_un_seul_insert(db_session, user, query_counter):
+    conversation_id = await _conversation_id(db_session, user)
+    writer = MessageWriter(TestSessionLocal)
+    for index in range(3):
+        await writer.enqueue([
+            message_row(conversation_id, f"Question {index}", False),
+            message_row(conversation_id, f"Réponse {index}", True),
+        ])
+    assert writer.pending(conversation_id) == 6
+
+    query_counter.reset()
+    writer.start()
+    await writer.aclose()
+
+    inserts = [q for q in query_counter.statements if q.startswith("INSERT")]
+    assert len(inserts) == 1 and query_counter.commits == 1
+    assert writer.pending() == 0 and writer.written == 6
+    messages = await ChatbotService(db_session).conversation_repository.get_messages(conversation_id)
+    assert [m.content for m in messages] == [
+        "Question 0", "Réponse 0", "Question 1", "Réponse 1", "Question 2", "Réponse 2"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_file_pleine_fait_attendre(db_session, user):
+    """Mémoire bornée : au-delà de max_pending tours, enqueue() attend que la file se vide."""
+    conversation_id = await _conversation_id(db_session, user)
+    writer = MessageWriter(TestSessionLocal, max_pending=1)
+    await writer.enqueue([message_row(conversation_id, "Premier", False)])
+
+    blocked = asyncio.create_task(writer.enqueue([message_row(conversation_id, "Second", False)]))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+
+    writer.start()
+    await asyncio.wait_for(blocked, timeout=2)
+    await writer.aclose()
+    assert writer.written == 2
+
+
+@pytest.mark.asyncio
+async def test_tour_invalide_ne_fait_pas_perdre_le_lot(db_session, user):
+    """Une clé d'idempotence en double fait échouer son tour, pas les autres tours du lot."""
+    conversation_id = await _conversation_id(db_session, user)
+    writer = MessageWriter(TestSessionLocal)
+    await writer.enqueue([message_row(conversation_id, "A", True, idempotency_key="clé")])
+    await writer.enqueue([message_row(conversation_id, "B", True, idempotency_key="clé")])
+    await writer.enqueue([message_row(conversation_id, "C", True)])
+
+    writer.start()
+    await writer.aclose()
+
+    assert (writer.written, writer.dropped) == (2, 1)
+    messages = await ChatbotService(db_session).conversation_repository.get_messages(conversation_id)
+    assert [m.content for m in messages] == ["A", "C"]
+
+
+@pytest.mark.asyncio
+async def test_lecture_de_ses_propres_ecritures(user, monkeypatch):
+    """Le tour suivant et GET /api/conversations/{id} voient les messages encore en file."""
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        return f"Réponse à {message} ({len(conversation_history or [])} messages d'historique)"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    writer = MessageWriter(TestSessionLocal)
+    writer.start()
+    app.state.message_writer = writer
+    try:
+        async with TestSessionLocal() as db:
+            service = ChatbotService(db, LangChainService(), message_writer=writer)
+            first = await service.process_message(user.id, "Bonjour", idempotency_key="k1")
+            replay = await service.get_stored_reply("k1")
+            second = await service.process_message(user.id, "Et Lyon ?", first.conversation_id)
+
+        assert replay.replayed and replay.response == first.response
+        assert second.response.endswith("(2 messages d'historique)")
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(f"/api/conversations/{first.conversation_id}")
+        assert [m["content"] for m in response.json()["messages"]] == [
+            "Bonjour", first.response, "Et Lyon ?", second.response
+        ]
+    finally:
+        del app.state.message_writer
+        await writer.aclose()
@@ -0,0 +1,47 @@
+"""
+Tests des métriques : /metrics et en-tête Server-Timing.
+"""
+import pytest
+from httpx import AsyncClient, ASGITransport
+from prometheus_client import REGISTRY
+
+from app.main import app
+from app.core.metrics import server_timing_header
+from app.services.langchain_service import LangChainService
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_format_server_timing():
+    header = server_timing_header([("history", 0.0012), ("llm", 0.8)], 0.85)
+
+    assert header == "history;dur=1.2, llm;dur=800.0, app;dur=850.0"
+
+
+@pytest.mark.asyncio
+async def test_chat_mesure_chaque_etape(monkeypatch):
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        return "Réponse"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    llm_calls = _sample("travelbot_chat_stage_seconds_count", stage="llm")
+    completion_tokens = _sample("travelbot_llm_tokens_total", kind="completion")
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/api/chat", json={"message": "Bonjour", "user_id": 1})
+        metrics = await client.get("/metrics")
+
+    stages = [entry.split(";")[0] for entry in response.headers["server-timing"].split(", ")]
+    # Question enregistrée avant l'appel au modèle (un commit), puis la réponse (un second commit)
+    assert stages == ["history", "conversation", "user_message", "commit", "cache", "llm", "commit", "bot_message", "app"]
+
+    assert _sample("travelbot_chat_stage_seconds_count", stage="llm") == llm_calls + 1
+    assert _sample("travelbot_llm_tokens_total", kind="completion") > completion_tokens
+    assert _sample(
+        "travelbot_http_request_duration_seconds_count",
+        method="POST", route="/api/chat", status="200"
+    ) >= 1
+    assert metrics.status_code == 200
+    assert "travelbot_db_pool_checkout_wait_seconds_bucket" in metrics.text
@@ -0,0 +1,84 @@
+"""
+Tests des migrations Alembic : elles produisent le schéma des modèles.
+"""
+import asyncio
+import os
+
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+
+from app.core.database import Base, create_engine_for_url, run_migrations
+from app.models.message import include_in_autogenerate
+
+MIGRATIONS_DATABASE_URL = "sqlite:///./test_migrations.db"
+
+# Schéma créé par l'ancien create_all au démarrage (avant Alembic), avec des données
+BASELINE_SCHEMA = [
+    "CREATE TABLE users (id INTEGER NOT NULL, email VARCHAR NOT NULL, name VARCHAR NOT NULL, "
+    "created_at DATETIME NOT NULL, PRIMARY KEY (id))",
+    "CREATE INDEX ix_users_id ON users (id)",
+    "CREATE UNIQUE INDEX ix_users_email ON users (email)",
+    "CREATE TABLE conversations (id INTEGER NOT NULL, user_id INTEGER NOT NULL, client_id INTEGER NOT NULL, "
+    "created_at DATETIME NOT NULL, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE)",
+    "CREATE INDEX ix_conversations_id ON conversations (id)",
+    "CREATE INDEX ix_conversations_user_id ON conversations (user_id)",
+    "CREATE INDEX ix_conversations_client_id ON conversations (client_id)",
+    "CREATE TABLE messages (id INTEGER NOT NULL, conversation_id INTEGER NOT NULL, content TEXT NOT NULL, "
+    "is_bot BOOLEAN NOT NULL, created_at DATETIME NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(conversation_id) REFERENCES conversations (id) ON DELETE CASCADE)",
+    "CREATE INDEX ix_messages_id ON messages (id)",
+    "CREATE INDEX ix_messages_conversation_id ON messages (conversation_id)",
+    "CREATE INDEX ix_messages_created_at ON messages (created_at)",
+    "INSERT INTO users VALUES (1, 'demo@travelbot.local', 'Demo', '2024-01-01 00:00:00')",
+    "INSERT INTO conversations VALUES (1, 1, 1, '2024-01-01 00:00:00')",
+    "INSERT INTO messages VALUES (1, 1, 'Que faire à Nice ?', 0, '2024-01-01 00:00:00')",
+]
+
+
+async def _inspect(callback, statements=()):
+    engine = create_engine_for_url(MIGRATIONS_DATABASE_URL)
+    try:
+        async with engine.begin() as conn:
+            for statement in statements:
+                await conn.exec_driver_sql(statement)
+            return await conn.run_sync(callback)
+    finally:
+        await engine.dispose()
+
+
+def _diff(sync_conn):
+    context = MigrationContext.configure(sync_conn, opts={"include_name": include_in_autogenerate})
+    return compare_metadata(context, Base.metadata)
+
+
+def _version(sync_conn):
+    return MigrationContext.configure(sync_conn).get_current_revision()
+
+
+def test_migrations_identiques_aux_modeles():
+    try:
+        run_migrations(MIGRATIONS_DATABASE_URL)
+        assert asyncio.run(_inspect(_diff)) == []
+        # Deuxième lancement (autre déploiement) : rien à faire
+        run_migrations(MIGRATIONS_DATABASE_URL)
+    finally:
+        os.remove("test_migrations.db")
+
+
+def _messages(sync_conn):
+    return sync_conn.exec_driver_sql("SELECT id, content, token_count, idempotency_key FROM messages").all()
+
+
+def test_base_creee_avant_alembic_est_versionnee():
+    """
+    Une base créée par l'ancien create_all est marquée à la révision initiale
+    puis mise à jour : nouvelles colonnes et index ajoutés, données conservées.
+    """
+    try:
+        asyncio.run(_inspect(lambda sync_conn: None, BASELINE_SCHEMA))
+        run_migrations(MIGRATIONS_DATABASE_URL)
+        assert asyncio.run(_inspect(_version)) is not None
+        assert asyncio.run(_inspect(_diff)) == []
+        assert asyncio.run(_inspect(_messages)) == [(1, "Que faire à Nice ?", None, None)]
+    finally:
+        os.remove("test_migrations.db")
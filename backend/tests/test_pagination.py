@@ -0,0 +1,87 @@
+"""
+Tests de la pagination par curseur (conversations et messages).
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.core.pagination import decode_cursor, encode_cursor
+from app.models import Conversation, Message
+
+
+def test_cursor_aller_retour():
+    created_at = datetime(2024, 2, 1, 10, 30, tzinfo=timezone.utc)
+    cursor = decode_cursor(encode_cursor(created_at, 42, "before"))
+
+    assert (cursor.created_at, cursor.id, cursor.direction) == (created_at, 42, "before")
+    with pytest.raises(ValueError):
+        decode_cursor("pas-un-curseur")
+
+
+async def _seed_messages(db_session, user, count):
+    conversation = Conversation(user_id=user.id)
+    db_session.add(conversation)
+    await db_session.flush()
+    start = datetime.now(timezone.utc)
+    # Deux messages par seconde : les égalités de created_at sont départagées par l'id
+    db_session.add_all([
+        Message(conversation_id=conversation.id, content=f"m{i}", created_at=start + timedelta(seconds=i // 2))
+        for i in range(count)
+    ])
+    await db_session.commit()
+    return conversation.id
+
+
+@pytest.mark.asyncio
+async def test_pagination_des_messages_dans_les_deux_sens(db_session, user):
+    conversation_id = await _seed_messages(db_session, user, 25)
+    url = f"/api/conversations/{conversation_id}/messages"
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        # Sans curseur : les plus récents
+        page = (await client.get(url, params={"limit": 10})).json()
+        assert [m["content"] for m in page["items"]] == [f"m{i}" for i in range(15, 25)]
+        assert page["newer_cursor"] is None
+
+        # On remonte vers les plus anciens jusqu'au début
+        seen = [m["content"] for m in page["items"]]
+        while page["older_cursor"]:
+            page = (await client.get(url, params={"limit": 10, "cursor": page["older_cursor"]})).json()
+            seen = [m["content"] for m in page["items"]] + seen
+        assert seen == [f"m{i}" for i in range(25)]
+        assert [m["content"] for m in page["items"]] == [f"m{i}" for i in range(5)]
+
+        # Puis on redescend vers les plus récents
+        page = (await client.get(url, params={"limit": 10, "cursor": page["newer_cursor"]})).json()
+        assert [m["content"] for m in page["items"]] == [f"m{i}" for i in range(5, 15)]
+        assert page["older_cursor"] is not None
+
+        invalid = await client.get(url, params={"cursor": "invalide"})
+        missing = await client.get("/api/conversations/9999/messages")
+
+    assert invalid.status_code == 400
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_pagination_des_conversations(db_session, user):
+    start = datetime.now(timezone.utc)
+    db_session.add_all([
+        Conversation(user_id=user.id, created_at=start + timedelta(minutes=i))
+        for i in range(5)
+    ])
+    await db_session.commit()
+    url = f"/api/users/{user.id}/conversations"
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = (await client.get(url, params={"limit": 3})).json()
+        second = (await client.get(url, params={"limit": 3, "cursor": first["older_cursor"]})).json()
+
+    first_ids = [c["id"] for c in first["items"]]
+    second_ids = [c["id"] for c in second["items"]]
+    assert first_ids == [5, 4, 3]
+    assert second_ids == [2, 1]
+    assert second["older_cursor"] is None
+    assert second["newer_cursor"] is not None
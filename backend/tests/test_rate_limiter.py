@@ -0,0 +1,86 @@
+"""
+Tests de la limitation de débit (seau à jetons par utilisateur, plafond global).
+"""
+import asyncio
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.services.langchain_service import LangChainService
+from app.services.rate_limiter import (
+    ConcurrencyLimiter,
+    InMemoryRateLimitStore,
+    RateLimitExceeded,
+    UserRateLimiter,
+)
+
+
+@pytest.mark.asyncio
+async def test_seau_a_jetons_attente_puis_refus():
+    store = InMemoryRateLimitStore()
+    # 2 jetons, 1 jeton par seconde, 1,5 s d'attente maximum
+    reservations = [await store.reserve("user:1", rate=1.0, capacity=2, max_wait=1.5) for _ in range(4)]
+
+    assert [allowed for allowed, _ in reservations] == [True, True, True, False]
+    assert reservations[0][1] == 0 and reservations[1][1] == 0
+    assert reservations[2][1] == pytest.approx(1.0, abs=0.05)
+    assert reservations[3][1] == pytest.approx(2.0, abs=0.05)
+    # Les seaux sont indépendants par utilisateur
+    assert await store.reserve("user:2", rate=1.0, capacity=2, max_wait=0) == (True, 0.0)
+
+
+@pytest.mark.asyncio
+async def test_plafond_de_concurrence():
+    limiter = ConcurrencyLimiter(max_concurrency=1, queue_timeout=0.05)
+
+    async with limiter.slot():
+        with pytest.raises(RateLimitExceeded):
+            async with limiter.slot():
+                pass
+
+    async with limiter.slot():
+        pass
+
+
+@pytest.mark.asyncio
+async def test_api_repond_429_avec_retry_after(monkeypatch, user):
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        return "Réponse"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    monkeypatch.setattr(
+        app.state, "user_rate_limiter",
+        UserRateLimiter(per_minute=1, burst=1, max_wait_seconds=0),
+        raising=False
+    )
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.post("/api/chat", json={"message": "Bonjour", "user_id": 1})
+        second = await client.post("/api/chat", json={"message": "Encore", "user_id": 1})
+        other_user = await client.post("/api/chat", json={"message": "Bonjour", "user_id": user.id})
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert second.headers["retry-after"] == "60"
+    assert other_user.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_appel_modele_sature(monkeypatch):
+    service = LangChainService(concurrency_limiter=ConcurrencyLimiter(max_concurrency=1, queue_timeout=0.01))
+    release = asyncio.Event()
+
+    async def slow_invoke(messages):
+        await release.wait()
+        return type("Response", (), {"content": "ok"})()
+
+    monkeypatch.setattr(service, "llm", type("LLM", (), {"ainvoke": staticmethod(slow_invoke)})())
+    first = asyncio.create_task(service.get_response("Bonjour"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(RateLimitExceeded):
+        await service.get_response("Bonjour")
+    release.set()
+    assert await first == "ok"
+    await service.aclose()
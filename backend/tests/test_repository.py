@@ -0,0 +1,94 @@
+"""
+Tests du ConversationRepository (couche d'accès aux données asynchrone).
+"""
+import asyncio
+
+import pytest
+
+from app.models import User
+from app.repositories.conversation_repository import ConversationRepository
+
+
+async def _create_user(db) -> User:
+    user = User(email="test@travelbot.local", name="Test")
+    db.add(user)
+    await db.commit()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_create_and_get_conversation(db_session):
+    """Une conversation créée peut être relue par son ID."""
+    user = await _create_user(db_session)
+    repository = ConversationRepository(db_session)
+
+    conversation = await repository.create_conversation(user.id)
+    found = await repository.get_conversation(conversation.id)
+
+    assert found is not None
+    assert found.user_id == user.id
+    assert await repository.get_conversation(9999) is None
+
+
+@pytest.mark.asyncio
+async def test_conversation_history_format(db_session):
+    """L'historique est retourné au format attendu par LangChain."""
+    user = await _create_user(db_session)
+    repository = ConversationRepository(db_session)
+    conversation = await repository.create_conversation(user.id)
+
+    await repository.add_message(conversation.id, "Bonjour", is_bot=False)
+    await asyncio.sleep(0.01)
+    await repository.add_message(conversation.id, "Salut !", is_bot=True)
+
+    history = await repository.get_conversation_history(conversation.id)
+
+    assert history == [
+        {"role": "user", "content": "Bonjour"},
+        {"role": "assistant", "content": "Salut !"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_delete_conversation(db_session):
+    """La suppression d'une conversation supprime aussi ses messages."""
+    user = await _create_user(db_session)
+    repository = ConversationRepository(db_session)
+    conversation = await repository.create_conversation(user.id)
+    await repository.add_message(conversation.id, "Bonjour")
+
+    assert await repository.delete_conversation(conversation.id) is True
+    assert await repository.get_messages(conversation.id) == []
+    assert await repository.delete_conversation(conversation.id) is False
+
+
+@pytest.mark.asyncio
+async def test_get_or_create_user(db_session):
+    """get_or_create_user ne crée pas de doublon pour un même email."""
+    repository = ConversationRepository(db_session)
+
+    first = await repository.get_or_create_user("voyageur@travelbot.local")
+    second = await repository.get_or_create_user("voyageur@travelbot.local")
+
+    assert first.id == second.id
+
+
+@pytest.mark.asyncio
+async def test_history_retourne_les_derniers_messages(db_session):
+    """L'historique contient les N messages les plus récents, en ordre chronologique."""
+    from datetime import datetime, timedelta, timezone
+    from app.models import Message
+
+    user = await _create_user(db_session)
+    repository = ConversationRepository(db_session)
+    conversation = await repository.create_conversation(user.id)
+    start = datetime.now(timezone.utc)
+    db_session.add_all([
+        Message(conversation_id=conversation.id, content=f"message {i}", created_at=start + timedelta(seconds=i))
+        for i in range(25)
+    ])
+    await db_session.commit()
+
+    history = await repository.get_conversation_history(conversation.id, limit=10)
+
+    assert [item["content"] for item in history] == [f"message {i}" for i in range(15, 25)]
@@ -0,0 +1,119 @@
+"""
+Tests du cache de réponses (LRU, TTL, invalidation, similarité sémantique).
+"""
+import asyncio
+
+import pytest
+
+from app.services.chatbot_service import ChatbotService
+from app.services.langchain_service import LangChainService
+from app.services.response_cache import ResponseCache, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  Meilleures ACTIVITÉS à Nice ?! ") == "meilleures activites a nice"
+
+
+@pytest.mark.asyncio
+async def test_hit_sur_question_normalisee():
+    cache = ResponseCache(max_entries=10, ttl_seconds=60)
+    lookup = await cache.lookup("Meilleures activités à Nice ?")
+    assert lookup.response is None
+    await cache.store(lookup, "La promenade des Anglais !")
+
+    hit = await cache.lookup("meilleures activites a nice")
+
+    assert hit.response == "La promenade des Anglais !"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_expiration_ttl(monkeypatch):
+    import app.services.response_cache as response_cache_module
+
+    now = [1000.0]
+    monkeypatch.setattr(response_cache_module.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(max_entries=10, ttl_seconds=60)
+    await cache.store(await cache.lookup("Nice"), "Réponse")
+
+    now[0] += 61
+
+    assert (await cache.lookup("Nice")).response is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_eviction_lru_et_invalidation():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    for question in ["Nice", "Lyon"]:
+        await cache.store(await cache.lookup(question), f"Réponse {question}")
+    await cache.lookup("Nice")  # Nice devient la plus récemment utilisée
+    await cache.store(await cache.lookup("Paris"), "Réponse Paris")
+
+    assert (await cache.lookup("Lyon")).response is None
+    assert (await cache.lookup("Nice")).response == "Réponse Nice"
+    assert cache.stats()["evictions"] == 1
+
+    assert cache.invalidate("NICE") is True
+    assert cache.invalidate("Nice") is False
+
+
+@pytest.mark.asyncio
+async def test_similarite_semantique():
+    vectors = {
+        "meilleures activites a nice": [1.0, 0.0, 0.1],
+        "que faire a nice": [0.98, 0.0, 0.15],
+        "ou manger a lyon": [0.0, 1.0, 0.0],
+    }
+
+    async def fake_embedder(text):
+        return vectors[text]
+
+    cache = ResponseCache(max_entries=10, ttl_seconds=60, embedder=fake_embedder, similarity_threshold=0.95)
+    await cache.store(await cache.lookup("Meilleures activités à Nice"), "Réponse Nice")
+
+    assert (await cache.lookup("Que faire à Nice ?")).response == "Réponse Nice"
+    assert (await cache.lookup("Où manger à Lyon ?")).response is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_embedding_en_echec_ou_trop_lent_traite_comme_un_miss():
+    async def failing_embedder(text):
+        raise RuntimeError("API indisponible")
+
+    async def slow_embedder(text):
+        await asyncio.sleep(10)
+        return [1.0, 0.0]
+
+    for embedder in (failing_embedder, slow_embedder):
+        cache = ResponseCache(max_entries=10, ttl_seconds=60, embedder=embedder, embed_timeout_seconds=0.05)
+        lookup = await cache.lookup("Que faire à Nice ?")
+        assert lookup.response is None and lookup.vector is None
+        await cache.store(lookup, "Réponse Nice")
+
+        # Enregistrée sans vecteur : la clé exacte reste servie
+        assert (await cache.lookup("que faire a nice")).response == "Réponse Nice"
+        assert cache.stats()["embed_errors"] == 2
+
+
+@pytest.mark.asyncio
+async def test_hit_sauvegarde_le_message_sans_appel_llm(db_session, user, monkeypatch):
+    calls = []
+
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        calls.append(message)
+        return "Réponse du modèle"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    service = ChatbotService(db_session, LangChainService(), ResponseCache(max_entries=10, ttl_seconds=60))
+
+    first = await service.process_message(user.id, "Que faire à Nice ?")
+    second = await service.process_message(user.id, "que faire a nice")
+
+    assert calls == ["Que faire à Nice ?"]
+    assert (first.cached, second.cached) == (False, True)
+    assert second.response == "Réponse du modèle"
+    messages = await service.conversation_repository.get_messages(second.conversation_id)
+    assert [(m.is_bot, m.content) for m in messages] == [(False, "que faire a nice"), (True, "Réponse du modèle")]
@@ -0,0 +1,81 @@
+"""
+Tests de la suppression en cascade par la base et du job de rétention.
+"""
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select
+
+from app.models import Conversation, Message
+from app.repositories.conversation_repository import ConversationRepository
+from app.services.retention import archive_expired_conversations, partition_bounds
+from tests.conftest import TestSessionLocal
+
+
+async def _count_messages(db, conversation_id):
+    return await db.scalar(select(func.count()).where(Message.conversation_id == conversation_id))
+
+
+@pytest.mark.asyncio
+async def test_suppression_sans_charger_les_messages(db_session, user, query_counter):
+    repository = ConversationRepository(db_session)
+    conversation = await repository.create_conversation(user.id)
+    for i in range(5):
+        await repository.add_message(conversation.id, f"Message {i}")
+
+    query_counter.reset()
+    assert await repository.delete_conversation(conversation.id) is True
+
+    # Un DELETE de la conversation, les messages sont supprimés par ON DELETE CASCADE
+    assert [q.split()[0] for q in query_counter.statements] == ["DELETE"]
+    assert await _count_messages(db_session, conversation.id) == 0
+
+
+@pytest.mark.asyncio
+async def test_archive_et_supprime_les_conversations_inactives(db_session, user, tmp_path):
+    now = datetime.now(timezone.utc)
+    old = now - timedelta(days=400)
+
+    repository = ConversationRepository(db_session)
+    expired = []
+    for i in range(3):
+        conversation = await repository.create_conversation(user.id)
+        conversation.created_at = old
+        await repository.add_message(conversation.id, f"Bonjour {i}", created_at=old)
+        await repository.add_message(conversation.id, f"Réponse {i}", is_bot=True, created_at=old + timedelta(seconds=1))
+        expired.append(conversation.id)
+    # Ancienne mais encore active, et récente : gardées
+    active = await repository.create_conversation(user.id)
+    active.created_at = old
+    await repository.add_message(active.id, "Ancien", created_at=old)
+    await repository.add_message(active.id, "Récent", created_at=now)
+    recent = await repository.create_conversation(user.id)
+    await db_session.commit()
+
+    report = await archive_expired_conversations(TestSessionLocal, now - timedelta(days=365), tmp_path, batch_size=2)
+
+    assert (report.conversations, report.messages, len(report.archives)) == (3, 6, 2)
+    archived = []
+    for path in report.archives:
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            archived += [json.loads(line) for line in archive]
+    assert [c["id"] for c in archived] == expired
+    assert [m["content"] for m in archived[0]["messages"]] == ["Bonjour 0", "Réponse 0"]
+    assert list(tmp_path.glob("*.part")) == []
+
+    remaining = (await db_session.execute(select(Conversation.id).order_by(Conversation.id))).scalars().all()
+    assert remaining == [active.id, recent.id]
+    assert await _count_messages(db_session, expired[0]) == 0
+    assert await _count_messages(db_session, active.id) == 2
+
+
+def test_bornes_des_partitions_mensuelles():
+    name, start, end = partition_bounds(datetime(2024, 12, 15, 23, 30, tzinfo=timezone.utc))
+
+    assert name == "messages_p202412"
+    assert (start, end) == (
+        datetime(2024, 12, 1, tzinfo=timezone.utc),
+        datetime(2025, 1, 1, tzinfo=timezone.utc),
+    )
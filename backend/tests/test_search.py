@@ -0,0 +1,84 @@
+"""
+Tests de la recherche plein texte dans l'historique (FTS5 sur SQLite).
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import text
+
+from app.main import app
+from app.repositories.conversation_repository import ConversationRepository
+from app.repositories.message_search import MessageSearchRepository, fts5_query
+
+
+def test_requete_fts5_sans_operateurs():
+    assert fts5_query('Un hôtel "pas cher" OR NEAR(', 7) == (
+        'owner : "u7" AND content : (("hôtel" OR "hôtels") AND ("cher" OR "chers") AND ("or" OR "ors") AND ("near" OR "nears"))'
+    )
+    # Que des mots vides : ils sont gardés
+    assert fts5_query("à la", 7) == 'owner : "u7" AND content : (("à" OR "às") AND ("la" OR "las"))'
+    assert fts5_query("?!", 7) is None
+
+
+@pytest.mark.asyncio
+async def test_recherche_classee_avec_extrait_et_contexte(db_session, user, query_counter):
+    repository = ConversationRepository(db_session)
+    last_month = datetime.now(timezone.utc) - timedelta(days=30)
+    lyon = await repository.create_conversation(user.id)
+    await repository.add_message(lyon.id, "Quel hôtel me conseilles-tu à Lyon ?", created_at=last_month)
+    await repository.add_message(
+        lyon.id, "À Lyon, l'hôtel Carlton est très bien placé, près de la place Bellecour.",
+        is_bot=True, created_at=last_month + timedelta(seconds=5)
+    )
+    nice = await repository.create_conversation(user.id)
+    await repository.add_message(nice.id, "Des hôtels à Nice ?")
+    # Autre utilisateur : jamais dans les résultats
+    other = await repository.create_conversation(1)
+    await repository.add_message(other.id, "Un hôtel à Lyon pas cher ?")
+
+    query_counter.reset()
+    hits = await MessageSearchRepository(db_session).search(user.id, "hotel lyon")
+
+    assert len(query_counter.statements) == 1
+    assert [hit.conversation_id for hit in hits] == [lyon.id, lyon.id]
+    bot_hit = next(hit for hit in hits if hit.is_bot)
+    assert "<mark>hôtel</mark>" in bot_hit.snippet and "<mark>Lyon</mark>" in bot_hit.snippet
+    assert bot_hit.previous_message == "Quel hôtel me conseilles-tu à Lyon ?"
+
+    # Préfixes : "hôtel" trouve "hôtels" ; filtre par période
+    recent = await MessageSearchRepository(db_session).search(
+        user.id, "hôtel", since=datetime.now(timezone.utc) - timedelta(days=1)
+    )
+    assert [hit.conversation_id for hit in recent] == [nice.id]
+
+
+@pytest.mark.asyncio
+async def test_index_suit_les_suppressions(db_session, user):
+    repository = ConversationRepository(db_session)
+    conversation = await repository.create_conversation(user.id)
+    await repository.add_message(conversation.id, "Musée des Confluences à Lyon")
+    assert len(await MessageSearchRepository(db_session).search(user.id, "musée")) == 1
+
+    await repository.delete_conversation(conversation.id)
+
+    # Les triggers retirent de l'index les messages supprimés en cascade
+    indexed = await db_session.scalar(text("SELECT count(*) FROM messages_fts WHERE messages_fts MATCH 'musee'"))
+    assert indexed == 0
+
+
+@pytest.mark.asyncio
+async def test_api_recherche(db_session, user):
+    repository = ConversationRepository(db_session)
+    conversation = await repository.create_conversation(user.id)
+    await repository.add_message(conversation.id, "Le Vieux-Port de Marseille au coucher du soleil")
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get(f"/api/users/{user.id}/messages/search", params={"q": "marseille"})
+        empty = await client.get(f"/api/users/{user.id}/messages/search", params={"q": ""})
+
+    assert response.status_code == 200
+    hits = response.json()["hits"]
+    assert [h["conversation_id"] for h in hits] == [conversation.id]
+    assert "<mark>Marseille</mark>" in hits[0]["snippet"] and hits[0]["previous_message"] is None
+    assert empty.status_code == 422
@@ -0,0 +1,253 @@
+"""
+Tests de la déduplication : single-flight et en-tête Idempotency-Key.
+"""
+import asyncio
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.services.chatbot_service import ChatbotService, TurnInProgressError
+from app.services.langchain_service import LangChainService
+from app.services.llm_resilience import LLMUnavailableError
+from app.services.single_flight import SingleFlight
+from tests.conftest import TestSessionLocal
+
+
+async def _wait_until(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition jamais atteinte")
+
+
+@pytest.mark.asyncio
+async def test_single_flight_partage_resultat_et_erreur():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "résultat"
+
+    results = await asyncio.gather(flight.do("clé", work), flight.do("clé", work))
+    assert results == [("résultat", False), ("résultat", True)]
+    assert calls == 1 and flight.in_flight() == 0
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("échec")
+
+    outcomes = await asyncio.gather(flight.do("clé", fail), flight.do("clé", fail), return_exceptions=True)
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+
+
+@pytest.mark.asyncio
+async def test_questions_identiques_en_parallele_un_seul_appel(db_session, user, monkeypatch):
+    release = asyncio.Event()
+    calls = 0
+
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "Réponse unique"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    conversation = await ChatbotService(db_session).conversation_repository.create_conversation(user.id)
+    flight = SingleFlight()
+
+    async def send(message):
+        async with TestSessionLocal() as db:
+            service = ChatbotService(db, LangChainService(), single_flight=flight)
+            return await service.process_message(user.id, message, conversation.id)
+
+    first = asyncio.create_task(send("Que faire à Nice ?"))
+    await _wait_until(lambda: flight.in_flight() == 1)
+    second = asyncio.create_task(send("que faire a nice"))
+    await _wait_until(lambda: flight.shared == 1)
+    release.set()
+
+    results = await asyncio.gather(first, second)
+    messages = await ChatbotService(db_session).conversation_repository.get_messages(conversation.id)
+    assert calls == 1
+    assert results[0] is results[1]
+    assert [m.is_bot for m in messages] == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_premier_appel_annule_un_suivant_reprend():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return f"résultat {calls}"
+
+    first = asyncio.create_task(flight.do("clé", work))
+    await _wait_until(lambda: flight.in_flight() == 1)
+    second = asyncio.create_task(flight.do("clé", work))
+    await _wait_until(lambda: flight.shared == 1)
+    first.cancel()
+
+    assert await second == ("résultat 2", False)
+    assert first.cancelled()
+    assert calls == 2 and flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_premier_message_en_double_une_seule_conversation(db_session, user, monkeypatch):
+    release = asyncio.Event()
+    calls = 0
+
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "Réponse unique"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    flight = SingleFlight()
+
+    async def send():
+        async with TestSessionLocal() as db:
+            service = ChatbotService(db, LangChainService(), single_flight=flight)
+            return await service.process_message(user.id, "Que faire à Nice ?")
+
+    first = asyncio.create_task(send())
+    await _wait_until(lambda: flight.in_flight() == 1)
+    second = asyncio.create_task(send())
+    await _wait_until(lambda: flight.shared == 1)
+    release.set()
+
+    results = await asyncio.gather(first, second)
+    conversations = await ChatbotService(db_session).conversation_repository.get_user_conversations(user.id)
+    assert calls == 1
+    assert results[0] is results[1]
+    assert [conversation.id for conversation in conversations] == [results[0].conversation_id]
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_renvoie_la_reponse_enregistree(monkeypatch):
+    calls = 0
+
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        nonlocal calls
+        calls += 1
+        return f"Réponse {calls}"
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    headers = {"Idempotency-Key": "7f7c2a9e-2f4b-4a55-9d1e-5b8f7a0c1d23"}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.post("/api/chat", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        retry = await client.post("/api/chat", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        replay_stream = await client.post("/api/chat/stream", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        history = await client.get(f"/api/conversations/{first.json()['conversation_id']}")
+
+    assert calls == 1
+    assert retry.json()["response"] == first.json()["response"] == "Réponse 1"
+    assert retry.json()["conversation_id"] == first.json()["conversation_id"]
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert "Réponse 1" in replay_stream.text
+    assert len(history.json()["messages"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_nouvel_essai_apres_503_reprend_le_tour(monkeypatch):
+    """Après un 503, le même envoi reprend sa conversation et son message : seule la réponse est générée."""
+    calls = 0
+
+    async def flaky_get_response(self, message, conversation_history=None, summary=None):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise LLMUnavailableError("Modèle indisponible", retry_after=1)
+        return f"Réponse ({len(conversation_history or [])} messages d'historique)"
+
+    monkeypatch.setattr(LangChainService, "get_response", flaky_get_response)
+    headers = {"Idempotency-Key": "0d6f3c55-1b7e-4c1a-9f0e-3c2b1a9d8e7f"}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        failed = await client.post("/api/chat", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        retry = await client.post("/api/chat", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        replay = await client.post("/api/chat", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        conversations = await client.get("/api/users/1/conversations")
+        history = await client.get(f"/api/conversations/{retry.json()['conversation_id']}")
+
+    assert failed.status_code == 503
+    assert retry.status_code == 200 and retry.json()["response"] == "Réponse (0 messages d'historique)"
+    assert replay.headers["idempotent-replayed"] == "true" and calls == 2
+    # Une seule conversation, un seul message utilisateur
+    assert [c["id"] for c in conversations.json()["items"]] == [retry.json()["conversation_id"]]
+    assert [(m["content"], m["is_bot"]) for m in history.json()["messages"]] == [
+        ("Bonjour", False), ("Réponse (0 messages d'historique)", True)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_flux_interrompu_repris_avec_la_meme_cle(monkeypatch):
+    calls = 0
+
+    async def flaky_stream_response(self, message, conversation_history=None, summary=None):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise LLMUnavailableError("Modèle indisponible", retry_after=1)
+        yield "Réponse"
+
+    monkeypatch.setattr(LangChainService, "stream_response", flaky_stream_response)
+    headers = {"Idempotency-Key": "5e8a1d2c-7b3f-4e6a-8c9d-0f1e2d3c4b5a"}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        failed = await client.post("/api/chat/stream", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        retry = await client.post("/api/chat/stream", json={"message": "Bonjour", "user_id": 1}, headers=headers)
+        conversations = await client.get("/api/users/1/conversations")
+
+    assert "event: error" in failed.text and "event: end" in retry.text
+    conversation_id = conversations.json()["items"][0]["id"]
+    assert len(conversations.json()["items"]) == 1
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        history = await client.get(f"/api/conversations/{conversation_id}")
+    assert [m["content"] for m in history.json()["messages"]] == ["Bonjour", "Réponse"]
+
+
+@pytest.mark.asyncio
+async def test_envoi_concurrent_de_la_meme_cle(db_session, user, monkeypatch):
+    """L'envoi qui perd la course sur la clé ne persiste rien : réponse de l'autre envoi, ou 409 s'il est en cours."""
+    async def fake_get_response(self, message, conversation_history=None, summary=None):
+        return "Réponse"
+
+    find_turn = ChatbotService.find_turn
+    stale_reads = set()
+
+    async def stale_find_turn(self, idempotency_key):
+        # Première lecture de chaque clé faite avant le commit de l'envoi concurrent
+        if idempotency_key not in stale_reads:
+            stale_reads.add(idempotency_key)
+            return None, None
+        return await find_turn(self, idempotency_key)
+
+    monkeypatch.setattr(LangChainService, "get_response", fake_get_response)
+    service = ChatbotService(db_session, LangChainService())
+    first = await service.process_message(user.id, "Bonjour", idempotency_key="k1")
+    conversation_id = first.conversation_id
+    await service.conversation_repository.add_message(conversation_id, "Et Lyon ?", idempotency_key="k2")
+
+    async with TestSessionLocal() as db:
+        late = ChatbotService(db, LangChainService())
+        monkeypatch.setattr(ChatbotService, "find_turn", stale_find_turn)
+        replayed = await late.process_message(user.id, "Bonjour", idempotency_key="k1")
+        with pytest.raises(TurnInProgressError):
+            await late.process_message(user.id, "Et Lyon ?", conversation_id, idempotency_key="k2")
+
+    assert replayed.replayed and replayed.conversation_id == conversation_id
+    assert len(await service.conversation_repository.get_user_conversations(user.id)) == 1
+    messages = await service.conversation_repository.get_messages(conversation_id)
+    assert [m.content for m in messages] == ["Bonjour", "Réponse", "Et Lyon ?"]
@@ -12,6 +12,14 @@ interface Message {
   createdAt: string;
 }
 
+// Nouveaux essais d'un envoi, avec un délai croissant (ou celui de Retry-After)
+const MAX_ATTEMPTS = 3;
+const RETRY_DELAY_MS = 1000;
+// Réponses après lesquelles renvoyer la même requête ne crée pas de doublon :
+// 409 (même clé encore en cours), 429 (refusée avant toute écriture), 503
+// (modèle indisponible : le serveur reprend le tour déjà enregistré sous cette clé)
+const RETRYABLE_STATUSES = [409, 429, 503];
+
 export default function ChatWindow() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [isLoading, setIsLoading] = useState(false);
@@ -39,6 +47,40 @@ export default function ChatWindow() {
     ]);
   }, []);
 
+  // Met à jour le contenu d'un message déjà affiché (utilisé pendant le streaming)
+  const updateMessage = (id: number, content: string, createdAt?: string) => {
+    setMessages(prev =>
+      prev.map(msg =>
+        msg.id === id ? { ...msg, content, createdAt: createdAt ?? msg.createdAt } : msg
+      )
+    );
+  };
+
+  // Envoie la requête ; si le serveur est injoignable ou répond 409/429/503
+  // (avant tout token), la renvoie avec la même clé d'idempotence
+  const postWithRetry = async (body: string, idempotencyKey: string): Promise<Response> => {
+    for (let attempt = 1; ; attempt++) {
+      let delay = RETRY_DELAY_MS * attempt;
+      try {
+        const response = await fetch(`${API_URL}/api/chat/stream`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            "Idempotency-Key": idempotencyKey
+          },
+          body
+        });
+        if (!RETRYABLE_STATUSES.includes(response.status) || attempt >= MAX_ATTEMPTS) return response;
+        const retryAfter = Number(response.headers.get("Retry-After"));
+        if (retryAfter > 0) delay = retryAfter * 1000;
+      } catch (error) {
+        // Erreur réseau : la clé d'idempotence rend le renvoi sans risque de doublon
+        if (attempt >= MAX_ATTEMPTS) throw error;
+      }
+      await new Promise(resolve => setTimeout(resolve, delay));
+    }
+  };
+
   const sendMessage = async (userMessage: string) => {
     // 1. Ajouter le message utilisateur immédiatement dans l'UI
     const newUserMessage: Message = {
@@ -50,47 +92,80 @@ export default function ChatWindow() {
     setMessages(prev => [...prev, newUserMessage]);
     setIsLoading(true);
 
+    const botMessageId = Date.now() + 1;
+    let botContent = "";
+    // Une clé par message, partagée par ses nouveaux essais : si le premier
+    // envoi a abouti côté serveur, le serveur renvoie la réponse déjà enregistrée
+    const idempotencyKey = crypto.randomUUID();
+
     try {
-      // 2. Envoyer la requête au backend
-      const response = await fetch(`${API_URL}/api/chat`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json"
-        },
-        body: JSON.stringify({
+      // 2. Envoyer la requête au backend (réponse en streaming SSE)
+      const response = await postWithRetry(
+        JSON.stringify({
           message: userMessage,
           user_id: 1,                    // Pour l'instant, user_id fixe à 1
           conversation_id: conversationId
-        })
-      });
+        }),
+        idempotencyKey
+      );
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         // En cas d'erreur HTTP, on affiche un message d'erreur
         const errorData = await response.json();
         throw new Error(errorData.detail || "Erreur inconnue");
       }
 
-      // 3. Parser la réponse du backend
-      const data = await response.json();
+      // 3. Lire le flux d'événements au fur et à mesure
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
 
-      // 4. Sauvegarder l'ID de conversation (pour les messages suivants)
-      if (!conversationId) {
-        setConversationId(data.conversation_id);
-      }
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
 
-      // 5. Ajouter la réponse du bot
-      const botMessage: Message = {
-        id: Date.now() + 1,
-        content: data.response,
-        isBot: true,
-        createdAt: data.timestamp
-      };
-      setMessages(prev => [...prev, botMessage]);
+        // Les événements SSE sont séparés par une ligne vide
+        const events = buffer.split("\n\n");
+        buffer = events.pop() ?? "";
+
+        for (const rawEvent of events) {
+          const lines = rawEvent.split("\n");
+          const event = lines.find(line => line.startsWith("event: "))?.slice(7);
+          const dataLine = lines.find(line => line.startsWith("data: "));
+          if (!event || !dataLine) continue;
+          const data = JSON.parse(dataLine.slice(6));
+
+          if (event === "start") {
+            // 4. Sauvegarder l'ID de conversation (pour les messages suivants)
+            if (!conversationId) {
+              setConversationId(data.conversation_id);
+            }
+          } else if (event === "token") {
+            // 5. Afficher la réponse partielle du bot
+            if (!botContent) {
+              setIsLoading(false);
+              setMessages(prev => [...prev, {
+                id: botMessageId,
+                content: "",
+                isBot: true,
+                createdAt: new Date().toISOString()
+              }]);
+            }
+            botContent += data.token;
+            updateMessage(botMessageId, botContent);
+          } else if (event === "end") {
+            updateMessage(botMessageId, botContent, data.timestamp);
+          } else if (event === "error") {
+            throw new Error(data.detail || "Erreur inconnue");
+          }
+        }
+      }
 
     } catch (error) {
       // En cas d'erreur, afficher un message d'erreur dans le chat
       const errorMessage: Message = {
-        id: Date.now() + 1,
+        id: Date.now() + 2,
         content: `❌ Oops ! Une erreur s'est produite : ${error instanceof Error ? error.message : "Erreur inconnue"}. Réessayez.`,
         isBot: true,
         createdAt: new Date().toISOString()